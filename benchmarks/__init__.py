@@ -0,0 +1,21 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+def per_call(func, number=1000, repeat=3):
+    """
+    Best of repeat runs of func, in microseconds per call.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / \
+        number * 1e6
+
+
+def print_table(header, rows):
+    widths = [max(len(str(r[i])) for r in [header] + rows)
+              for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(row, widths)))
@@ -0,0 +1,143 @@
+"""
+Replays the same event stream through every CATTLE_AGENT_MULTI mode.
+
+    python -m benchmarks.bench_concurrency
+
+The stream is the requests in tests/docker/ repeated.  Every worker parses
+the event, waits on a simulated docker call and checksums the event
+through blocking().  The mode is picked when cattle.concurrency is
+imported, so each one runs in its own interpreter.  Modes that can not run
+here are listed with the reason.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import print_table
+
+
+MODES = ['proc', 'thread', 'eventlet', 'asyncio']
+EVENTS = 2000
+WORKERS = 50
+DOCKER_CALL = 0.005
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'docker')
+
+
+def _stream():
+    lines = []
+    for name in sorted(os.listdir(_FIXTURES)):
+        if not name.endswith('_resp'):
+            with open(os.path.join(_FIXTURES, name)) as f:
+                lines.append(json.dumps(json.load(f)))
+    return [lines[i % len(lines)] for i in range(EVENTS)]
+
+
+def _rss_kb(pid):
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+def _worker(queue, done):
+    from cattle.concurrency import blocking
+
+    while True:
+        line = queue.get()
+        if line is None:
+            break
+        json.loads(line)
+        time.sleep(DOCKER_CALL)
+        blocking(lambda: hashlib.sha1(line).hexdigest())
+        done.put(True)
+
+
+def _replay():
+    from cattle import concurrency
+
+    stream = _stream()
+    queue = concurrency.Queue(WORKERS * 5)
+    done = concurrency.Queue()
+    result = {}
+
+    def main():
+        workers = [concurrency.spawn(target=_worker, args=(queue, done))
+                   for i in range(WORKERS)]
+
+        start = time.time()
+        for line in stream:
+            queue.put(line)
+        for line in stream:
+            done.get()
+        result['seconds'] = time.time() - start
+
+        rss = _rss_kb(os.getpid())
+        for worker in workers:
+            if getattr(worker, 'pid', None):
+                rss += _rss_kb(worker.pid)
+        result['rss'] = rss
+
+        for worker in workers:
+            queue.put(None)
+
+    concurrency.run(main)
+    return result
+
+
+def _child(mode):
+    if mode == 'eventlet':
+        try:
+            import eventlet  # NOQA
+        except ImportError:
+            print(json.dumps({'error': 'eventlet is not installed'}))
+            return
+
+    try:
+        result = _replay()
+    except Exception as e:
+        print(json.dumps({'error': str(e)}))
+    else:
+        print(json.dumps(result))
+
+
+def main():
+    home = tempfile.mkdtemp()
+    rows = []
+    for mode in MODES:
+        env = dict(os.environ)
+        env['CATTLE_AGENT_MULTI'] = mode
+        env['CATTLE_HOME'] = home
+        out = subprocess.Popen([sys.executable, '-m',
+                                'benchmarks.bench_concurrency', mode],
+                               env=env, stdout=subprocess.PIPE,
+                               stderr=open(os.devnull, 'w')).communicate()[0]
+        try:
+            result = json.loads(out.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            result = {'error': 'failed'}
+
+        if 'error' in result:
+            rows.append((mode, '-', '-', '-', result['error']))
+        else:
+            rows.append((mode, '%.2f' % result['seconds'],
+                         '%.0f' % (EVENTS / result['seconds']),
+                         '%d' % (result['rss'] / 1024), ''))
+
+    print_table(('mode', 'seconds', 'events/s', 'rss MB', 'note'), rows)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        _child(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,61 @@
+"""
+Collects the cgroup stats of many containers from a fake cgroup tree.
+
+    CATTLE_DOCKER_REQUIRED=false python -m benchmarks.bench_container_stats
+
+The tree is on a temporary directory, like the real cgroup file system the
+files are small and in memory, so this is mostly the cost of opening and
+parsing four files a container.
+"""
+import os
+import shutil
+import tempfile
+
+from benchmarks import per_call, print_table
+
+from cattle.plugins.docker.cgroup_stats import ContainerStats
+
+CONTAINERS = [10, 100, 500]
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _tree(root, ids):
+    for id in ids:
+        path = 'docker/' + id
+        _write(os.path.join(root, 'cpuacct', path, 'cpuacct.usage'),
+               '123456789\n')
+        _write(os.path.join(root, 'memory', path, 'memory.usage_in_bytes'),
+               '1048576\n')
+        _write(os.path.join(root, 'memory', path, 'memory.limit_in_bytes'),
+               '9223372036854771712\n')
+        _write(os.path.join(root, 'blkio', path,
+                            'blkio.throttle.io_service_bytes'),
+               '8:0 Read 4096\n8:0 Write 8192\n8:0 Sync 0\n'
+               '8:0 Async 12288\n8:0 Total 12288\nTotal 12288\n')
+
+
+def main():
+    rows = []
+    for count in CONTAINERS:
+        root = tempfile.mkdtemp()
+        try:
+            ids = ['%064x' % i for i in range(count)]
+            _tree(root, ids)
+            stats = ContainerStats(root)
+            stats.collect(ids)
+            us = per_call(lambda: stats.collect(ids), number=20)
+            rows.append([count, '%.0f' % us, '%.1f' % (us / count)])
+        finally:
+            shutil.rmtree(root)
+
+    print_table(['containers', 'us/collection', 'us/container'], rows)
+
+
+if __name__ == '__main__':
+    main()
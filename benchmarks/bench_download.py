@@ -0,0 +1,108 @@
+"""
+Downloads the same artifact from a local HTTP server in one stream and in
+parallel segments.
+
+    python -m benchmarks.bench_download
+
+The server honours range requests and limits every connection to RATE
+bytes a second, like a remote registry or artifact store would.  Each
+download is checked against its sha256, the cache is turned off.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+from benchmarks import print_table
+
+from cattle import CONFIG_OVERRIDE
+
+
+SIZE = 64 * 2**20
+RATE = 32 * 2**20
+CHUNK = 64 * 2**10
+SEGMENT_SIZE = 8 * 2**20
+PARALLELISM = [1, 2, 4, 8]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+    data = None
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+
+    def do_GET(self):
+        start = 0
+        end = len(self.data) - 1
+        range = self.headers.get('Range')
+        if range:
+            start, end = range.split('=')[1].split('-')
+            start = int(start)
+            end = int(end) if end else len(self.data) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, len(self.data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.end_headers()
+
+        for offset in xrange(start, end + 1, CHUNK):
+            sent = time.time()
+            self.wfile.write(self.data[offset:min(offset + CHUNK, end + 1)])
+            time.sleep(max(0, float(CHUNK) / RATE - (time.time() - sent)))
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    _Handler.data = os.urandom(SIZE)
+    checksum = hashlib.sha256(_Handler.data).hexdigest()
+
+    server = _Server(('127.0.0.1', 0), _Handler)
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    url = 'http://127.0.0.1:{0}/artifact'.format(server.server_port)
+
+    work = tempfile.mkdtemp()
+    CONFIG_OVERRIDE['DOWNLOAD_CACHE_MAX_SIZE'] = '0'
+    CONFIG_OVERRIDE['DOWNLOAD_SEGMENT_SIZE'] = str(SEGMENT_SIZE)
+
+    from cattle import download
+
+    rows = []
+    try:
+        for parallelism in PARALLELISM:
+            CONFIG_OVERRIDE['DOWNLOAD_PARALLELISM'] = str(parallelism)
+            start = time.time()
+            file_name = download._download_file(url, work, checksum=checksum)
+            elapsed = time.time() - start
+            os.remove(file_name)
+            rows.append(['stream' if parallelism == 1 else 'segmented',
+                         parallelism, '%.2f' % elapsed,
+                         '%.1f' % (SIZE / 2**20 / elapsed)])
+    finally:
+        server.shutdown()
+        shutil.rmtree(work)
+
+    print('{0} MB artifact, {1} MB/s per connection, {2} MB segments'.format(
+        SIZE / 2**20, RATE / 2**20, SEGMENT_SIZE / 2**20))
+    print_table(['mode', 'parallelism', 'seconds', 'MB/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
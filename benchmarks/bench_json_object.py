@@ -0,0 +1,111 @@
+"""
+Cost of wrapping the events in tests/docker/ in a JsonObject.
+
+    python -m benchmarks.bench_json_object
+
+Each event is parsed, its instance uuid and host kind are read the way the
+handlers do and it is serialized again.  The eager columns are the previous
+JsonObject, which wrapped the whole tree up front and copied it back in
+unwrap().  The bytes columns are the size of the objects the wrapped tree
+holds after the reads.
+"""
+import json
+import os
+import sys
+
+from benchmarks import per_call, print_table
+
+from cattle.utils import JsonObject
+
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'docker')
+
+
+def _to_eager(v):
+    if isinstance(v, dict):
+        return EagerJsonObject(v)
+    elif isinstance(v, list):
+        return [_to_eager(i) for i in v]
+    return v
+
+
+class EagerJsonObject:
+    def __init__(self, data):
+        for k, v in data.items():
+            self.__dict__[k] = _to_eager(v)
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__, name)
+
+    @staticmethod
+    def unwrap(v):
+        if isinstance(v, list):
+            return [EagerJsonObject.unwrap(i) for i in v]
+        if isinstance(v, dict):
+            return dict((k, EagerJsonObject.unwrap(i)) for k, i in v.items())
+        if isinstance(v, EagerJsonObject):
+            return EagerJsonObject.unwrap(v.__dict__)
+        return v
+
+
+def _read(obj):
+    try:
+        ihm = obj.data.instanceHostMap
+        return ihm.instance.uuid, ihm.host.kind
+    except (AttributeError, KeyError):
+        return None
+
+
+def _roundtrip(cls, text):
+    obj = cls(json.loads(text))
+    _read(obj)
+    return json.dumps(cls.unwrap(obj))
+
+
+def _sizeof(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, EagerJsonObject):
+        size += _sizeof(obj.__dict__, seen)
+    elif isinstance(obj, dict):
+        for k, v in dict.iteritems(obj):
+            size += _sizeof(k, seen) + _sizeof(v, seen)
+    elif isinstance(obj, list):
+        for v in list.__iter__(obj):
+            size += _sizeof(v, seen)
+    return size
+
+
+def _wrapped(cls, text):
+    obj = cls(json.loads(text))
+    _read(obj)
+    return obj
+
+
+def main():
+    rows = []
+    totals = [0, 0, 0, 0]
+    for name in sorted(os.listdir(_FIXTURES)):
+        with open(os.path.join(_FIXTURES, name)) as f:
+            text = f.read()
+
+        values = [per_call(lambda: _roundtrip(EagerJsonObject, text), 200),
+                  per_call(lambda: _roundtrip(JsonObject, text), 200),
+                  _sizeof(_wrapped(EagerJsonObject, text)),
+                  _sizeof(_wrapped(JsonObject, text))]
+        totals = [t + v for t, v in zip(totals, values)]
+        rows.append([name] + ['%.1f' % v for v in values[:2]] + values[2:])
+
+    rows.append(['total'] + ['%.1f' % v for v in totals[:2]] + totals[2:])
+    print_table(('fixture', 'eager us', 'lazy us', 'eager bytes',
+                 'lazy bytes'), rows)
+
+
+if __name__ == '__main__':
+    main()
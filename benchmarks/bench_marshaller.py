@@ -0,0 +1,130 @@
+"""
+Marshaller cost per message for every JSON backend installed.
+
+    python -m benchmarks.bench_marshaller
+
+The ping messages are tests/docker/ping_resp with the instance resources
+repeated, the activate message is tests/docker/instance_activate_resp with
+a docker inspect of the container added to it.  The same column tells if
+the encoder wrote the same bytes as json.dumps.
+"""
+import copy
+import json
+import os
+
+from benchmarks import per_call, print_table
+
+from cattle.plugins.core import marshaller
+
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'docker')
+
+
+def _fixture(name):
+    with open(os.path.join(_FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def _ping(count):
+    ping = _fixture('ping_resp')
+    resources = ping['data']['resources']
+    instance = [r for r in resources if r['type'] == 'instance'][0]
+    del resources[2:]
+    for i in range(count):
+        resource = copy.deepcopy(instance)
+        resource['uuid'] = 'uuid-%d' % i
+        resource['dockerId'] = '%064x' % i
+        resource['labels']['io.rancher.container.uuid'] = resource['uuid']
+        resources.append(resource)
+    return ping
+
+
+def _inspect(i):
+    return {
+        'Id': '%064x' % i,
+        'Created': '2015-11-04T19:26:01.123456789Z',
+        'Path': '/bin/sh',
+        'Args': ['-c', 'while true; do sleep 1; done'],
+        'State': {'Running': True, 'Paused': False, 'Restarting': False,
+                  'OOMKilled': False, 'Dead': False, 'Pid': 4242 + i,
+                  'ExitCode': 0, 'Error': '',
+                  'StartedAt': '2015-11-04T19:26:02.123456789Z',
+                  'FinishedAt': '0001-01-01T00:00:00Z'},
+        'Image': '%064x' % (i + 1),
+        'Name': '/r-container-%d' % i,
+        'Config': {
+            'Hostname': 'container-%d' % i,
+            'Env': ['PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin',
+                    'CATTLE_URL=http://localhost:8080/v1'] +
+                   ['VAR_%d=value %d' % (j, j) for j in range(20)],
+            'Cmd': ['sleep', '1'],
+            'Image': 'ibuildthecloud/helloworld:latest',
+            'Labels': dict(('io.rancher.label.%d' % j, 'value-%d' % j)
+                           for j in range(10)),
+            'ExposedPorts': {'80/tcp': {}, '443/tcp': {}},
+        },
+        'HostConfig': {
+            'Binds': ['/var/lib/data%d:/data%d:rw' % (j, j)
+                      for j in range(5)],
+            'PortBindings': {'80/tcp': [{'HostIp': '', 'HostPort': '8080'}]},
+            'RestartPolicy': {'Name': '', 'MaximumRetryCount': 0},
+            'Memory': 0,
+            'CpuShares': 0,
+            'Privileged': False,
+            'Dns': ['169.254.169.250'],
+            'LogConfig': {'Type': 'json-file', 'Config': {}},
+        },
+        'NetworkSettings': {
+            'IPAddress': '172.17.0.%d' % (i % 250 + 2),
+            'IPPrefixLen': 16,
+            'Gateway': '172.17.42.1',
+            'MacAddress': '02:42:ac:11:00:02',
+            'Ports': {'80/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '8080'}]},
+        },
+        'Mounts': [{'Source': '/var/lib/data%d' % j,
+                    'Destination': '/data%d' % j, 'Mode': 'rw',
+                    'RW': True} for j in range(5)],
+    }
+
+
+def _activate():
+    resp = _fixture('instance_activate_resp')
+    data = resp['data']['instanceHostMap']['instance']['+data']
+    data['dockerInspect'] = _inspect(0)
+    data['dockerContainer']['Labels'] = data['dockerInspect']['Config'][
+        'Labels']
+    return resp
+
+
+def main():
+    messages = [('ping, 1000 instances', _ping(1000), 20),
+                ('ping, 5000 instances', _ping(5000), 5),
+                ('activate with inspect', _activate(), 1000)]
+
+    rows = []
+    for name, factory in marshaller.BACKENDS:
+        try:
+            loads, dumps = factory()
+        except ImportError:
+            rows.append((name, '-', 'not installed', '', '', ''))
+            continue
+
+        for message, obj, number in messages:
+            string = json.dumps(obj)
+            if dumps is None:
+                encode = same = '-'
+            else:
+                encode = '%.1f' % per_call(lambda: dumps(obj), number)
+                same = dumps(obj) == string
+            rows.append((name, message,
+                         '%d' % len(string),
+                         '%.1f' % per_call(lambda: loads(string), number),
+                         encode, same))
+
+    print_table(('backend', 'message', 'bytes', 'decode us', 'encode us',
+                 'same'), rows)
+
+
+if __name__ == '__main__':
+    main()
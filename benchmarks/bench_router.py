@@ -0,0 +1,78 @@
+"""
+Per event routing cost as compute drivers are added.
+
+    python -m benchmarks.bench_router
+
+The dispatch column is Router.route, the scan column is the old approach
+of asking every driver whether it supports the request.
+"""
+from benchmarks import per_call, print_table
+
+from cattle import type_manager
+from cattle.agent.handler import BaseHandler, KindBasedMixin
+from cattle.plugins.core.event_router import Router
+from cattle.utils import JsonObject
+
+
+class Driver(KindBasedMixin, BaseHandler):
+    def __init__(self, kind):
+        KindBasedMixin.__init__(self, kind=kind)
+        BaseHandler.__init__(self)
+
+    def _get_handler_category(self, req):
+        return 'compute'
+
+    def instance_activate(self, req=None, **kw):
+        return req
+
+
+class Hook(object):
+    def events(self):
+        return ['ping']
+
+    def execute(self, req):
+        return None
+
+
+def _request(kind):
+    return JsonObject({
+        'name': 'compute.instance.activate;agent=42',
+        'data': {
+            'instanceHostMap': {
+                'instance': {'uuid': 'uuid'},
+                'host': {'kind': kind},
+            },
+        },
+    })
+
+
+def _scan(drivers, req):
+    for driver in drivers:
+        if driver.supports(req):
+            return driver.execute(req)
+
+
+def main():
+    rows = []
+    for count in [1, 10, 100, 1000]:
+        type_manager.TYPES = {}
+        for i in range(count):
+            type_manager.register_type(type_manager.COMPUTE_DRIVER,
+                                       Driver('kind%d' % i))
+        type_manager.register_type(type_manager.POST_REQUEST_HANDLER, Hook())
+
+        drivers = type_manager.get_type_list(type_manager.COMPUTE_DRIVER)
+        router = Router()
+        req = _request('kind%d' % (count - 1))
+        assert router.route(req) is req
+
+        rows.append((count,
+                     '%.2f' % per_call(lambda: router.route(req)),
+                     '%.2f' % per_call(lambda: _scan(drivers, req),
+                                       number=100)))
+
+    print_table(('drivers', 'dispatch us/event', 'scan us/event'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -157,10 +157,115 @@ class Config:
     def multi_style():
         return default_value('AGENT_MULTI', 'proc')
 
+    @staticmethod
+    def blocking_workers():
+        return int(default_value('BLOCKING_WORKERS', '8'))
+
     @staticmethod
     def queue_depth():
         return int(default_value('QUEUE_DEPTH', 5))
 
+    @staticmethod
+    def publisher_mode():
+        return default_value('PUBLISHER_MODE', 'sync')
+
+    @staticmethod
+    def publisher_queue_depth():
+        return int(default_value('PUBLISHER_QUEUE_DEPTH', '1000'))
+
+    @staticmethod
+    def publisher_senders():
+        return int(default_value('PUBLISHER_SENDERS', '4'))
+
+    @staticmethod
+    def publisher_retries():
+        return int(default_value('PUBLISHER_RETRIES', '5'))
+
+    @staticmethod
+    def publisher_retry_backoff():
+        return float(default_value('PUBLISHER_RETRY_BACKOFF', '0.5'))
+
+    @staticmethod
+    def publisher_max_retry_backoff():
+        return float(default_value('PUBLISHER_MAX_RETRY_BACKOFF', '30'))
+
+    @staticmethod
+    def publisher_flush_timeout():
+        return int(default_value('PUBLISHER_FLUSH_TIMEOUT', '10'))
+
+    @staticmethod
+    def stats_log_interval():
+        return int(default_value('STATS_LOG_INTERVAL', '300'))
+
+    @staticmethod
+    def progress_interval():
+        return float(default_value('PROGRESS_INTERVAL', '1'))
+
+    @staticmethod
+    def event_spill_file():
+        return default_value('EVENT_SPILL_FILE',
+                             os.path.join(Config.state_dir(), 'event-spill'))
+
+    @staticmethod
+    def event_spill_max_size():
+        return int(default_value('EVENT_SPILL_MAX_SIZE', '67108864'))
+
+    @staticmethod
+    def lock_retry_timeout():
+        return float(default_value('LOCK_RETRY_TIMEOUT', '300'))
+
+    @staticmethod
+    def lock_retry_interval():
+        return float(default_value('LOCK_RETRY_INTERVAL', '0.5'))
+
+    @staticmethod
+    def download_chunk_size():
+        return int(default_value('DOWNLOAD_CHUNK_SIZE', '65536'))
+
+    @staticmethod
+    def download_retries():
+        return int(default_value('DOWNLOAD_RETRIES', '3'))
+
+    @staticmethod
+    def download_parallelism():
+        return int(default_value('DOWNLOAD_PARALLELISM', '1'))
+
+    @staticmethod
+    def download_segment_size():
+        return int(default_value('DOWNLOAD_SEGMENT_SIZE', '16777216'))
+
+    @staticmethod
+    def download_cache_dir():
+        return default_value('DOWNLOAD_CACHE_DIR',
+                             os.path.join(Config.state_dir(),
+                                          'download-cache'))
+
+    @staticmethod
+    def download_cache_max_size():
+        return int(default_value('DOWNLOAD_CACHE_MAX_SIZE', '0'))
+
+    @staticmethod
+    def download_timeout():
+        return int(default_value('DOWNLOAD_TIMEOUT', '60'))
+
+    @staticmethod
+    def process_restart_backoff():
+        return float(default_value('PROCESS_RESTART_BACKOFF', '1'))
+
+    @staticmethod
+    def process_max_restart_backoff():
+        return float(default_value('PROCESS_MAX_RESTART_BACKOFF', '60'))
+
+    @staticmethod
+    def process_reap_interval():
+        return float(default_value('PROCESS_REAP_INTERVAL', '10'))
+
+    @staticmethod
+    def process_stats_file():
+        return default_value('PROCESS_STATS_FILE',
+                             os.path.join(Config.state_dir(),
+                                          'process-stats'))
+
     @staticmethod
     def stop_timeout():
         return int(default_value('STOP_TIMEOUT', 60))
@@ -242,6 +347,30 @@ class Config:
     def max_dropped_ping():
         return int(default_value('MAX_DROPPED_PING', '10'))
 
+    @staticmethod
+    def host_stats_timeout():
+        return float(default_value('HOST_STATS_TIMEOUT', '2'))
+
+    @staticmethod
+    def host_sampler_enabled():
+        return default_value('HOST_SAMPLER', 'true') == 'true'
+
+    @staticmethod
+    def host_sampler_interval():
+        return float(default_value('HOST_SAMPLER_INTERVAL', '2'))
+
+    @staticmethod
+    def host_sampler_size():
+        return int(default_value('HOST_SAMPLER_SIZE', '900'))
+
+    @staticmethod
+    def host_sampler_history_points():
+        return int(default_value('HOST_SAMPLER_HISTORY_POINTS', '60'))
+
+    @staticmethod
+    def cadvisor_enabled():
+        return default_value('CADVISOR_ENABLED', 'true') == 'true'
+
     @staticmethod
     def cadvisor_port():
         return int(default_value('CADVISOR_PORT', '9344'))
@@ -286,6 +415,10 @@ class Config:
     def event_read_timeout():
         return int(default_value('EVENT_READ_TIMEOUT', '60'))
 
+    @staticmethod
+    def json_backend():
+        return default_value('JSON_BACKEND', 'auto')
+
     @staticmethod
     def eventlet_backdoor():
         val = default_value('EVENTLET_BACKDOOR', None)
@@ -6,12 +6,17 @@ import time
 import uuid
 import websocket
 import base64
+from collections import deque, OrderedDict
 
 from cattle import Config
+from cattle import progress
 from cattle import type_manager
 from cattle import utils
 from cattle.agent import Agent
-from cattle.lock import FailedToLock
+from cattle.agent.shard import ShardedQueue, shard_key
+from cattle.agent.spill import SpillJournal
+from cattle.download import download_cache_stats
+from cattle.lock import FailedToLock, lock_summary
 from cattle.plugins.core.publisher import Publisher
 from cattle.concurrency import Queue, Full, Empty, run, spawn
 
@@ -71,55 +76,183 @@ def _worker(worker_name, queue, ppid):
         _worker_main(worker_name, queue, ppid)
     finally:
         log.error('%s : Exiting', worker_name)
+        publisher = type_manager.get_type(type_manager.PUBLISHER)
+        if publisher is not None and \
+                not publisher.flush(Config.publisher_flush_timeout()):
+            log.error('%s : Replies left unsent', worker_name)
+
+
+class _Deferred(object):
+    """
+    Events whose lock is held by an event of another worker.  They wait
+    here by resource, in the order they came, and are retried every
+    Config.lock_retry_interval() seconds while the worker goes on with
+    other events.  Later events of a waiting resource wait behind it.  An
+    event whose lock is still held after Config.lock_retry_timeout()
+    seconds is given up on and gets an error reply.
+    """
+
+    def __init__(self):
+        self._events = OrderedDict()
+        self._retry_at = None
+
+    def __contains__(self, key):
+        return key in self._events
+
+    def add(self, key, req):
+        deadline = time.time() + Config.lock_retry_timeout()
+        self._events.setdefault(key, deque()).append((req, deadline))
+        if self._retry_at is None:
+            self._retry_at = time.time() + Config.lock_retry_interval()
+
+    def timeout(self, default):
+        if self._retry_at is None:
+            return default
+        return max(0, min(default, self._retry_at - time.time()))
+
+    def retry(self, run, give_up):
+        """
+        Runs the events that are due with run(req), which returns False if
+        the lock is still held.  Events that timed out are handed to
+        give_up(req).
+        """
+        if self._retry_at is None or time.time() < self._retry_at:
+            return
+
+        for key in self._events.keys():
+            events = self._events[key]
+            while events:
+                req, deadline = events[0]
+                if not run(req):
+                    if time.time() < deadline:
+                        break
+                    log.error('Lock for %s still held, giving up', req.name)
+                    give_up(req)
+                events.popleft()
+            if not events:
+                del self._events[key]
+
+        self._retry_at = None
+        if self._events:
+            self._retry_at = time.time() + Config.lock_retry_interval()
+
+
+def _deferral_key(req):
+    key = shard_key(req)
+    if key is None:
+        return 'event:{0}'.format(req.get('id'))
+    return key
+
+
+def _reply_error(publisher, req, msg):
+    resp = utils.reply(req)
+    if resp is not None:
+        resp["transitioning"] = "error"
+        resp["transitioningInternalMessage"] = msg
+        publisher.publish(resp)
+
+
+def _give_up(publisher, req):
+    """
+    Replies with an error to an event that waited too long for its lock,
+    so the server does not wait for its timeout.
+    """
+    _reply_error(publisher, req, 'Lock still held after {0} seconds'.format(
+        Config.lock_retry_timeout()))
+
+
+def _run_event(worker_name, agent, publisher, req):
+    """
+    Runs one event and publishes its reply, returns False if a lock it
+    needs is held elsewhere.
+    """
+    id = req.id
+    start = time.time()
+    try:
+        utils.log_request(req, log, '%s : Starting request %s for %s',
+                          worker_name, id, req.name)
+        try:
+            resp = agent.execute(req)
+        finally:
+            progress.flush(req)
+        if resp is not None:
+            publisher.publish(resp)
+    except FailedToLock as e:
+        log.info("%s for %s, retrying later", e, req.name)
+        return False
+    except Exception as e:
+        error_id = str(uuid.uuid4())
+        log.exception("%s : Unknown error", error_id)
+
+        _reply_error(publisher, req, "{0} : {1}".format(error_id, e))
+    finally:
+        duration = time.time() - start
+        utils.log_request(req, log,
+                          '%s : Done request %s for %s [%s] seconds',
+                          worker_name, id, req.name, duration)
+    return True
+
+
+def _log_stats(worker_name, publisher):
+    """
+    Logs the counters of the publisher, the locks and the download cache of
+    this process, along with those of each LIFECYCLE type with a stats()
+    method.
+    """
+    stats = [('Publisher', publisher.stats()),
+             ('Locks', lock_summary()),
+             ('Download cache', download_cache_stats())]
+    for impl in type_manager.get_type_list(type_manager.LIFECYCLE):
+        if hasattr(impl, 'stats'):
+            try:
+                stats.append((impl.__class__.__name__, impl.stats()))
+            except:
+                log.exception('Failed to get the stats of %s', impl)
+
+    for name, values in stats:
+        if values:
+            log.info('%s : %s %s', worker_name, name, values)
 
 
 def _worker_main(worker_name, queue, ppid):
     agent = Agent()
     marshaller = type_manager.get_type(type_manager.MARSHALLER)
     publisher = type_manager.get_type(type_manager.PUBLISHER)
-    while True:
-        try:
-            req = None
-            line = queue.get(True, 5)
+    deferred = _Deferred()
+    stats_logged = time.time()
 
-            req = marshaller.from_string(line)
+    def run(req):
+        return _run_event(worker_name, agent, publisher, req)
 
-            utils.log_request(req, log, 'Request: %s', line)
+    def give_up(req):
+        _give_up(publisher, req)
 
-            id = req.id
-            start = time.time()
-            try:
-                utils.log_request(req, log, '%s : Starting request %s for %s',
-                                  worker_name, id, req.name)
-                resp = agent.execute(req)
-                if resp is not None:
-                    publisher.publish(resp)
-            finally:
-                duration = time.time() - start
-                utils.log_request(req, log,
-                                  '%s : Done request %s for %s [%s] seconds',
-                                  worker_name, id, req.name, duration)
+    while True:
+        if time.time() - stats_logged >= Config.stats_log_interval():
+            stats_logged = time.time()
+            _log_stats(worker_name, publisher)
+
+        deferred.retry(run, give_up)
+
+        try:
+            line = queue.get(True, deferred.timeout(5))
         except Empty:
             if not _should_run(ppid):
                 break
-        except FailedToLock as e:
-            log.info("%s for %s", e, req.name)
-            if not _should_run(ppid):
-                break
-        except Exception as e:
-            error_id = str(uuid.uuid4())
-            log.exception("%s : Unknown error", error_id)
-            if not _should_run(ppid):
-                break
+            continue
+
+        try:
+            req = marshaller.from_string(line)
+        except Exception:
+            log.exception('%s : Failed to read request %s', worker_name,
+                          line)
+            continue
 
-            if req is not None:
-                msg = "{0} : {1}".format(error_id, e)
+        utils.log_request(req, log, 'Request: %s', line)
 
-                resp = utils.reply(req)
-                if resp is not None:
-                    resp["transitioning"] = "error"
-                    resp["transitioningInternalMessage"] = msg
-                    publisher.publish(resp)
+        key = _deferral_key(req)
+        if key in deferred or not run(req):
+            deferred.add(key, req)
 
 
 class EventClient:
@@ -132,8 +265,9 @@ class EventClient:
         self._workers = int(workers)
         self._children = []
         self._agent_id = agent_id
-        self._queue = Queue(queue_depth)
+        self._queue = ShardedQueue(self._workers, queue_depth)
         self._ping_queue = Queue(queue_depth)
+        self._spill = SpillJournal(self._queue)
 
         type_manager.register_type(type_manager.PUBLISHER,
                                    Publisher(url + "/publish", auth))
@@ -142,7 +276,7 @@ class EventClient:
         pid = os.getpid()
         for i in range(self._workers):
             p = spawn(target=_worker, args=('worker{0}'.format(i),
-                                            self._queue, pid))
+                                            self._queue.queues[i], pid))
             self._children.append(p)
 
         p = spawn(target=_worker, args=('ping', self._ping_queue, pid))
@@ -171,6 +305,7 @@ class EventClient:
                 'ping_drop': 0,
             }
             self._start_children()
+            self._spill.start()
 
             def on_message(ws, message):
                 line = message.strip()
@@ -181,8 +316,8 @@ class EventClient:
                         if ping:
                             self._ping_queue.put(line, block=False)
                             drops['ping_drop'] = 0
-                        else:
-                            self._queue.put(line, block=False)
+                        elif not self._spill.offer(line):
+                            raise Full()
                 except Full:
                     log.info("Dropping request %s" % line)
                     drops['drop_count'] += 1
@@ -31,18 +31,35 @@ class BaseHandler(object):
         if method is None:
             return None
         else:
-            return method(req=req, **req.data.__dict__)
+            return method(req=req, **dict(req.data.iteritems()))
+
+    def dispatcher(self, event_name):
+        """
+        Resolves the handler method for an event name once, returns a
+        callable doing what execute() does for such a request or None.
+        """
+        method = self._get_method_for_name(event_name)
+        if method is None:
+            return None
+
+        def dispatch(req):
+            return method(req=req, **dict(req.data.iteritems()))
+
+        return dispatch
 
     def _get_method_for(self, req):
+        return self._get_method_for_name(req.name, req)
+
+    def _get_method_for_name(self, event_name, req=None):
         prefix = ''
         category = self._get_handler_category(req)
         if len(category) > 0:
             prefix = category + '.'
 
-        if len(req.name) <= len(prefix):
+        if len(event_name) <= len(prefix):
             return None
 
-        name = req.name[len(prefix):].replace('.', '_')
+        name = event_name[len(prefix):].replace('.', '_')
         idx = name.find(';')
         if idx != -1:
             name = name[0:idx]
@@ -117,16 +134,24 @@ class KindBasedMixin(object):
         super(KindBasedMixin, self).__init__()
         self._kind = kind
 
+    @property
+    def kind(self):
+        return self._kind
+
     def _check_supports(self, req):
+        return self._kind in KindBasedMixin.request_kinds(req)
+
+    @staticmethod
+    def request_kinds(req):
+        kinds = []
         for check in KindBasedMixin.CHECK_PATHS:
             val = req.data
             try:
                 for part in check:
                     val = val[part]
 
-                if val == self._kind:
-                    return True
-            except KeyError:
+                kinds.append(val)
+            except (KeyError, TypeError):
                 pass
 
-        return False
+        return kinds
@@ -0,0 +1,68 @@
+import itertools
+import logging
+
+from cattle import type_manager
+from cattle.concurrency import Queue
+
+
+log = logging.getLogger("agent")
+
+# Maps in the event data that name the resource an event works on
+_RESOURCE_MAPS = [
+    ('instanceHostMap', 'instance'),
+    ('volumeStoragePoolMap', 'volume'),
+    ('imageStoragePoolMap', 'image'),
+]
+
+
+def shard_key(req):
+    """
+    The resource an event works on, events with the same key have to run
+    one after the other.  None if the event does not name one.
+    """
+    data = req.get('data')
+    if isinstance(data, dict):
+        for map_name, resource in _RESOURCE_MAPS:
+            try:
+                uuid = data[map_name][resource]['uuid']
+            except (KeyError, TypeError):
+                continue
+            if uuid is not None:
+                return '{0}:{1}'.format(resource, uuid)
+
+    resource_type = req.get('resourceType')
+    resource_id = req.get('resourceId')
+    if resource_type is not None and resource_id is not None:
+        return '{0}:{1}'.format(resource_type, resource_id)
+
+    return None
+
+
+class ShardedQueue(object):
+    """
+    One queue per worker, events are put on the queue of their shard_key()
+    so the events of a resource run in order on one worker and never race
+    each other for its lock.  Events without a key are spread round robin.
+    """
+
+    def __init__(self, shards, depth):
+        self.queues = [Queue(depth) for i in range(shards)]
+        self._round_robin = itertools.cycle(range(shards))
+
+    def put(self, line, block=True, timeout=None):
+        self.queues[self.shard(line)].put(line, block, timeout)
+
+    def qsize(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def shard(self, line):
+        try:
+            marshaller = type_manager.get_type(type_manager.MARSHALLER)
+            key = shard_key(marshaller.from_string(line))
+        except Exception:
+            log.exception('Failed to read the resource of [%s]', line)
+            key = None
+
+        if key is None:
+            return next(self._round_robin)
+        return hash(key) % len(self.queues)
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from cattle import Config
+from cattle.concurrency import Full
+
+
+log = logging.getLogger("agent")
+
+_STATS_INTERVAL = 10
+
+# How often spilled events are offered to their full shard again
+_FEED_INTERVAL = 0.05
+
+# First byte of the records of waiting and handed over events
+_WAITING = '+'
+_DONE = '-'
+
+
+class SpillJournal(object):
+    """
+    Hands events to the sharded worker queue from a dispatcher thread, so
+    the websocket thread never has to read them.  An event whose shard is
+    full, or whose shard still has spilled events waiting, is written to a
+    file instead of being dropped.  Every shard keeps the offsets of its own
+    waiting events and they are moved back into its queue in order as its
+    worker catches up, a busy shard never holds up the events of another.
+
+    Every record in the file starts with a byte that is flipped once the
+    event was handed to its shard.  Events spilled by an earlier run and
+    not handed over yet are taken up again when the agent starts, they stay
+    in the file until they are handed over like any other spilled event.
+    Those the server already timed out, going by their time and
+    timeoutMillis, are dropped instead.  The file is emptied whenever
+    nothing is waiting.  Waiting events are bounded by
+    CATTLE_EVENT_SPILL_MAX_SIZE bytes, past that events are dropped like
+    before.
+    """
+
+    def __init__(self, queue, path=None, max_size=None):
+        self._queue = queue
+        self._path = path or Config.event_spill_file()
+        self._max_size = max_size or Config.event_spill_max_size()
+
+        self._cond = Condition(Lock())
+        self._inbox = deque()
+        self._backlogs = [deque() for q in queue.queues]
+        self._file = None
+        self._thread = None
+        self._size = 0
+        self._written = 0
+        self._pending = 0
+        self._spill_bytes = 0
+        self._spilled_total = 0
+        self._drained_total = 0
+        self._rate = 0.0
+        self._rate_start = time.time()
+        self._rate_count = 0
+        self._last_log = time.time()
+        self._stats_logged = time.time()
+
+        self._replay()
+
+    def _replay(self):
+        if not os.path.exists(self._path):
+            return
+
+        self._ensure_open()
+        records = self._file.readlines()
+        now = time.time()
+        expired = 0
+        offset = 0
+        for record in records:
+            if not record.endswith('\n'):
+                # Cut short by a crash, it was never complete
+                break
+
+            line = record[1:-1]
+            if not record.startswith(_WAITING):
+                pass
+            elif _expired(line, now):
+                self._file.seek(offset)
+                self._file.write(_DONE)
+                expired += 1
+            else:
+                shard = self._queue.shard(line)
+                self._backlogs[shard].append((offset, len(line)))
+                self._size += len(line) + 1
+                self._spill_bytes += len(line) + 1
+                self._pending += 1
+            offset += len(record)
+
+        self._written = offset
+        if not self._pending:
+            self._written = 0
+        self._file.truncate(self._written)
+        self._file.flush()
+
+        if self._pending or expired:
+            log.info('Replaying %s events spilled before the restart, '
+                     'dropped %s that timed out', self._pending, expired)
+
+    def start(self):
+        with self._cond:
+            self._ensure_started()
+
+    def offer(self, line):
+        """
+        Takes line for its shard, returns False if there is no room left to
+        keep it.
+        """
+        line = line.replace('\n', ' ')
+        size = len(line) + 1
+        with self._cond:
+            if self._size + size > self._max_size:
+                return False
+
+            self._ensure_started()
+            self._inbox.append(line)
+            self._size += size
+            self._cond.notify()
+            return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queueDepth': _qsize(self._queue),
+                'waiting': len(self._inbox),
+                'spilled': self._pending,
+                'spillBytes': self._spill_bytes,
+                'spilledTotal': self._spilled_total,
+                'drainedTotal': self._drained_total,
+                'drainRate': self._rate,
+            }
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._dispatch, name='event-spill')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                if not self._inbox and not self._pending:
+                    self._cond.wait(Config.stats_log_interval())
+                if not self._inbox and self._pending:
+                    self._cond.wait(_FEED_INTERVAL)
+                lines = list(self._inbox)
+                self._inbox.clear()
+
+            if time.time() - self._stats_logged >= \
+                    Config.stats_log_interval():
+                self._stats_logged = time.time()
+                stats = self.stats()
+                if stats['spilledTotal']:
+                    log.info('Event spill journal %s', stats)
+
+            try:
+                # Spilled events first, they came before the new ones
+                self._feed()
+                for line in lines:
+                    self._route(line)
+            except Exception:
+                log.exception('Failed to dispatch events')
+
+    def _route(self, line):
+        shard = self._queue.shard(line)
+        if not self._backlogs[shard]:
+            try:
+                self._queue.queues[shard].put(line, block=False)
+                with self._cond:
+                    self._size -= len(line) + 1
+                return
+            except Full:
+                pass
+
+        self._ensure_open()
+        self._file.seek(self._written)
+        self._file.write(_WAITING + line + '\n')
+        self._file.flush()
+        self._backlogs[shard].append((self._written, len(line)))
+
+        with self._cond:
+            self._written += len(line) + 2
+            self._spill_bytes += len(line) + 1
+            self._pending += 1
+            self._spilled_total += 1
+            if self._pending == 1:
+                self._rate_start = time.time()
+                self._rate_count = 0
+                log.info('Event queue is full, spilling events to %s',
+                         self._path)
+
+    def _feed(self):
+        if not self._pending:
+            return
+
+        for shard, backlog in enumerate(self._backlogs):
+            while backlog:
+                offset, length = backlog[0]
+                self._file.seek(offset + 1)
+                line = self._file.read(length)
+                try:
+                    self._queue.queues[shard].put(line, block=False)
+                except Full:
+                    break
+
+                self._file.seek(offset)
+                self._file.write(_DONE)
+                self._file.flush()
+                backlog.popleft()
+                with self._cond:
+                    self._size -= length + 1
+                    self._spill_bytes -= length + 1
+                    self._pending -= 1
+                    self._drained_total += 1
+                    self._update_rate()
+
+        with self._cond:
+            if self._pending == 0:
+                self._file.truncate(0)
+                self._written = 0
+                log.info('Drained spilled events, %s', self._stats())
+                self._rate = 0.0
+            elif time.time() - self._last_log > _STATS_INTERVAL:
+                self._last_log = time.time()
+                log.info('Draining spilled events, %s', self._stats())
+
+    def _ensure_open(self):
+        if self._file is None:
+            dir = os.path.dirname(self._path)
+            if dir and not os.path.exists(dir):
+                os.makedirs(dir)
+            open(self._path, 'ab').close()
+            self._file = open(self._path, 'r+b')
+
+    def _stats(self):
+        return 'spilled [{0}], bytes [{1}], drain rate [{2:.1f}/s]'.format(
+            self._pending, self._spill_bytes, self._rate)
+
+    def _update_rate(self):
+        self._rate_count += 1
+        elapsed = time.time() - self._rate_start
+        if elapsed >= 1:
+            self._rate = self._rate_count / elapsed
+            self._rate_count = 0
+            self._rate_start = time.time()
+
+
+def _expired(line, now):
+    try:
+        event = json.loads(line)
+        return (event['time'] + event['timeoutMillis']) / 1000.0 < now
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def _qsize(queue):
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return None
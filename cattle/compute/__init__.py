@@ -3,7 +3,6 @@ import hashlib
 
 from cattle.agent.handler import BaseHandler
 from cattle.progress import Progress
-from cattle.lock import lock
 
 
 log = logging.getLogger("BaseComputeDriver")
@@ -80,9 +79,13 @@ class BaseComputeDriver(BaseHandler):
             .hexdigest()
 
     def instance_pull(self, req=None, instancePull=None):
+        """
+        Takes no lock, _do_instance_pull() locks what it changes, with
+        _image_pull_lock() for the image.  Pulling the image itself is left
+        to the storage driver, which runs one pull per image for everybody.
+        """
         progress = Progress(req)
-        with lock(self._image_pull_lock(instancePull)):
-            result = self._do_instance_pull(instancePull, progress)
+        result = self._do_instance_pull(instancePull, progress)
         if result is None:
             result = {}
         else:
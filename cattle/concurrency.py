@@ -1,9 +1,11 @@
 import logging
+from collections import deque
 from cattle import Config
 
 log = logging.getLogger('concurrency')
 
-__all__ = ['Queue', 'Empty', 'Full', 'Worker', 'run', 'spawn', 'blocking']
+__all__ = ['Queue', 'Empty', 'Full', 'Worker', 'run', 'spawn', 'blocking',
+           'blocking_each']
 
 if Config.is_eventlet():
     import eventlet
@@ -38,10 +40,16 @@ elif Config.is_multi_proc():
     log.info('Using multiprocessing')
 elif Config.is_multi_thread():
     from Queue import Queue, Empty, Full
-    from threading import Thread
+    from threading import BoundedSemaphore, Thread
     Worker = Thread
 
+    # All workers share the process, bound the blocking work they run
+    blocking_slots = BoundedSemaphore(Config.blocking_workers())
+
     log.info('Using threading')
+elif Config.multi_style() == 'asyncio':
+    raise Exception('CATTLE_AGENT_MULTI=asyncio needs Python 3, use thread '
+                    'to run in a single process without monkey patching')
 else:
     raise Exception('Could not determine concurrency style set '
                     'CATTLE_AGENT_MULTI to eventlet, thread, or '
@@ -65,5 +73,49 @@ def run(method, *args):
 def blocking(method, *args, **kw):
     if Config.is_eventlet():
         return tpool.execute(method, *args, **kw)
+    elif Config.is_multi_thread():
+        with blocking_slots:
+            return method(*args, **kw)
     else:
         return method(*args, **kw)
+
+
+def blocking_each(method, items, parallelism):
+    """
+    Calls method(item) through blocking() for each of items, up to
+    parallelism of them at a time.  The items after a failed call are
+    skipped and its error is raised once the running calls are done.
+
+    Must not be called from blocking(), the calls could wait for the slot
+    the caller holds.
+    """
+    items = deque(items)
+    errors = []
+
+    def work():
+        while not errors:
+            try:
+                item = items.popleft()
+            except IndexError:
+                return
+            try:
+                blocking(method, item)
+            except Exception as e:
+                errors.append(e)
+
+    count = min(parallelism, len(items))
+    if Config.is_eventlet():
+        workers = [eventlet.spawn(work) for _ in range(count)]
+        for worker in workers:
+            worker.wait()
+    else:
+        from threading import Thread
+        workers = [Thread(target=work) for _ in range(count)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    if errors:
+        raise errors[0]
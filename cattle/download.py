@@ -1,12 +1,18 @@
-from urllib import urlretrieve
 from hashlib import md5, sha1, sha256, sha512
 
 import bz2
 import gzip
+import httplib
 import logging
 import os
-
-from concurrency import blocking
+import socket
+import urllib2
+import zlib
+from threading import Lock
+
+from cattle import Config
+from concurrency import blocking, blocking_each
+from download_cache import DownloadCache, _validator
 from utils import temp_file_in_work_dir
 
 
@@ -22,31 +28,433 @@ DECOMPRESS = {
     '.bz2': bz2.BZ2File
 }
 
+STREAM_DECOMPRESS = {
+    '.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    '.bz2': bz2.BZ2Decompressor
+}
+
 CHUNK_SIZE = 8192
 
 log = logging.getLogger('cattle')
 
+_CACHE = DownloadCache(Config.download_cache_dir(),
+                       Config.download_cache_max_size())
+
 
 def download_file(url, destination, reporthook=None, decompression=True,
                   checksum=None):
-    return blocking(_download_file, url, destination, reporthook=reporthook,
-                    decompression=decompression, checksum=checksum)
+    return _download_file(url, destination, reporthook=reporthook,
+                          decompression=decompression, checksum=checksum)
 
 
 def _download_file(url, destination, reporthook=None, decompression=True,
                    checksum=None):
+    """
+    The network and file work is done through blocking(), each segment of
+    a segmented download on its own, so this is not called from it.
+    """
+    digest = None
+    if checksum is not None:
+        digest = HASHES.get(len(checksum))
+        if digest is None:
+            raise Exception("Invalid checksum format")
+
+    decompressor = None
+    if decompression:
+        for ext, factory in STREAM_DECOMPRESS.items():
+            if url.endswith(ext):
+                decompressor = factory
+
+    decompressed = decompressor is not None
+    headers = None
+    if _CACHE.enabled and checksum is None or \
+            Config.download_parallelism() > 1:
+        headers = blocking(_head, url)
+
+    cache_key = None
+    if _CACHE.enabled:
+        if checksum is not None:
+            cache_key = DownloadCache.checksum_key(checksum, decompressed)
+        elif headers is not None:
+            cache_key = DownloadCache.url_key(url, _validator(headers),
+                                              decompressed)
+
     temp_name = temp_file_in_work_dir(destination)
 
+    if cache_key is not None and \
+            blocking(_CACHE.fetch, cache_key, temp_name):
+        log.info('Using cached download of %s for %s', url, temp_name)
+        return temp_name
+
     log.info('Downloading %s to %s', url, temp_name)
-    urlretrieve(url, filename=temp_name, reporthook=reporthook)
+    try:
+        validator = None
+        size = _segmented_size(url, headers)
+        if size is not None:
+            try:
+                hexdigest = _download_segmented(url, temp_name, size, digest,
+                                                reporthook)
+                validator = _validator(headers)
+            except RangeNotSupported as e:
+                log.info('Downloading %s in one stream: %s', url, e)
+                size = None
+
+        if size is not None:
+            if decompressed:
+                blocking(decompress, temp_name, url)
+        else:
+            validator, hexdigest = blocking(_download_stream, url, temp_name,
+                                            digest, decompressor, reporthook)
+
+        if checksum is not None and hexdigest != checksum:
+            raise Exception('Invalid checksum [{0}]'.format(checksum))
+    except:
+        os.remove(temp_name)
+        raise
+
+    if _CACHE.enabled:
+        if checksum is None:
+            # Cache what was actually downloaded, not what the HEAD said
+            cache_key = DownloadCache.url_key(url, validator, decompressed)
+        if cache_key is not None:
+            blocking(_CACHE.store, cache_key, temp_name)
 
-    if checksum is not None:
-        validate_checksum(temp_name, checksum)
+    return temp_name
 
-    if decompression:
-        decompress(temp_name, url)
 
-    return temp_name
+def download_cache_stats():
+    return _CACHE.stats()
+
+
+def _head(url):
+    request = urllib2.Request(url)
+    request.get_method = lambda: 'HEAD'
+    try:
+        response = urllib2.urlopen(request, timeout=Config.download_timeout())
+    except (IOError, socket.error, httplib.HTTPException) as e:
+        log.debug('Failed to get the headers of %s: %s', url, e)
+        return None
+    try:
+        return response.info()
+    finally:
+        response.close()
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def _segmented_size(url, headers):
+    """
+    Returns the size of url if it should be downloaded in segments, that is
+    parallel downloads are on and the server says it does ranges of a file
+    bigger than one segment.
+    """
+    if Config.download_parallelism() <= 1 or headers is None or \
+            not url.startswith(('http://', 'https://')) or \
+            headers.get('Accept-Ranges') != 'bytes':
+        return None
+    try:
+        size = int(headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+    if size <= Config.download_segment_size():
+        return None
+    return size
+
+
+def _download_stream(url, file_name, digest, decompressor, reporthook):
+    """
+    Returns the validator of url and the hex digest of what was downloaded
+    into file_name, None if there is no digest.
+    """
+    with open(file_name, 'wb') as output:
+        pipeline = _Pipeline(output, digest, decompressor)
+        _stream(url, pipeline, reporthook)
+    if digest is None:
+        return pipeline.validator, None
+    return pipeline.validator, pipeline.hexdigest()
+
+
+class _SegmentProgress(object):
+    """
+    Reports the bytes written by the segments and hashes them in order as
+    they are written.  Data written at the first byte not hashed yet is
+    hashed right away, bytes segments further ahead wrote meanwhile are
+    read back from the file once the segments before them are done.
+    """
+
+    def __init__(self, reporthook, file_name, size, segment_size, digest):
+        self._reporthook = reporthook
+        self._file_name = file_name
+        self._size = size
+        self._segment_size = segment_size
+        self._lock = Lock()
+        self._digest = None if digest is None else digest()
+        self._hashed = 0
+        self._written = {}
+        self.received = 0
+
+    def add(self, offset, data):
+        with self._lock:
+            self.received += len(data)
+            if self._digest is not None:
+                self._hash(offset, data)
+            if self._reporthook is not None:
+                chunk_size = Config.download_chunk_size()
+                self._reporthook(self.received // chunk_size, chunk_size,
+                                 self._size)
+
+    def _hash(self, offset, data):
+        start = offset - offset % self._segment_size
+        self._written[start] = offset + len(data)
+        if offset == self._hashed:
+            self._digest.update(data)
+            self._hashed += len(data)
+
+        while self._hashed < self._size:
+            start = self._hashed - self._hashed % self._segment_size
+            written = self._written.get(start, start)
+            if written <= self._hashed:
+                return
+            with open(self._file_name, 'rb') as f:
+                f.seek(self._hashed)
+                self._digest.update(f.read(written - self._hashed))
+            self._hashed = written
+
+    def hexdigest(self):
+        if self._digest is None:
+            return None
+        if self._hashed != self._size:
+            raise Exception('Hashed {0} of {1} bytes'.format(self._hashed,
+                                                             self._size))
+        return self._digest.hexdigest()
+
+
+def _download_segmented(url, file_name, size, digest=None, reporthook=None):
+    """
+    Downloads url of size bytes as Config.download_segment_size() sized
+    range requests, Config.download_parallelism() of them at a time, each
+    written at its offset in the preallocated file_name.  Returns the hex
+    digest of the file, None if there is no digest.
+    """
+    segment_size = Config.download_segment_size()
+    segments = [(start, min(start + segment_size, size) - 1)
+                for start in xrange(0, size, segment_size)]
+    progress = _SegmentProgress(reporthook, file_name, size, segment_size,
+                                digest)
+
+    with open(file_name, 'wb') as output:
+        output.truncate(size)
+
+    blocking_each(lambda segment: _fetch_segment(url, file_name, segment,
+                                                 progress),
+                  segments, Config.download_parallelism())
+
+    return progress.hexdigest()
+
+
+def _fetch_segment(url, file_name, segment, progress):
+    with open(file_name, 'r+b') as output:
+        _fetch_range(url, output, segment, progress)
+
+
+def _fetch_range(url, output, segment, progress):
+    offset, end = segment
+    retries = 0
+    while offset <= end:
+        request = urllib2.Request(url)
+        request.add_header('Range', 'bytes={0}-{1}'.format(offset, end))
+        try:
+            response = urllib2.urlopen(request,
+                                       timeout=Config.download_timeout())
+            try:
+                if _range_start(response) != offset:
+                    raise RangeNotSupported(
+                        'No range response for bytes {0}-{1}'.format(
+                            offset, end))
+
+                while offset <= end:
+                    data = response.read(min(Config.download_chunk_size(),
+                                             end + 1 - offset))
+                    if not data:
+                        raise IOError('Segment ended at {0} of {1}'.format(
+                            offset, end))
+                    output.seek(offset)
+                    output.write(data)
+                    # Read back by the digest if it is ahead
+                    output.flush()
+                    progress.add(offset, data)
+                    offset += len(data)
+            finally:
+                response.close()
+        except urllib2.HTTPError:
+            raise
+        except (IOError, socket.error, httplib.HTTPException) as e:
+            if retries >= Config.download_retries():
+                raise
+            retries += 1
+            log.info('Segment of %s interrupted at %s, resuming: %s', url,
+                     offset, e)
+
+
+class _Decompressor(object):
+    """
+    Incremental decompressor that, like gzip.open and bz2.BZ2File, reads
+    files made of several concatenated compressed streams.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._d = factory()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self._d.decompress(data))
+            data = self._d.unused_data
+            if not data.strip('\0'):
+                # Trailing padding after the last stream
+                break
+            self._d = self._factory()
+        return ''.join(out)
+
+    def flush(self):
+        """
+        Returns the rest of the data, raises if the last stream was cut
+        short.
+        """
+        if not self._ended():
+            raise Exception('Compressed data ended before the end of the '
+                            'stream')
+        flush = getattr(self._d, 'flush', None)
+        if flush is None:
+            return ''
+        return flush()
+
+    def _ended(self):
+        eof = getattr(self._d, 'eof', None)
+        if eof is not None:
+            return eof
+        # Python 2 decompressors do not tell, a byte past the end of the
+        # stream is either refused or left over
+        try:
+            self._d.decompress('\0')
+        except EOFError:
+            return True
+        except (IOError, zlib.error):
+            return False
+        return bool(self._d.unused_data)
+
+
+class _Pipeline(object):
+    """
+    Takes the downloaded bytes in order, hashes them and writes them, or
+    what they decompress to, to output.
+    """
+
+    def __init__(self, output, digest=None, decompressor=None):
+        self._output = output
+        self._digest_factory = digest
+        self._decompressor_factory = decompressor
+        self.reset()
+
+    def reset(self):
+        self._output.seek(0)
+        self._output.truncate()
+        self.received = 0
+        self.blocks = 0
+        self.validator = None
+        self._digest = None
+        self._decompressor = None
+        if self._digest_factory is not None:
+            self._digest = self._digest_factory()
+        if self._decompressor_factory is not None:
+            self._decompressor = _Decompressor(self._decompressor_factory)
+
+    def feed(self, data):
+        self.received += len(data)
+        self.blocks += 1
+        if self._digest is not None:
+            self._digest.update(data)
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data)
+        self._output.write(data)
+
+    def close(self):
+        if self._decompressor is not None:
+            self._output.write(self._decompressor.flush())
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+def _stream(url, pipeline, reporthook=None):
+    """
+    Downloads url into pipeline.  An interrupted transfer is resumed where
+    it stopped with a range request, or started over when the server does
+    not do ranges, up to Config.download_retries() times.
+    """
+    retries = 0
+    while True:
+        try:
+            _fetch(url, pipeline, reporthook)
+            pipeline.close()
+            return
+        except urllib2.HTTPError:
+            raise
+        except (IOError, socket.error, httplib.HTTPException) as e:
+            if retries >= Config.download_retries():
+                raise
+            retries += 1
+            log.info('Download of %s interrupted after %s bytes, '
+                     'resuming: %s', url, pipeline.received, e)
+
+
+def _fetch(url, pipeline, reporthook):
+    request = urllib2.Request(url)
+    if pipeline.received:
+        request.add_header('Range', 'bytes={0}-'.format(pipeline.received))
+
+    response = urllib2.urlopen(request, timeout=Config.download_timeout())
+    try:
+        start = _range_start(response)
+        if start != pipeline.received:
+            pipeline.reset()
+        pipeline.validator = _validator(response.info())
+
+        total = -1
+        length = response.info().get('Content-Length')
+        if length is not None:
+            total = start + int(length)
+
+        chunk_size = Config.download_chunk_size()
+        if reporthook is not None:
+            reporthook(pipeline.blocks, chunk_size, total)
+
+        while True:
+            data = response.read(chunk_size)
+            if not data:
+                break
+            pipeline.feed(data)
+            if reporthook is not None:
+                reporthook(pipeline.blocks, chunk_size, total)
+
+        if total >= 0 and pipeline.received < total:
+            raise IOError('Received {0} of {1} bytes'.format(
+                pipeline.received, total))
+    finally:
+        response.close()
+
+
+def _range_start(response):
+    if response.getcode() != 206:
+        return 0
+    try:
+        content_range = response.info()['Content-Range']
+        return int(content_range.split()[1].split('-')[0])
+    except (KeyError, IndexError, ValueError):
+        return 0
 
 
 def decompress(file_name, name=None):
@@ -92,15 +500,6 @@ def validate_checksum(file_name, checksum_value, buffer_size=2**20):
     if digest is None:
         raise Exception("Invalid checksum format")
 
-    d = digest()
-
-    with open(file_name, 'rb') as input:
-        while True:
-            data = input.read(buffer_size)
-            if not data:
-                break
-            d.update(data)
-
     c = checksum(file_name, digest=digest, buffer_size=buffer_size)
 
     if c != checksum_value:
@@ -0,0 +1,138 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+from threading import Lock
+
+from cattle.utils import temp_file
+
+log = logging.getLogger('cattle')
+
+
+def _validator(headers):
+    """
+    Returns what identifies the version of a resource from its response
+    headers, the ETag or else the Last-Modified date.
+    """
+    for name in ['ETag', 'Last-Modified']:
+        value = headers.get(name)
+        if value:
+            return value
+    return None
+
+
+class DownloadCache(object):
+    """
+    Content addressed cache of downloaded files.  Entries are keyed by the
+    checksum of the download, or by url and the ETag or Last-Modified of
+    the response when no checksum is known.  Files are copied in and out of
+    the cache, an entry never shares its inode with a file the caller may
+    change, and removing an entry always frees its space.
+
+    The cache keeps its files under path and no more than max_size bytes of
+    them, the least recently used are removed first.  The cache is off when
+    max_size is 0.  The modification time of an entry is its last use so
+    that all agent processes share the LRU order.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def checksum_key(checksum, decompressed):
+        return 'sum-{0}{1}'.format(checksum, '-d' if decompressed else '')
+
+    @staticmethod
+    def url_key(url, validator, decompressed):
+        if not validator:
+            return None
+        digest = hashlib.sha1('{0}\0{1}'.format(url, validator)).hexdigest()
+        return 'url-{0}{1}'.format(digest, '-d' if decompressed else '')
+
+    def fetch(self, key, destination):
+        """
+        Puts the entry for key at destination, returns False if there is
+        none.
+        """
+        entry = os.path.join(self.path, key)
+        try:
+            shutil.copyfile(entry, destination)
+            os.utime(entry, None)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                log.exception('Failed to read download cache entry %s', key)
+            self._count(miss=True)
+            return False
+
+        self._count(hit=True)
+        return True
+
+    def store(self, key, file_name):
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        temp_name = temp_file(self.path)
+        try:
+            shutil.copyfile(file_name, temp_name)
+            os.rename(temp_name, os.path.join(self.path, key))
+        except (IOError, OSError):
+            log.exception('Failed to add %s to the download cache', key)
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            return
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._evictions += 1
+
+    def _count(self, hit=False, miss=False):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            if miss:
+                self._misses += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hitRate': float(self._hits) / lookups if lookups else 0.0,
+            }
@@ -1,38 +1,283 @@
 import portalocker
+import errno
 import os
+import threading
+import time
+from collections import deque, OrderedDict
 from cattle import Config
 
+# Number of lock keys wait and hold times are kept for
+STATS_SIZE = 1024
+
 
 class FailedToLock(Exception):
     pass
 
 
+class _Key(object):
+    __slots__ = ('waiters', 'acquired')
+
+    def __init__(self):
+        self.waiters = deque()
+        self.acquired = 0
+
+
+class LockManager(object):
+    """
+    Table of the locks held in this process, keyed by lock name.  A free
+    lock is taken with no system calls.  Waiters of a held lock are queued
+    and the lock is handed to them in order when it is released, each
+    waits no longer than its own deadline.  The time spent waiting for and
+    holding every lock name is recorded, see stats().
+
+    The table is reset when the process forks, a child holds none of the
+    locks of its parent.
+    """
+
+    def __init__(self):
+        self._init_lock = threading.Lock()
+        self._pid = None
+        self._lock = None
+        self._keys = {}
+        self._stats = OrderedDict()
+
+    def _table_lock(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._init_lock:
+                if self._pid != pid:
+                    # Made here so it is green when eventlet is used
+                    self._lock = threading.Lock()
+                    self._keys = {}
+                    self._stats = OrderedDict()
+                    self._pid = pid
+        return self._lock
+
+    def acquire(self, name, timeout=None):
+        """
+        Takes the lock name, raises FailedToLock if it is held and timeout
+        is None or it is not released to this caller within timeout
+        seconds.
+        """
+        table_lock = self._table_lock()
+        start = time.time()
+
+        with table_lock:
+            key = self._keys.get(name)
+            if key is None:
+                key = _Key()
+                key.acquired = start
+                self._keys[name] = key
+                self._record(name, wait=0)
+                return
+
+            if timeout is None:
+                self._record(name, failed=True)
+                raise FailedToLock("Failed to lock [{0}]".format(name))
+
+            waiter = threading.Event()
+            key.waiters.append(waiter)
+
+        waiter.wait(max(0, timeout))
+
+        with table_lock:
+            if not waiter.is_set():
+                key.waiters.remove(waiter)
+                self._record(name, failed=True)
+                raise FailedToLock("Timed out locking [{0}]".format(name))
+
+            now = time.time()
+            key.acquired = now
+            self._record(name, wait=now - start)
+
+    def release(self, name):
+        with self._table_lock():
+            key = self._keys[name]
+            self._record(name, hold=time.time() - key.acquired)
+            if key.waiters:
+                # Hand the lock over, the first waiter now holds it
+                key.waiters.popleft().set()
+            else:
+                del self._keys[name]
+
+    def held(self, name):
+        with self._table_lock():
+            return name in self._keys
+
+    def _record(self, name, wait=None, hold=None, failed=False):
+        stats = self._stats.pop(name, None)
+        if stats is None:
+            stats = {
+                'acquired': 0,
+                'contended': 0,
+                'failed': 0,
+                'waitTime': 0.0,
+                'maxWaitTime': 0.0,
+                'holdTime': 0.0,
+                'maxHoldTime': 0.0,
+            }
+        self._stats[name] = stats
+        while len(self._stats) > STATS_SIZE:
+            self._stats.popitem(last=False)
+
+        if failed:
+            stats['failed'] += 1
+        if wait is not None:
+            stats['acquired'] += 1
+            if wait > 0:
+                stats['contended'] += 1
+            stats['waitTime'] += wait
+            stats['maxWaitTime'] = max(stats['maxWaitTime'], wait)
+        if hold is not None:
+            stats['holdTime'] += hold
+            stats['maxHoldTime'] = max(stats['maxHoldTime'], hold)
+
+    def stats(self):
+        with self._table_lock():
+            return dict((name, dict(stats))
+                        for name, stats in self._stats.items())
+
+
+_MANAGER = LockManager()
+
+
+_LOCK_DIRS = set()
+
+
+def _lock_file(name):
+    lock_dir = Config.lock_dir()
+    if lock_dir not in _LOCK_DIRS:
+        try:
+            os.makedirs(lock_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        _LOCK_DIRS.add(lock_dir)
+    return os.path.join(lock_dir, name)
+
+
+def _is_current(fh, path):
+    """
+    Returns True if the locked file fh is still the lock file at path, the
+    last holder may have removed it while this process waited for it.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+    fst = os.fstat(fh.fileno())
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+
 class LockWrapper(object):
-    def __init__(self, name, lock):
+    """
+    Holds the lock name of the in-process LockManager and, when the workers
+    are separate processes, the lock file of the same name.  The holder
+    removes the lock file before it unlocks it so the lock directory does
+    not grow.  A process that was waiting on the removed file checks after
+    locking that it is still the one at the path, and starts over on the
+    new file otherwise.
+    """
+
+    def __init__(self, name, timeout=None):
         self._name = name
-        self._lock = lock
+        self._timeout = timeout
+        self._file_lock = None
+        self._path = None
 
     def __enter__(self):
+        deadline = None
+        if self._timeout is not None:
+            deadline = time.time() + self._timeout
+
+        _MANAGER.acquire(self._name, self._timeout)
+        if not Config.is_multi_proc():
+            return
+
         try:
-            return self._lock.__enter__()
-        except portalocker.AlreadyLocked:
+            self._path = _lock_file(self._name)
+            while True:
+                if deadline is None:
+                    file_lock = portalocker.Lock(self._path)
+                else:
+                    file_lock = portalocker.Lock(
+                        self._path,
+                        timeout=max(0, deadline - time.time()),
+                        fail_when_locked=False)
+                fh = file_lock.acquire()
+                if _is_current(fh, self._path):
+                    self._file_lock = file_lock
+                    return fh
+                file_lock.release()
+        except portalocker.LockException:
+            _MANAGER.release(self._name)
             raise FailedToLock("Failed to lock [{0}]".format(self._name))
+        except:
+            _MANAGER.release(self._name)
+            raise
 
     def __exit__(self, type, value, tb):
-        if os.path.exists(self._lock.filename):
-            os.unlink(self._lock.filename)
+        try:
+            if self._file_lock is not None:
+                try:
+                    os.remove(self._path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                finally:
+                    self._file_lock.__exit__(type, value, tb)
+                    self._file_lock = None
+        finally:
+            _MANAGER.release(self._name)
 
-        return self._lock.__exit__(type, value, tb)
 
+def lock(obj, timeout=None):
+    """
+    Without a timeout a held lock raises FailedToLock, with one it waits up
+    to timeout seconds for it first.  Waiters in this process get the lock
+    in the order they asked for it.
 
-def lock(obj):
+    Failing right away is the default on purpose.  The event handlers lock
+    without a timeout, a worker that gets FailedToLock defers the event and
+    goes on with others instead of blocking on it, see _Deferred in
+    cattle.agent.event.  Callers that would rather wait pass a timeout.
+    """
     if isinstance(obj, basestring):
         lock_name = obj
     else:
         lock_name = "{0}-{1}".format(obj["type"], obj["id"])
 
-    lock_dir = Config.lock_dir()
-    if not os.path.exists(lock_dir):
-        os.mkdir(lock_dir)
-    return LockWrapper(lock_name,
-                       portalocker.Lock(os.path.join(lock_dir, lock_name)))
+    return LockWrapper(lock_name, timeout)
+
+
+def lock_stats():
+    """
+    Returns the wait and hold times of each lock name of this process.
+    """
+    return _MANAGER.stats()
+
+
+def lock_summary():
+    """
+    Returns the lock_stats() of all lock names added up, with the name
+    waited on longest.
+    """
+    summary = {
+        'names': 0,
+        'acquired': 0,
+        'contended': 0,
+        'failed': 0,
+        'waitTime': 0.0,
+        'maxWaitTime': 0.0,
+        'maxWaitName': None,
+    }
+    for name, stats in lock_stats().items():
+        summary['names'] += 1
+        for key in ['acquired', 'contended', 'failed', 'waitTime']:
+            summary[key] += stats[key]
+        if stats['maxWaitTime'] > summary['maxWaitTime']:
+            summary['maxWaitTime'] = stats['maxWaitTime']
+            summary['maxWaitName'] = name
+    return summary
@@ -7,6 +7,9 @@ from cattle.process_manager import background
 class Cadvisor(object):
 
     def on_startup(self):
+        if not Config.cadvisor_enabled():
+            return
+
         cmd = ['cadvisor',
                '-logtostderr=true',
                '-listen_ip', Config.cadvisor_ip(),
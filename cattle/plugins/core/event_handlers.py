@@ -45,12 +45,13 @@ class ConfigUpdateHandler:
         if not _should_handle(self, event):
             return
 
-        if len(event.data.items) == 0:
+        items = event.data.get('items')
+        if len(items) == 0:
             return utils.reply(event)
 
         item_names = []
 
-        for item in event.data.items:
+        for item in items:
             # For development, don't let the server kill your agent
             if item.name != 'pyagent' or Config.config_update_pyagent():
                 item_names.append(item.name)
@@ -1,3 +1,5 @@
+from cattle import type_manager
+from cattle.agent.handler import KindBasedMixin
 from cattle.type_manager import get_type_list
 from cattle.type_manager import PRE_REQUEST_HANDLER, STORAGE_DRIVER
 from cattle.type_manager import COMPUTE_DRIVER, POST_REQUEST_HANDLER
@@ -5,32 +7,131 @@ from cattle.type_manager import REQUEST_HANDLER
 
 
 class Router:
+    """
+    Routes requests through a dispatch table that maps each event name to
+    the ordered handlers for it.  The table is built from the type registry
+    the first time it is used and again whenever a type is registered, so
+    routing a request is a dict lookup plus the kind check.
+    """
+
     def __init__(self):
-        pass
+        self._generation = None
+        self._table = {}
 
     def route(self, req):
-        for handler in _handlers(req):
-            resp = handler.execute(req)
+        for execute in self._handlers(req):
+            resp = execute(req)
             if resp is not None:
                 return resp
 
+    def _handlers(self, req):
+        kinds = None
+        for step in self._entry(req.name.split(';', 1)[0]):
+            if isinstance(step, _KindGroup):
+                if kinds is None:
+                    kinds = KindBasedMixin.request_kinds(req)
+                for execute in step.select(kinds):
+                    yield execute
+            else:
+                execute, check = step
+                if check is None or check(req):
+                    yield execute
+
+    def _entry(self, name):
+        generation = type_manager.generation()
+        if generation != self._generation:
+            self._table = _build_table()
+            self._generation = generation
+
+        try:
+            return self._table[name]
+        except KeyError:
+            # Not an event any handler lists, still route it the same way
+            entry = _build_entry(name)
+            self._table[name] = entry
+            return entry
+
+
+class _KindGroup(object):
+    """
+    Consecutive kind based drivers of a dispatch entry, indexed by kind.
+    """
+
+    def __init__(self):
+        self._ordered = []
+        self._by_kind = {}
+
+    def add(self, kind, execute):
+        self._ordered.append((kind, execute))
+        self._by_kind.setdefault(kind, []).append(execute)
+
+    def select(self, kinds):
+        if len(kinds) == 1:
+            return self._by_kind.get(kinds[0], [])
+        return [execute for kind, execute in self._ordered if kind in kinds]
+
+
+def _event_names():
+    names = set()
+    for type_name in [PRE_REQUEST_HANDLER, STORAGE_DRIVER, COMPUTE_DRIVER,
+                      REQUEST_HANDLER, POST_REQUEST_HANDLER]:
+        for handler in get_type_list(type_name):
+            if hasattr(handler, 'events'):
+                names.update(handler.events())
+    return names
+
+
+def _build_table():
+    table = {}
+    for name in _event_names():
+        table[name] = _build_entry(name)
+    return table
+
+
+def _listens(handler, name):
+    if not hasattr(handler, 'events'):
+        return True
+    return name in handler.events()
+
+
+def _build_entry(name):
+    entry = []
 
-def _handlers(req):
     for pre in get_type_list(PRE_REQUEST_HANDLER):
-        yield pre
+        if _listens(pre, name):
+            entry.append((pre.execute, None))
 
     drivers = []
-    if req.name.startswith("storage."):
-        drivers = get_type_list(STORAGE_DRIVER)
+    if name.startswith("storage."):
+        drivers.extend(get_type_list(STORAGE_DRIVER))
 
-    if req.name.startswith("compute."):
-        drivers = get_type_list(COMPUTE_DRIVER)
+    if name.startswith("compute."):
+        drivers.extend(get_type_list(COMPUTE_DRIVER))
 
     drivers.extend(get_type_list(REQUEST_HANDLER))
 
+    group = None
     for driver in drivers:
-        if driver.supports(req):
-            yield driver
+        if not hasattr(driver, 'dispatcher'):
+            group = None
+            entry.append((driver.execute, driver.supports))
+            continue
+
+        execute = driver.dispatcher(name)
+        if execute is None:
+            continue
+
+        if isinstance(driver, KindBasedMixin):
+            if group is None:
+                group = _KindGroup()
+                entry.append(group)
+            group.add(driver.kind, execute)
+        else:
+            group = None
+            entry.append((execute, driver._check_supports))
 
     for post in get_type_list(POST_REQUEST_HANDLER):
-        yield post
+        if _listens(post, name):
+            entry.append((post.execute, None))
+
+    return entry
@@ -1,15 +1,83 @@
 import json
+import logging
+
+from cattle import Config
 from cattle.utils import JsonObject
 
+log = logging.getLogger('marshaller')
+
+
+def _ujson():
+    import ujson
+
+    def loads(string):
+        return ujson.loads(string, precise_float=True)
+
+    # ujson separates and escapes differently, so it only decodes
+    return loads, None
+
+
+def _simplejson():
+    import simplejson
+    return simplejson.loads, simplejson.dumps
+
+
+def _json():
+    return json.loads, json.dumps
+
+
+# Fastest first, the stdlib json module is always there to fall back to
+BACKENDS = [
+    ('ujson', _ujson),
+    ('simplejson', _simplejson),
+    ('json', _json),
+]
+
+
+def load_backend(name='auto'):
+    """
+    Returns (decoder name, loads, encoder name, dumps) for the backend
+    name, 'auto' takes the fastest one installed.  Every encoder writes the
+    same bytes as json.dumps.
+    """
+    if name != 'auto' and name not in dict(BACKENDS):
+        log.warning('Unknown JSON backend %s, using json', name)
+        name = 'json'
+
+    loads = dumps = None
+    for backend, factory in BACKENDS:
+        if name != 'auto' and backend not in (name, 'json'):
+            continue
+
+        try:
+            backend_loads, backend_dumps = factory()
+        except ImportError:
+            if backend == name:
+                log.warning('JSON backend %s is not installed, using json',
+                            name)
+            continue
+
+        if loads is None:
+            loads = (backend, backend_loads)
+        if dumps is None and backend_dumps is not None:
+            dumps = (backend, backend_dumps)
+
+    return loads + dumps
+
 
 class Marshaller:
-    def __init__(self):
-        pass
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = Config.json_backend()
+
+        self.decoder, self._loads, self.encoder, self._dumps = \
+            load_backend(backend)
+        log.info('Decoding JSON with %s, encoding with %s', self.decoder,
+                 self.encoder)
 
     def from_string(self, string):
-        obj = json.loads(string)
+        obj = self._loads(string)
         return JsonObject(obj)
 
     def to_string(self, obj):
-        obj = JsonObject.unwrap(obj)
-        return json.dumps(obj)
+        return self._dumps(obj)
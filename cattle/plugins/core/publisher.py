@@ -1,6 +1,11 @@
 import logging
+import os
 import requests
 import time
+from Queue import Queue
+from threading import Condition, Event, Lock, Thread
+
+from cattle import Config
 from cattle import type_manager
 from cattle.utils import log_request
 
@@ -8,26 +13,87 @@ from cattle.utils import log_request
 log = logging.getLogger("agent")
 
 
+class PublishError(Exception):
+    pass
+
+
+class PublishFuture(object):
+    """
+    The delivery of one reply.  result() waits for it and returns the seconds
+    from publish() until the server accepted the reply or raises the reason
+    it could not be delivered.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self._latency = None
+        self._exception = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise PublishError('Timed out waiting for the reply to be sent')
+        if self._exception is not None:
+            raise self._exception
+        return self._latency
+
+    def set_result(self, latency):
+        self._latency = latency
+        self._event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._event.set()
+
+
 class Publisher:
-    def __init__(self, url, auth):
+    def __init__(self, url, auth, mode=None):
         self._url = url
         self._auth = auth
         self._marshaller = type_manager.get_type(type_manager.MARSHALLER)
         self._session = requests.Session()
+        self._outbox = None
+
+        if mode is None:
+            mode = Config.publisher_mode()
+        if mode == 'async':
+            self._outbox = Outbox(url, auth)
 
     def publish(self, resp):
         line = self._marshaller.to_string(resp)
 
+        if self._outbox is not None:
+            return self._outbox.put(resp, line)
+
+        future = PublishFuture()
         start = time.time()
         try:
             r = self._session.post(self._url, data=line, auth=self._auth,
                                    timeout=60)
-            if r.status_code != 201:
+            if r.status_code == 201:
+                future.set_result(time.time() - start)
+            else:
                 log.error("Error [%s], Request [%s]", r.text, line)
+                future.set_exception(PublishError(
+                    'Error [{0}], Request [{1}]'.format(r.text, line)))
         finally:
             log_request(resp, log, 'Response: %s [%s] seconds', line,
                         time.time() - start)
 
+        return future
+
+    def flush(self, timeout=None):
+        if self._outbox is None:
+            return True
+        return self._outbox.flush(timeout)
+
+    def stats(self):
+        if self._outbox is None:
+            return {}
+        return self._outbox.stats()
+
     @property
     def url(self):
         return self._url
@@ -35,3 +101,175 @@ class Publisher:
     @property
     def auth(self):
         return self._auth
+
+
+def _reply_key(resp):
+    try:
+        return resp['previousIds'][0]
+    except (KeyError, IndexError, TypeError):
+        return resp.get('id')
+
+
+class Outbox(object):
+    """
+    Replies waiting to be posted by a small pool of sender threads.
+
+    Replies to the same event always go to the same sender so they reach the
+    server in the order they were published, replies to different events
+    are sent concurrently.  Each sender keeps its own keep-alive session and
+    retries connection errors and 5xx responses with exponential backoff.
+    put() blocks while the outbox is full.
+
+    The senders are started by the first put() of every process, workers
+    forked after the publisher was created get their own.
+    """
+
+    def __init__(self, url, auth, depth=None, senders=None, retries=None,
+                 backoff=None, max_backoff=None):
+        self._url = url
+        self._auth = auth
+        self._depth = depth or Config.publisher_queue_depth()
+        self._senders = senders or Config.publisher_senders()
+        self._retries = Config.publisher_retries() if retries is None \
+            else retries
+        self._backoff = Config.publisher_retry_backoff() if backoff is None \
+            else backoff
+        self._max_backoff = max_backoff or \
+            Config.publisher_max_retry_backoff()
+
+        self._pid = None
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        self._queues = []
+        self._pending = 0
+        self._stats = {}
+
+    def put(self, resp, line):
+        self._ensure_started()
+
+        future = PublishFuture()
+        queue = self._queues[hash(_reply_key(resp)) % len(self._queues)]
+        with self._lock:
+            self._pending += 1
+        queue.put((resp, line, future, time.time()))
+        return future
+
+    def depth(self):
+        if self._pid != os.getpid():
+            return 0
+        return sum(q.qsize() for q in self._queues)
+
+    def flush(self, timeout=None):
+        """
+        Waits until every reply put so far was sent or given up on, returns
+        False if that did not happen within timeout seconds.
+        """
+        if self._pid != os.getpid():
+            return True
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending > 0:
+                if deadline is None:
+                    self._idle.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['depth'] = self.depth()
+        sent = stats.get('sent', 0)
+        if sent:
+            stats['latencyAvg'] = stats.pop('latencyTotal') / sent
+        return stats
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            self._queues = []
+            self._pending = 0
+            self._stats = {
+                'sent': 0,
+                'failed': 0,
+                'retries': 0,
+                'latencyTotal': 0.0,
+                'latencyMax': 0.0,
+            }
+            size = max(1, self._depth // self._senders)
+            for i in range(self._senders):
+                queue = Queue(size)
+                t = Thread(target=self._send_loop, args=(queue,),
+                           name='publisher{0}'.format(i))
+                t.daemon = True
+                t.start()
+                self._queues.append(queue)
+            self._pid = pid
+
+    def _send_loop(self, queue):
+        session = requests.Session()
+        while True:
+            resp, line, future, queued = queue.get()
+            try:
+                self._deliver(session, resp, line, future, queued)
+            except Exception as e:
+                log.exception('Failed to publish [%s]', line)
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def _deliver(self, session, resp, line, future, queued):
+        attempt = 0
+        while True:
+            start = time.time()
+            retry = True
+            try:
+                r = session.post(self._url, data=line, auth=self._auth,
+                                 timeout=60)
+                if r.status_code == 201:
+                    break
+                error = PublishError('Error [{0}], Request [{1}]'
+                                     .format(r.text, line))
+                retry = r.status_code >= 500
+            except requests.RequestException as e:
+                error = e
+
+            if not retry or attempt >= self._retries:
+                log.error('Giving up on publishing [%s] after [%s] attempts:'
+                          ' %s', line, attempt + 1, error)
+                self._count('failed')
+                future.set_exception(error)
+                return
+
+            self._count('retries')
+            time.sleep(min(self._backoff * 2 ** attempt, self._max_backoff))
+            attempt += 1
+
+        latency = time.time() - queued
+        with self._lock:
+            self._stats['sent'] += 1
+            self._stats['latencyTotal'] += latency
+            self._stats['latencyMax'] = max(self._stats['latencyMax'],
+                                            latency)
+
+        log_request(resp, log, 'Response: %s [%s] seconds, [%s] since '
+                    'publish, [%s] queued', line, time.time() - start,
+                    latency, self.depth())
+        future.set_result(latency)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
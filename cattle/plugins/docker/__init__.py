@@ -1,7 +1,9 @@
 import logging
+import os
 
 from docker.utils import kwargs_from_env
 from cattle import default_value, Config
+from cattle.plugins.docker.pool import ClientPool, tls_identity
 
 log = logging.getLogger('docker')
 
@@ -50,6 +52,19 @@ class DockerConfig:
     def delegate_timeout():
         return int(default_value('DOCKER_DELEGATE_TIMEOUT', '120'))
 
+    @staticmethod
+    def delegate_retry_timeout():
+        return float(default_value('DOCKER_DELEGATE_RETRY_TIMEOUT', '3'))
+
+    @staticmethod
+    def delegate_exec_helper():
+        return default_value('DOCKER_DELEGATE_EXEC_HELPER', 'true') == 'true'
+
+    @staticmethod
+    def delegate_exec_helper_idle_timeout():
+        return float(default_value('DOCKER_DELEGATE_EXEC_HELPER_IDLE_TIMEOUT',
+                                   '600'))
+
     @staticmethod
     def use_boot2docker_connection_env_vars():
         use_b2d = default_value('DOCKER_USE_BOOT2DOCKER', 'false')
@@ -59,8 +74,60 @@ class DockerConfig:
     def is_host_pidns():
         return default_value('AGENT_PIDNS', 'container') == 'host'
 
+    @staticmethod
+    def container_index_enabled():
+        return default_value('DOCKER_CONTAINER_INDEX', 'true') == 'true'
+
+    @staticmethod
+    def event_retry_interval():
+        return int(default_value('DOCKER_EVENT_RETRY_INTERVAL', '5'))
+
+    @staticmethod
+    def event_feed_socket():
+        return default_value('DOCKER_EVENT_FEED_SOCKET',
+                             os.path.join(Config.state_dir(),
+                                          'docker-events.sock'))
+
+    @staticmethod
+    def image_index_enabled():
+        return default_value('DOCKER_IMAGE_INDEX', 'true') == 'true'
+
+    @staticmethod
+    def image_index_refresh_interval():
+        return int(default_value('DOCKER_IMAGE_INDEX_REFRESH_INTERVAL',
+                                 '300'))
 
-def docker_client(version=None, base_url_override=None, tls_config=None):
+    @staticmethod
+    def client_pool_size():
+        return int(default_value('DOCKER_CLIENT_POOL_SIZE', '32'))
+
+    @staticmethod
+    def max_connections():
+        return int(default_value('DOCKER_MAX_CONNECTIONS', '10'))
+
+    @staticmethod
+    def cluster_client_cache_size():
+        return int(default_value('DOCKER_CLUSTER_CLIENT_CACHE_SIZE', '16'))
+
+    @staticmethod
+    def pull_lock_timeout():
+        return int(default_value('DOCKER_PULL_LOCK_TIMEOUT', '1800'))
+
+    @staticmethod
+    def container_stats_enabled():
+        return default_value('DOCKER_CONTAINER_STATS', 'true') == 'true'
+
+    @staticmethod
+    def cgroup_root():
+        return default_value('DOCKER_CGROUP_ROOT', '/sys/fs/cgroup')
+
+
+def docker_client(version=None, base_url_override=None, tls_config=None,
+                  pooled=True):
+    """
+    Returns the shared client for the endpoint, pooled=False gets a new
+    client for callers that change it or hold on to it like event streams.
+    """
     if DockerConfig.use_boot2docker_connection_env_vars():
         kwargs = kwargs_from_env(assert_hostname=False)
     else:
@@ -76,8 +143,34 @@ def docker_client(version=None, base_url_override=None, tls_config=None):
         version = DockerConfig.api_version()
 
     kwargs['version'] = version
-    log.debug('docker_client=%s', kwargs)
-    return Client(**kwargs)
+
+    if not pooled:
+        log.debug('docker_client=%s', kwargs)
+        return Client(**kwargs)
+
+    key = (kwargs.get('base_url'), version, tls_identity(kwargs.get('tls')))
+    return _CLIENTS.get(key, lambda: Client(**kwargs))
+
+
+def client_pool_stats():
+    return _CLIENTS.stats()
+
+
+class DockerClients(object):
+    """
+    Reports the counters of the Docker client pool with the other stats
+    of the workers.
+    """
+
+    def on_startup(self):
+        pass
+
+    def stats(self):
+        return client_pool_stats()
+
+
+_CLIENTS = ClientPool(DockerConfig.client_pool_size(),
+                      DockerConfig.max_connections())
 
 
 def pull_image(image, progress):
@@ -96,7 +189,7 @@ except:
 
 try:
     if _ENABLED:
-        docker_client().info()
+        docker_client(pooled=False).info()
 except Exception, e:
     log.exception('Disabling docker, could not contact docker')
     _ENABLED = False
@@ -105,6 +198,7 @@ if _ENABLED and DockerConfig.docker_enabled():
     from .storage import DockerPool
     from .compute import DockerCompute
     from .delegate import DockerDelegate
+    from .events import DockerEvents
     from cattle import type_manager
 
     _DOCKER_POOL = DockerPool()
@@ -114,6 +208,8 @@ if _ENABLED and DockerConfig.docker_enabled():
     type_manager.register_type(type_manager.COMPUTE_DRIVER, _DOCKER_COMPUTE)
     type_manager.register_type(type_manager.PRE_REQUEST_HANDLER,
                                _DOCKER_DELEGATE)
+    type_manager.register_type(type_manager.LIFECYCLE, DockerEvents())
+    type_manager.register_type(type_manager.LIFECYCLE, DockerClients())
 
 if not _ENABLED and DockerConfig.docker_required():
     raise Exception('Failed to initialize Docker')
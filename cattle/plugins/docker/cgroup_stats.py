@@ -0,0 +1,153 @@
+import errno
+import logging
+import os
+import time
+from array import array
+from threading import Lock
+
+from . import DockerConfig
+
+log = logging.getLogger('docker')
+
+# Where the cgroupfs and the systemd cgroup drivers put a container
+CGROUP_LAYOUTS = ['docker/{0}', 'system.slice/docker-{0}.scope']
+
+# Counters kept per container: CPU nanoseconds, bytes read, bytes written
+COUNTERS = 3
+
+
+def _read_int(path):
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def _blkio_bytes(path):
+    read = written = 0
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            if fields[1] == 'Read':
+                read += int(fields[2])
+            elif fields[1] == 'Write':
+                written += int(fields[2])
+    return read, written
+
+
+class ContainerStats(object):
+    """
+    Resource usage of the running containers read straight from their
+    cgroups: cpuacct.usage, memory.usage_in_bytes and limit_in_bytes, and
+    blkio.throttle.io_service_bytes under DockerConfig.cgroup_root().
+
+    The counters of the last collection are kept in one flat array, three
+    numbers a container, and the CPU and disk rates are derived from the
+    time since then.  A container seen for the first time has no rates
+    until the next collection.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+        self._lock = Lock()
+        self._time = None
+        self._slots = {}
+        self._counters = array('d')
+        self._paths = {}
+        self._layout = 0
+
+    def _find(self, root, id):
+        """
+        Returns the cgroup of a container relative to a hierarchy, trying
+        the layout that last matched first.
+        """
+        order = [self._layout] + [i for i in range(len(CGROUP_LAYOUTS))
+                                  if i != self._layout]
+        for i in order:
+            path = CGROUP_LAYOUTS[i].format(id)
+            if os.path.isdir(os.path.join(root, 'cpuacct', path)):
+                self._layout = i
+                return path
+        return None
+
+    def _read(self, root, path):
+        cpu = _read_int(os.path.join(root, 'cpuacct', path, 'cpuacct.usage'))
+        memory = os.path.join(root, 'memory', path)
+        usage = _read_int(os.path.join(memory, 'memory.usage_in_bytes'))
+        limit = _read_int(os.path.join(memory, 'memory.limit_in_bytes'))
+        read, written = _blkio_bytes(os.path.join(
+            root, 'blkio', path, 'blkio.throttle.io_service_bytes'))
+        return (cpu, read, written), usage, limit
+
+    def collect(self, ids, now=None):
+        """
+        Returns the stats of the containers ids as one list per stat, in the
+        order of 'ids'.  Containers without a cgroup are left out.
+        """
+        with self._lock:
+            return self._collect(ids, now)
+
+    def _collect(self, ids, now):
+        root = self._root or DockerConfig.cgroup_root()
+        if now is None:
+            now = time.time()
+
+        elapsed = None
+        if self._time is not None and now > self._time:
+            elapsed = now - self._time
+
+        data = {
+            'ids': [],
+            'cpuPercentages': [],
+            'memoryUsage': [],
+            'memoryLimit': [],
+            'diskReadBytesPerSecond': [],
+            'diskWriteBytesPerSecond': [],
+        }
+
+        slots = {}
+        counters = array('d')
+        paths = {}
+
+        for id in ids:
+            path = self._paths.get(id) or self._find(root, id)
+            if path is None:
+                continue
+
+            try:
+                values, usage, limit = self._read(root, path)
+            except (IOError, OSError) as e:
+                # Stopped since it was listed
+                if e.errno != errno.ENOENT:
+                    log.exception('Failed to read cgroup of %s', id)
+                continue
+
+            rates = [None] * COUNTERS
+            slot = self._slots.get(id)
+            if slot is not None and elapsed is not None:
+                offset = slot * COUNTERS
+                previous = self._counters[offset:offset + COUNTERS]
+                rates = [max(0, v - p) / elapsed
+                         for v, p in zip(values, previous)]
+                # Nanoseconds a second to percent of one core
+                rates = [round(rates[0] / 10**7, 3),
+                         round(rates[1], 3),
+                         round(rates[2], 3)]
+
+            slots[id] = len(data['ids'])
+            counters.extend(values)
+            paths[id] = path
+
+            data['ids'].append(id)
+            data['cpuPercentages'].append(rates[0])
+            data['memoryUsage'].append(usage)
+            data['memoryLimit'].append(limit)
+            data['diskReadBytesPerSecond'].append(rates[1])
+            data['diskWriteBytesPerSecond'].append(rates[2])
+
+        self._time = now
+        self._slots = slots
+        self._counters = counters
+        self._paths = paths
+
+        return data
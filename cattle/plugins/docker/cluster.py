@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from os import path, makedirs
+from threading import Lock
+
+from docker import tls
+
+from cattle import Config
+from cattle.plugins.docker import docker_client
+
+log = logging.getLogger('docker')
+
+_CERT_FILES = [('caCrt', 'ca.crt'), ('clientCrt', 'client.crt'),
+               ('clientKey', 'client.key')]
+_HASH_FILE = '.sha1'
+
+
+def _write_certs(cert_dir, certs, digest):
+    """
+    Writes the cert files of an account unless the hash file next to them
+    says they already hold this content.
+    """
+    hash_file = path.join(cert_dir, _HASH_FILE)
+    try:
+        with open(hash_file) as f:
+            if f.read().strip() == digest:
+                return
+    except IOError:
+        pass
+
+    if not path.exists(cert_dir):
+        log.debug('Creating client cert directory: %s', cert_dir)
+        makedirs(cert_dir)
+
+    for field, name in _CERT_FILES:
+        if certs[field]:
+            log.debug('Writing %s', name)
+            with open(path.join(cert_dir, name), 'w') as f:
+                f.write(certs[field])
+
+    with open(hash_file, 'w') as f:
+        f.write(digest)
+
+
+class ClusterClients(object):
+    """
+    Docker clients for clusterConnection hosts, cached per account and
+    cluster url together with the hash of the certs they were made with.
+    Certs are written and a new TLS config and client made only when the
+    host shows up with different certs, the least recently used client is
+    closed when there are more than size of them.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._lock = Lock()
+        self._pid = None
+        self._clients = OrderedDict()
+
+    def get(self, host, cluster_connection):
+        try:
+            account_id = host['accountId']
+            certs = dict((field, host[field]) for field, _ in _CERT_FILES)
+        except (KeyError, AttributeError) as e:
+            raise Exception(
+                'Unable to process cert/keys for cluster',
+                cluster_connection,
+                e)
+
+        digest = hashlib.sha1('\0'.join(certs[field] or ''
+                                        for field, _ in _CERT_FILES)) \
+            .hexdigest()
+        key = (str(account_id), cluster_connection)
+
+        with self._lock:
+            self._check_pid()
+            cached = self._clients.pop(key, None)
+            if cached is not None and cached[0] == digest:
+                self._clients[key] = cached
+                return cached[1]
+
+        if cached is not None:
+            cached[1].close()
+
+        cert_dir = path.join(Config.client_certs_dir(), str(account_id))
+        _write_certs(cert_dir, certs, digest)
+
+        tls_config = None
+        if all(certs.values()):
+            tls_config = tls.TLSConfig(
+                client_cert=(
+                    path.join(cert_dir, 'client.crt'),
+                    path.join(cert_dir, 'client.key')
+                ),
+                verify=path.join(cert_dir, 'ca.crt'),
+                assert_hostname=False
+            )
+
+        client = docker_client(base_url_override=cluster_connection,
+                               tls_config=tls_config, pooled=False)
+
+        with self._lock:
+            self._check_pid()
+            self._clients[key] = (digest, client)
+            evicted = []
+            while len(self._clients) > self._size:
+                evicted.append(self._clients.popitem(last=False)[1][1])
+
+        for old in evicted:
+            old.close()
+
+        return client
+
+    def _check_pid(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._clients = OrderedDict()
+            self._pid = pid
@@ -1,29 +1,37 @@
+import copy
 import logging
 import socket
 from os import path, remove, makedirs, rename, environ
 
-from . import docker_client, pull_image
+from . import docker_client, pull_image, events
 from . import DockerConfig
 from .storage import DockerPool
-from cattle import Config
+from cattle import Config, process_manager
 from cattle.compute import BaseComputeDriver
 from cattle.agent.handler import KindBasedMixin
 from cattle.type_manager import get_type, MARSHALLER
 from cattle import utils
 from cattle.utils import JsonObject
 from docker.errors import APIError
-from docker import tls
 from cattle.plugins.host_info.main import HostInfo
+from cattle.plugins.host_info.sampler import get_sampler
 from cattle.plugins.docker.util import add_label, is_no_op, remove_container
 from cattle.progress import Progress
 from cattle.lock import lock
 from cattle.plugins.docker.network import setup_ipsec, setup_links, \
     setup_mac_and_ip, setup_ports, setup_network_mode
 from cattle.plugins.docker.agent import setup_cattle_config_url
+from cattle.plugins.docker.index import get_container_index, \
+    get_image_index
+from cattle.plugins.docker.report import InstanceReporter
+from cattle.plugins.docker.cluster import ClusterClients
+from cattle.plugins.docker.cgroup_stats import ContainerStats
 
 
 log = logging.getLogger('docker')
 
+_CLUSTER_CLIENTS = ClusterClients(DockerConfig.cluster_client_cache_size())
+
 SYSTEM_LABEL = 'io.rancher.container.system'
 
 CREATE_CONFIG_FIELDS = [
@@ -81,7 +89,10 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         KindBasedMixin.__init__(self, kind='docker')
         BaseComputeDriver.__init__(self)
         self.host_info = HostInfo(docker_client())
+        events.add_listener(self.host_info.facts)
         self.system_images = self.get_agent_images(docker_client())
+        self.instance_reporter = InstanceReporter()
+        self.container_stats = ContainerStats()
 
     def get_agent_images(self, client):
         images = client.images(filters={'label': SYSTEM_LABEL})
@@ -100,7 +111,11 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
 
     @staticmethod
     def get_container_by(client, func):
-        containers = client.containers(all=True, trunc=False)
+        index = get_container_index(client)
+        if index is None:
+            containers = client.containers(all=True, trunc=False)
+        else:
+            containers = index.containers()
         containers = filter(func, containers)
 
         if len(containers) > 0:
@@ -112,10 +127,17 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         if not DockerConfig.docker_enabled():
             return
 
-        self._add_resources(ping, pong)
-        self._add_instances(ping, pong)
+        # The containers are listed once for the stats and the instances
+        listing = []
+        self._add_resources(ping, pong, listing)
+        self._add_instances(ping, pong, listing)
+
+    def _listed(self, listing):
+        if not listing:
+            listing.append(self._get_all_containers_by_state())
+        return listing[0]
 
-    def _add_instances(self, ping, pong):
+    def _add_instances(self, ping, pong, listing):
         if not utils.ping_include_instances(ping):
             return
 
@@ -125,7 +147,7 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         })
 
         containers = []
-        running, nonrunning = self._get_all_containers_by_state()
+        running, nonrunning = self._listed(listing)
 
         for key, container in running.iteritems():
             self.add_container('running', container, containers)
@@ -133,8 +155,15 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         for key, container in nonrunning.iteritems():
             self.add_container('stopped', container, containers)
 
+        containers, options = self.instance_reporter.report(
+            containers,
+            generation=utils.ping_get_option(ping, 'instancesGeneration'),
+            checksum=utils.ping_get_option(ping, 'instancesChecksum'))
+
         utils.ping_add_resources(pong, *containers)
         utils.ping_set_option(pong, 'instances', True)
+        for key, value in options.iteritems():
+            utils.ping_set_option(pong, key, value)
 
     def add_container(self, state, container, containers):
         try:
@@ -156,25 +185,47 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
 
     def _get_all_containers_by_state(self):
         client = docker_client()
+        index = get_container_index(client)
+        if index is None:
+            containers = client.containers(all=True)
+        else:
+            containers = index.containers()
 
         nonrunning_containers = {}
-        for c in client.containers(all=True):
+        running_containers = {}
+        for c in containers:
+            status = c['Status']
             # Blank status only wait to distinguish created from stopped
-            if c['Status'] != '' and c['Status'] != 'Created':
-                nonrunning_containers[c['Id']] = c
+            if status == '' or status == 'Created':
+                continue
 
-        running_containers = {}
-        for c in client.containers(all=False):
-            running_containers[c['Id']] = c
-            del nonrunning_containers[c['Id']]
+            # Same as what docker ps without -a lists
+            if status.startswith('Up ') or status.startswith('Restarting'):
+                running_containers[c['Id']] = c
+            else:
+                nonrunning_containers[c['Id']] = c
 
         return running_containers, nonrunning_containers
 
     def _get_sys_container(self, container):
         try:
             image = container['Image']
-            if image in self.system_images:
-                return self.system_images[image]
+            client = docker_client()
+            index = get_image_index(client)
+            found = None
+            if index is not None:
+                try:
+                    found = index.get(client, image)
+                except APIError:
+                    # Refreshing a changed image failed, use what was
+                    # listed at startup
+                    log.exception('Failed to look up image [%s]', image)
+                    index = None
+            if index is None:
+                if image in self.system_images:
+                    return self.system_images[image]
+            elif found is not None:
+                return found['Labels'][SYSTEM_LABEL]
         except (TypeError, KeyError):
             pass
 
@@ -214,14 +265,24 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
             # Unknown. Assume running and state should sync up eventually.
             return 'running'
 
-    def _add_resources(self, ping, pong):
+    def _add_resources(self, ping, pong, listing):
         if not utils.ping_include_resources(ping):
             return
 
         stats = None
         if utils.ping_include_stats(ping):
             try:
+                # The host facts are dropped on Docker daemon restarts
+                events.ensure_started()
                 stats = self.host_info.collect_data()
+                stats['processInfo'] = process_manager.stats()
+                sampler = get_sampler()
+                stats['hostHistory'] = {} if sampler is None else \
+                    sampler.history(Config.host_sampler_history_points())
+                if DockerConfig.container_stats_enabled():
+                    running, _ = self._listed(listing)
+                    stats['containerStats'] = \
+                        self.container_stats.collect(running.keys())
             except:
                 log.exception("Error geting host info stats")
 
@@ -291,6 +352,11 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         if instance is None:
             return None
 
+        index = get_container_index(client)
+        if index is not None:
+            return self._get_indexed_container(client, index, instance,
+                                               by_agent)
+
         name = '/{0}'.format(instance.uuid)
         container = self.get_container_by(client,
                                           lambda x: self._name_filter(name, x))
@@ -310,6 +376,33 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
 
         return container
 
+    @staticmethod
+    def _get_indexed_container(client, index, instance, by_agent):
+        container = index.by_name(client, instance.uuid)
+        if container:
+            return container
+
+        container = index.by_uuid(client, instance.uuid)
+        if container:
+            return container
+
+        if hasattr(instance, 'externalId') and instance.externalId:
+            container = index.by_id(client, instance.externalId)
+
+        if container:
+            return container
+
+        if by_agent and hasattr(instance, 'agentId') and instance.agentId:
+            container = index.by_agent_id(client, str(instance.agentId))
+
+        return container
+
+    @staticmethod
+    def _invalidate(client, container_id):
+        index = get_container_index(client)
+        if index is not None:
+            index.invalidate(container_id)
+
     def _is_instance_active(self, instance, host):
         if is_no_op(instance):
             return True
@@ -321,60 +414,14 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
     @staticmethod
     def _get_docker_client(host):
         cluster_connection = None
-        tls_config = None
         try:
             cluster_connection = host['clusterConnection']
             if cluster_connection.startswith('https'):
-                try:
-                    account_id = host['accountId']
-                    ca_crt = host['caCrt']
-                    client_crt = host['clientCrt']
-                    client_key = host['clientKey']
-
-                    client_certs_dir = Config.client_certs_dir()
-                    acct_client_cert_dir = \
-                        path.join(client_certs_dir, str(account_id))
-                    if not path.exists(acct_client_cert_dir):
-                        log.debug('Creating client cert directory: %s',
-                                  acct_client_cert_dir)
-                        makedirs(acct_client_cert_dir)
-                    if ca_crt:
-                        log.debug('Writing cert auth')
-                        with open(path.join(acct_client_cert_dir, 'ca.crt'),
-                                  'w') as f:
-                            f.write(ca_crt)
-                    if client_crt:
-                        log.debug('Writing client cert')
-                        with open(path.join(acct_client_cert_dir,
-                                            'client.crt'),
-                                  'w') as f:
-                            f.write(client_crt)
-                    if client_key:
-                        log.debug('Writing client key')
-                        with open(path.join(acct_client_cert_dir,
-                                            'client.key'),
-                                  'w') as f:
-                            f.write(client_key)
-                    if ca_crt and client_crt and client_key:
-                        tls_config = tls.TLSConfig(
-                            client_cert=(
-                                path.join(acct_client_cert_dir, 'client.crt'),
-                                path.join(acct_client_cert_dir, 'client.key')
-                            ),
-                            verify=path.join(acct_client_cert_dir, 'ca.crt'),
-                            assert_hostname=False
-                        )
-                except (KeyError, AttributeError) as e:
-                    raise Exception(
-                        'Unable to process cert/keys for cluster',
-                        cluster_connection,
-                        e)
+                return _CLUSTER_CLIENTS.get(host, cluster_connection)
         except (KeyError, AttributeError):
             pass
 
-        return docker_client(
-            base_url_override=cluster_connection,
-            tls_config=tls_config)
+        return docker_client(base_url_override=cluster_connection)
 
     @staticmethod
     def _setup_legacy_command(create_config, instance, command):
@@ -572,6 +619,7 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
                  container_id, start_config)
 
         client.start(container_id)
+        self._invalidate(client, container_id)
 
         self._record_state(client, instance, docker_id=container['Id'])
 
@@ -641,7 +689,8 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         for src, dest in fields:
             try:
                 src_obj = instance.data.fields[src]
-                config[dest] = JsonObject.unwrap(src_obj)
+                # The request is not copied anymore, keep it unchanged
+                config[dest] = copy.deepcopy(src_obj)
             except (KeyError, AttributeError):
                 pass
 
@@ -695,10 +744,8 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         for i in ['type', 'config']:
             bad = True
             try:
-                obj = start_config['log_config'][i]
-                if obj is not None:
+                if start_config['log_config'][i] is not None:
                     bad = False
-                    start_config['log_config'][i] = JsonObject.unwrap(obj)
             except (KeyError, AttributeError):
                 pass
             if bad and 'log_config' in start_config:
@@ -794,10 +841,12 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         container = self.get_container(c, instance)
 
         c.stop(container['Id'], timeout=timeout)
+        self._invalidate(c, container['Id'])
 
         container = self.get_container(c, instance)
         if not _is_stopped(c, container):
             c.kill(container['Id'])
+            self._invalidate(c, container['Id'])
 
         container = self.get_container(c, instance)
         if not _is_stopped(c, container):
@@ -805,8 +854,10 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
                             .format(instance.uuid))
 
     def _do_instance_force_stop(self, instanceForceStop):
+        client = docker_client()
         try:
-            docker_client().stop(instanceForceStop['id'])
+            client.stop(instanceForceStop['id'])
+            self._invalidate(client, instanceForceStop['id'])
         except APIError as e:
             if e.message.response.status_code != 404:
                 raise e
@@ -828,42 +879,61 @@ class DockerCompute(KindBasedMixin, BaseComputeDriver):
         client = docker_client()
 
         image = pull_info.image.data.dockerImage
-        try:
-            existing = client.inspect_image(image.fullName)
-        except APIError:
-            existing = None
+        index = get_image_index(client)
+        if index is not None:
+            existing = index.by_name(client, image.fullName)
+        else:
+            try:
+                existing = client.inspect_image(image.fullName)
+            except APIError:
+                existing = None
 
         if pull_info.mode == 'cached' and existing is None:
             return existing
 
-        if pull_info.complete:
-            if existing is not None:
-                client.remove_image(image.fullName + pull_info.tag)
-            return
+        if not pull_info.complete:
+            DockerPool.image_pull(pull_info.image, progress)
 
-        DockerPool.image_pull(pull_info.image, progress)
+        with lock(self._image_pull_lock(pull_info),
+                  timeout=DockerConfig.pull_lock_timeout()):
+            if pull_info.complete:
+                if existing is not None:
+                    client.remove_image(image.fullName + pull_info.tag)
+                    if index is not None:
+                        index.invalidate(image.fullName + pull_info.tag)
+                return
 
-        if pull_info.tag is not None:
-            image_info = DockerPool.parse_repo_tag(image.fullName)
-            client.tag(image.fullName, image_info['repo'],
-                       image_info['tag'] + pull_info.tag, force=True)
+            if pull_info.tag is not None:
+                image_info = DockerPool.parse_repo_tag(image.fullName)
+                client.tag(image.fullName, image_info['repo'],
+                           image_info['tag'] + pull_info.tag, force=True)
+                if index is not None:
+                    index.invalidate(image.fullName)
         return client.inspect_image(image.fullName)
 
     def _do_instance_inspect(self, instanceInspectRequest):
         client = docker_client()
+        index = get_container_index(client)
         container = None
         try:
             container_id = instanceInspectRequest.id
-            container = self.get_container_by(client, lambda x:
-                                              self._id_filter(container_id, x))
+            if index is None:
+                container = self.get_container_by(
+                    client, lambda x: self._id_filter(container_id, x))
+            elif container_id:
+                container = index.by_id(client, container_id)
         except (KeyError, AttributeError):
             pass
 
         if not container:
             try:
                 name = '/{0}'.format(instanceInspectRequest.name)
-                container = self.get_container_by(client, lambda x:
-                                                  self._name_filter(name, x))
+                if index is None:
+                    container = self.get_container_by(
+                        client, lambda x: self._name_filter(name, x))
+                elif instanceInspectRequest.name:
+                    container = index.by_name(client,
+                                              instanceInspectRequest.name)
             except (KeyError, AttributeError):
                 pass
 
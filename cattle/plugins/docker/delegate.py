@@ -1,4 +1,7 @@
 import logging
+import uuid
+from collections import OrderedDict
+from threading import Lock
 
 from cattle import Config
 from cattle.utils import reply, popen
@@ -6,31 +9,63 @@ from .compute import DockerCompute
 from cattle.agent.handler import BaseHandler
 from cattle.progress import Progress
 from cattle.type_manager import get_type, MARSHALLER
-from . import docker_client
+from . import docker_client, events, DockerConfig
 
+import select
+import signal
 import subprocess
 import os
 import time
 
 log = logging.getLogger('docker')
 
+# Runs delegate scripts for the agent inside the namespaces of a container,
+# one request after the other.  A request is the script path and the event
+# on a line each.  The reply is the output of the script followed by a line
+# with the token ($0) and the exit code, or the token and "missing" if
+# there is no such script yet.
+_HELPER_SCRIPT = """
+while read -r script && read -r input; do
+    if [ ! -e "$script" ]; then
+        echo "$0 missing"
+        continue
+    fi
+    output=$(printf '%s\\n' "$input" | "$script" 2>&1)
+    rc=$?
+    printf '%s\\n%s %s\\n' "$output" "$0" "$rc"
+done
+"""
 
-def ns_exec(pid, event):
-    script = os.path.join(Config.home(), 'events', event.name.split(';')[0])
-    cmd = ['nsenter',
-           '-F',
-           '-m',
-           '-u',
-           '-i',
-           '-n',
-           '-p',
-           '-t', str(pid),
-           '--', script]
 
-    marshaller = get_type(MARSHALLER)
-    input = marshaller.to_string(event)
-    data = None
+def _nsenter(pid):
+    return ['nsenter', '-F', '-m', '-u', '-i', '-n', '-p', '-t', str(pid),
+            '--']
+
+
+class HelperError(Exception):
+    pass
+
+
+class HelperTimeout(HelperError):
+    pass
 
+
+def _process_key(pid):
+    """
+    Returns pid and the time the process started, pids get reused.
+    """
+    with open('/proc/{0}/stat'.format(pid)) as f:
+        return pid, f.read().rsplit(')', 1)[1].split()[19]
+
+
+def _is_running(key):
+    try:
+        return _process_key(key[0]) == key
+    except IOError:
+        return False
+
+
+def _environ(pid):
     env = {}
     with open('/proc/{}/environ'.format(pid)) as f:
         for line in f.read().split('\0'):
@@ -42,25 +77,250 @@ def ns_exec(pid, event):
 
     env['PATH'] = os.environ['PATH']
     env['CATTLE_CONFIG_URL'] = Config.config_url()
+    return env
 
-    for i in range(3):
-        p = popen(cmd,
-                  env=env,
-                  stdin=subprocess.PIPE,
-                  stdout=subprocess.PIPE,
-                  stderr=subprocess.STDOUT)
-        output, error = p.communicate(input=input)
-        retcode = p.poll()
 
-        if retcode == 0:
-            break
+class _ExecHelper(object):
+    """
+    A shell started once inside the namespaces of a container that runs
+    the delegate scripts sent to it, see _HELPER_SCRIPT.
+    """
+
+    def __init__(self, pid, env):
+        self._lock = Lock()
+        self._token = uuid.uuid4().hex
+        self._process = popen(
+            _nsenter(pid) + ['sh', '-c', _HELPER_SCRIPT, self._token],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=open(os.devnull, 'w'),
+            close_fds=True,
+            # Its own group, so a script that times out goes with it
+            preexec_fn=os.setsid)
+
+    def run(self, script, input, timeout):
+        """
+        Returns the exit code and output of script, or None and None if
+        it does not exist.  Raises HelperTimeout and kills the helper if
+        script takes longer than timeout seconds.
+        """
+        with self._lock:
+            try:
+                self._process.stdin.write('{0}\n{1}\n'.format(script, input))
+                self._process.stdin.flush()
+                output = self._read_reply(time.time() + timeout)
+            except (IOError, OSError, select.error) as e:
+                raise HelperError(e)
+
+        lines = output.split('\n')
+        result = lines[-2][len(self._token) + 1:]
+        if result == 'missing':
+            return None, None
+        return int(result), '\n'.join(lines[:-2] + [''])
+
+    def _read_reply(self, deadline):
+        # Not stdout.readline(), select() can't see what the file buffered
+        fd = self._process.stdout.fileno()
+        marker = '\n' + self._token + ' '
+        output = '\n'
+        while True:
+            end = output.find(marker)
+            if end >= 0 and output.find('\n', end + 1) >= 0:
+                return output[1:]
+
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                self.kill()
+                raise HelperTimeout('Exec helper timed out')
+
+            data = os.read(fd, 4096)
+            if not data:
+                raise HelperError('Exec helper exited')
+            output += data
+
+    def kill(self):
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+        self._process.wait()
+
+
+class ExecHelpers(object):
+    """
+    The environment and exec helper of each container process delegate
+    scripts run in, the least recently used are closed when there are more
+    than size of them.  Containers whose helper fails get the one shot
+    nsenter from then on.
+
+    A helper holds the namespaces of its container, so it is also closed
+    when the container dies or is destroyed, when its process is gone and
+    when it was not used for DockerConfig.delegate_exec_helper_idle_timeout()
+    seconds.  It gets the Docker events as a listener of the events watcher.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._lock = Lock()
+        self._pid = None
+        self._entries = OrderedDict()
+
+    def _check_pid(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # The helpers of the parent are its to close
+            self._entries = OrderedDict()
+            self._pid = pid
+
+    def get(self, pid, container_id=None):
+        """
+        Returns the environment for pid and its helper, or None for no
+        helper.
+        """
+        key = _process_key(pid)
+        with self._lock:
+            self._check_pid()
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry[:2] + (time.time(),) + entry[3:]
+                return entry[0], entry[1]
+
+        self.expire()
+
+        env = _environ(pid)
+        helper = None
+        if DockerConfig.delegate_exec_helper():
+            try:
+                helper = _ExecHelper(pid, env)
+            except OSError:
+                log.exception('Failed to start exec helper for %s', pid)
 
+        evicted = []
+        with self._lock:
+            self._check_pid()
+            self._entries[key] = (env, helper, time.time(), container_id)
+            while len(self._entries) > self._size:
+                evicted.append(self._entries.popitem(last=False)[1][1])
+
+        _close(evicted)
+        return env, helper
+
+    def disable(self, pid, helper):
+        """
+        Stops using helper for pid.
+        """
+        key = _process_key(pid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is helper:
+                self._entries[key] = (entry[0], None) + entry[2:]
+        helper.close()
+
+    def expire(self, container_id=None):
+        """
+        Closes the helpers of container_id and those that are idle or whose
+        process is gone.
+        """
+        idle = time.time() - DockerConfig.delegate_exec_helper_idle_timeout()
+        closed = []
+        with self._lock:
+            self._check_pid()
+            for key, entry in self._entries.items():
+                if (container_id is not None and entry[3] == container_id) \
+                        or entry[2] < idle or not _is_running(key):
+                    del self._entries[key]
+                    closed.append(entry[1])
+
+        _close(closed)
+
+    def forked(self):
+        self._lock = Lock()
+
+    def reset(self):
+        pass
+
+    def resync(self, client):
+        self.expire()
+
+    def on_event(self, client, event):
+        if events.is_image_event(event):
+            return
+
+        if event.get('status') in ('die', 'destroy'):
+            self.expire(event.get('id'))
+
+
+def _close(helpers):
+    for helper in helpers:
+        if helper is not None:
+            helper.close()
+
+
+_HELPERS = ExecHelpers(64)
+events.add_listener(_HELPERS)
+
+
+def _exec(pid, script, input, env):
+    cmd = _nsenter(pid) + [script]
+    p = popen(cmd,
+              env=env,
+              stdin=subprocess.PIPE,
+              stdout=subprocess.PIPE,
+              stderr=subprocess.STDOUT)
+    output, error = p.communicate(input=input)
+    retcode = p.poll()
+
+    if retcode != 0:
         exists_cmd = cmd[:-1] + ['/usr/bin/test', '-e', script]
-        if popen(exists_cmd, env=env).wait() == 0:
+        if popen(exists_cmd, env=env).wait() != 0:
+            return None, None
+
+    return retcode, output
+
+
+def _run(pid, script, input, container_id):
+    env, helper = _HELPERS.get(pid, container_id)
+    if helper is not None:
+        try:
+            return helper.run(script, input, DockerConfig.delegate_timeout())
+        except HelperTimeout:
+            # Don't run it a second time with nsenter
+            _HELPERS.disable(pid, helper)
+            raise
+        except HelperError as e:
+            log.info('Exec helper for %s failed, using nsenter: %s', pid, e)
+            _HELPERS.disable(pid, helper)
+
+    return _exec(pid, script, input, env)
+
+
+def ns_exec(pid, event, container_id=None):
+    script = os.path.join(Config.home(), 'events', event.name.split(';')[0])
+
+    marshaller = get_type(MARSHALLER)
+    input = marshaller.to_string(event)
+    data = None
+
+    # Retry while the script is missing, the container may still be
+    # getting its files
+    deadline = time.time() + DockerConfig.delegate_retry_timeout()
+    delay = 0.1
+    while True:
+        retcode, output = _run(pid, script, input, container_id)
+        if retcode is not None or time.time() + delay > deadline:
             break
+        time.sleep(delay)
+        delay *= 2
 
-        # Sleep and try again if missing
-        time.sleep(1)
+    if retcode is None:
+        return 127, 'Missing {0}'.format(script), None
 
     if retcode:
         return retcode, output, None
@@ -109,7 +369,8 @@ class DockerDelegate(BaseHandler):
             return
 
         progress = Progress(event, parent=req)
-        exit_code, output, data = ns_exec(inspect['State']['Pid'], event)
+        exit_code, output, data = ns_exec(inspect['State']['Pid'], event,
+                                          inspect['Id'])
 
         if exit_code == 0:
             return reply(event, data, parent=req)
@@ -0,0 +1,281 @@
+import errno
+import json
+import logging
+import os
+import socket
+import time
+from threading import Thread, Lock
+
+from cattle import Config
+from . import docker_client, DockerConfig
+
+log = logging.getLogger('docker')
+
+IMAGE_EVENTS = frozenset(['untag', 'delete', 'pull', 'tag', 'import'])
+
+# How long a worker gets to take an update before it is dropped, it
+# connects again and starts over from a snapshot
+SEND_TIMEOUT = 5
+
+
+def is_image_event(event):
+    try:
+        return event['Type'] == 'image'
+    except KeyError:
+        return event.get('status') in IMAGE_EVENTS
+
+
+class DockerEventWatcher(object):
+    """
+    Follows the Docker /events stream in a background thread and hands every
+    event to the registered listeners.  The stream is opened before the
+    listeners are resynced so nothing that happens during the resync is lost.
+    Whenever the stream drops the listeners are reset and a full resync is
+    done on reconnect.  The listeners talk to Docker with the pooled client
+    and its timeout, only the stream itself never times out.
+
+    When the workers are forked processes the agent process calls serve()
+    before it forks them.  Only that process then follows the stream, the
+    workers connect to DockerConfig.event_feed_socket() and get what the
+    listeners changed instead, see publish().  A worker whose feed drops
+    resets its listeners until it is connected again.  Without serve() the
+    watcher is started lazily in each process.
+
+    Listeners make their locks again in forked(), called in a process that
+    was forked after the watcher started.  A listener with snapshot() and
+    apply() sends its own updates, a new
+    worker first gets the snapshot.  Other listeners get the resets and
+    events of the agent process in the workers, with no client.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = Lock()
+        self._pid = None
+        self._feed_pid = None
+        self._feed_lock = Lock()
+        self._subscribers = {}
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def serve(self):
+        path = DockerConfig.event_feed_socket()
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(64)
+
+        self._feed_pid = os.getpid()
+        self.ensure_started()
+
+        for target, args in [(self._accept, (server,)), (self._tick, ())]:
+            t = Thread(target=target, args=args)
+            t.setDaemon(True)
+            t.start()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            if self._pid is not None:
+                # Forked, a lock held by a thread of the parent stays held
+                for listener in self._listeners:
+                    listener.forked()
+            self._pid = pid
+            self._subscribers = {}
+            self._reset()
+
+            if self._feed_pid is None or self._feed_pid == pid:
+                target = self._watch
+            else:
+                target = self._subscribe
+
+            t = Thread(target=target, args=(pid,))
+            t.setDaemon(True)
+            t.start()
+
+    def publish(self, listener, update):
+        """
+        Sends an update of listener to the worker processes, if this is the
+        process that serves them.  The workers hand it to apply() of the
+        same listener.  Listeners publish while they hold their own lock so
+        the updates go out in the order they were made.
+        """
+        if self._feed_pid != os.getpid():
+            return
+
+        i = self._listeners.index(listener)
+        line = json.dumps([i, update]) + '\n'
+        with self._feed_lock:
+            for subscriber in list(self._subscribers.get(i, [])):
+                self._send(subscriber, line)
+
+    def _join(self, i, subscriber, update):
+        """
+        Sends the snapshot update of listener i to a new subscriber and
+        publishes the later updates to it.  Listeners call it from
+        snapshot() under their own lock, like publish().
+        """
+        with self._feed_lock:
+            if update is None or self._send(subscriber, json.dumps(
+                    [i, update]) + '\n'):
+                self._subscribers.setdefault(i, []).append(subscriber)
+
+    def _send(self, subscriber, line):
+        try:
+            subscriber.sendall(line)
+            return True
+        except (IOError, socket.error):
+            log.info('Dropping slow Docker event subscriber')
+
+        for subscribers in self._subscribers.values():
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+        try:
+            subscriber.close()
+        except (IOError, socket.error):
+            pass
+        return False
+
+    def _reset(self):
+        for listener in self._listeners:
+            listener.reset()
+            if not _replicated(listener):
+                self.publish(listener, ['reset'])
+
+    def _watch(self, pid):
+        while self._pid == pid:
+            try:
+                stream_client = docker_client(pooled=False)
+                # The stream is idle most of the time, don't time out reads
+                stream_client.timeout = None
+                stream = stream_client.events(decode=True)
+
+                client = docker_client()
+                for listener in self._listeners:
+                    listener.resync(client)
+
+                for event in stream:
+                    self._dispatch(client, event)
+
+                log.info('Docker event stream closed')
+            except:
+                log.exception('Error reading Docker event stream')
+            finally:
+                self._reset()
+
+            time.sleep(DockerConfig.event_retry_interval())
+
+    def _dispatch(self, client, event):
+        for listener in self._listeners:
+            try:
+                listener.on_event(client, event)
+            except:
+                log.exception('Failed to handle Docker event %s', event)
+            if not _replicated(listener):
+                self.publish(listener, ['event', event])
+
+    def _accept(self, server):
+        while True:
+            try:
+                subscriber, _ = server.accept()
+            except (IOError, socket.error):
+                log.exception('Failed to accept Docker event subscriber')
+                continue
+
+            subscriber.settimeout(SEND_TIMEOUT)
+            for i, listener in enumerate(self._listeners):
+                if _replicated(listener):
+                    listener.snapshot(
+                        lambda update, i=i: self._join(i, subscriber, update))
+                else:
+                    self._join(i, subscriber, None)
+
+    def _tick(self):
+        while True:
+            time.sleep(DockerConfig.event_retry_interval())
+            for listener in self._listeners:
+                tick = getattr(listener, 'tick', None)
+                if tick is not None:
+                    try:
+                        tick(docker_client())
+                    except:
+                        log.exception('Failed to refresh %s', listener)
+
+    def _subscribe(self, pid):
+        path = DockerConfig.event_feed_socket()
+        while self._pid == pid:
+            feed = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                feed.connect(path)
+                for line in feed.makefile('rb'):
+                    i, update = json.loads(line)
+                    try:
+                        self._apply(self._listeners[i], update)
+                    except:
+                        log.exception('Failed to apply Docker event update')
+                log.info('Docker event feed closed')
+            except (IOError, socket.error, ValueError):
+                log.exception('Error reading Docker event feed')
+            finally:
+                feed.close()
+                self._reset()
+
+            time.sleep(DockerConfig.event_retry_interval())
+
+    def _apply(self, listener, update):
+        if _replicated(listener):
+            listener.apply(update)
+        elif update[0] == 'reset':
+            listener.reset()
+        elif update[0] == 'event':
+            listener.on_event(None, update[1])
+
+
+def _replicated(listener):
+    return hasattr(listener, 'apply')
+
+
+_WATCHER = DockerEventWatcher()
+
+
+def add_listener(listener):
+    _WATCHER.add_listener(listener)
+
+
+def ensure_started():
+    _WATCHER.ensure_started()
+
+
+def publish(listener, update):
+    _WATCHER.publish(listener, update)
+
+
+def is_replica():
+    """
+    Returns True in a worker that gets the listener updates from the agent
+    process instead of following the Docker events itself.
+    """
+    return _WATCHER._feed_pid not in (None, os.getpid())
+
+
+class DockerEvents(object):
+    """
+    Serves the Docker events to the worker processes from the agent
+    process, see DockerEventWatcher.
+    """
+
+    def on_startup(self):
+        if Config.is_multi_proc():
+            _WATCHER.serve()
@@ -0,0 +1,555 @@
+import logging
+import time
+from threading import Lock
+
+from docker.errors import APIError
+
+from . import docker_client, DockerConfig
+from . import events
+
+UUID_LABEL = 'io.rancher.container.uuid'
+AGENT_ID_LABEL = 'io.rancher.container.agent_id'
+
+log = logging.getLogger('docker')
+
+
+def _not_found(e):
+    try:
+        return e.response.status_code == 404
+    except AttributeError:
+        return False
+
+
+def _names(container):
+    """
+    Returns the name keys of a container.  Docker also lists link aliases
+    such as /web/db, those match on their last segment the same way
+    DockerCompute._name_filter does, but never win over a primary name.
+    """
+    primary = []
+    aliases = []
+    for name in container.get('Names') or []:
+        if name.startswith('/'):
+            name = name[1:]
+        if '/' in name:
+            aliases.append(name.rsplit('/', 1)[1])
+        else:
+            primary.append(name)
+    return primary, aliases
+
+
+def _all_names(container):
+    primary, aliases = _names(container)
+    return primary + aliases
+
+
+def _label(container, key):
+    try:
+        return container['Labels'][key]
+    except (TypeError, KeyError):
+        return None
+
+
+class ContainerIndex(object):
+    """
+    In-memory index of the containers of the local Docker daemon, keyed by
+    name, Docker id, rancher uuid label and agent id label.  The index is
+    loaded from a single container listing and then kept current from the
+    Docker event stream, see events.DockerEventWatcher.  Until the first
+    resync is done, or while the stream is down, the index reports itself as
+    not synced and callers should list containers from Docker instead.
+
+    In forked workers the index is a copy of the one in the agent process,
+    loaded from its snapshot() and kept current by its updates, see
+    events.publish().
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._base_url = None
+        self._synced = False
+        self._clear()
+
+    def _clear(self):
+        self._by_id = {}
+        self._by_name = {}
+        self._by_uuid = {}
+        self._by_agent_id = {}
+        self._dirty = set()
+
+    def covers(self, client):
+        if self._base_url is None:
+            self._base_url = docker_client().base_url
+        return getattr(client, 'base_url', None) == self._base_url
+
+    @property
+    def synced(self):
+        return self._synced
+
+    def forked(self):
+        self._lock = Lock()
+
+    def reset(self):
+        with self._lock:
+            self._synced = False
+            self._clear()
+            events.publish(self, ['reset'])
+
+    def resync(self, client):
+        containers = client.containers(all=True, trunc=False)
+        with self._lock:
+            self._load(containers)
+            self._synced = True
+            events.publish(self, ['load', containers])
+
+    def snapshot(self, join):
+        with self._lock:
+            join(['load', self._by_id.values()] if self._synced else None)
+
+    def apply(self, update):
+        with self._lock:
+            if update[0] == 'reset':
+                self._synced = False
+                self._clear()
+            elif update[0] == 'load':
+                self._load(update[1])
+                self._synced = True
+            elif update[0] == 'set':
+                self._remove(update[1])
+                for container in update[2]:
+                    self._put(container)
+
+    def on_event(self, client, event):
+        if events.is_image_event(event):
+            return
+
+        id = event.get('id')
+        if not id:
+            return
+
+        if event.get('status') == 'destroy':
+            self.discard(id)
+        else:
+            self.refresh(client, id)
+
+    def containers(self):
+        with self._lock:
+            return self._by_id.values()
+
+    def invalidate(self, id):
+        """
+        Marks a container as changed by the agent itself so the next lookup
+        reads it back from Docker instead of waiting for the event.
+        """
+        with self._lock:
+            if id in self._by_id:
+                self._dirty.add(id)
+
+    def discard(self, id):
+        with self._lock:
+            self._remove(id)
+            events.publish(self, ['set', id, []])
+
+    def refresh(self, client, id):
+        try:
+            containers = client.containers(all=True, trunc=False,
+                                           filters={'id': id})
+        except APIError:
+            # Daemon does not know the id filter
+            containers = client.containers(all=True, trunc=False)
+
+        matched = [c for c in containers if c.get('Id') == id]
+
+        with self._lock:
+            if len(containers) > len(matched):
+                # The filter was ignored so this is a full listing anyway
+                self._load(containers)
+                events.publish(self, ['load', containers])
+            else:
+                self._remove(id)
+                for container in matched:
+                    self._put(container)
+                events.publish(self, ['set', id, matched])
+
+        if len(matched) > 0:
+            return matched[0]
+        return None
+
+    def by_id(self, client, id):
+        container = self._get(client, None, id)
+        if container is None:
+            container = self._probe(client, id)
+            if container is not None and container['Id'] != id:
+                container = None
+        return container
+
+    def by_name(self, client, name):
+        container = self._get(client, self._by_name, name)
+        if container is None:
+            container = self._probe(client, name)
+            if container is not None and name not in _all_names(container):
+                container = None
+        return container
+
+    def by_uuid(self, client, uuid):
+        return self._get(client, self._by_uuid, uuid)
+
+    def by_agent_id(self, client, agent_id):
+        return self._get(client, self._by_agent_id, agent_id)
+
+    def _get(self, client, keys, key):
+        with self._lock:
+            id = key if keys is None else keys.get(key)
+            if id not in self._by_id:
+                return None
+            if id not in self._dirty:
+                return self._by_id.get(id)
+
+        return self.refresh(client, id)
+
+    def _probe(self, client, name_or_id):
+        """
+        A miss may only mean the event for a brand new container has not been
+        read yet.  Inspecting by name or id is a cheap, direct lookup in
+        Docker, only if that finds something is the container listed.
+        """
+        try:
+            inspect = client.inspect_container(name_or_id)
+        except APIError as e:
+            if _not_found(e):
+                return None
+            raise
+
+        return self.refresh(client, inspect['Id'])
+
+    def _load(self, containers):
+        self._clear()
+        for container in containers:
+            self._put(container)
+
+    def _put(self, container):
+        id = container['Id']
+        self._by_id[id] = container
+
+        primary, aliases = _names(container)
+        for name in aliases:
+            self._by_name.setdefault(name, id)
+        for name in primary:
+            self._by_name[name] = id
+
+        uuid = _label(container, UUID_LABEL)
+        if uuid:
+            self._by_uuid[uuid] = id
+
+        agent_id = _label(container, AGENT_ID_LABEL)
+        if agent_id:
+            self._by_agent_id[agent_id] = id
+
+    def _remove(self, id):
+        self._dirty.discard(id)
+        container = self._by_id.pop(id, None)
+        if container is None:
+            return
+
+        for keys, key_list in [
+                (self._by_name, _all_names(container)),
+                (self._by_uuid, [_label(container, UUID_LABEL)]),
+                (self._by_agent_id, [_label(container, AGENT_ID_LABEL)])]:
+            for key in key_list:
+                if keys.get(key) == id:
+                    del keys[key]
+
+
+_INDEX = ContainerIndex()
+events.add_listener(_INDEX)
+
+
+def get_container_index(client):
+    """
+    Returns the container index if it can answer lookups for this client,
+    that is the client talks to the local daemon and the index is synced.
+    """
+    if not DockerConfig.container_index_enabled():
+        return None
+
+    events.ensure_started()
+
+    if _INDEX.synced and _INDEX.covers(client):
+        return _INDEX
+    return None
+
+
+def _image_key(name):
+    """
+    Returns the tag key of an image name, a name without a tag means the
+    latest tag just like it does for docker pull and inspect.
+    """
+    if name.rfind(':') <= name.rfind('/'):
+        return name + ':latest'
+    return name
+
+
+def _image(inspect, name):
+    """
+    Converts the inspect output of an image to the form Docker lists images
+    in.  Daemons that don't report RepoTags in inspect get the name the image
+    was looked up by.
+    """
+    tags = inspect.get('RepoTags')
+    if tags is None:
+        tags = []
+        if not inspect['Id'].startswith(name):
+            tags.append(_image_key(name))
+
+    return {
+        'Id': inspect['Id'],
+        'ParentId': inspect.get('Parent'),
+        'RepoTags': tags,
+        'Labels': (inspect.get('Config') or {}).get('Labels'),
+        'Created': inspect.get('Created'),
+        'Size': inspect.get('Size'),
+        'VirtualSize': inspect.get('VirtualSize'),
+    }
+
+
+class ImageIndex(object):
+    """
+    In-memory index of the images of the local Docker daemon, keyed by
+    Docker id and every repo tag.  Like ContainerIndex it is loaded from a
+    single image listing and kept current from the image events of the
+    Docker event stream.  Pull events only name the image, so the index
+    is also reloaded when it is older than
+    DockerConfig.image_index_refresh_interval().  Forked workers keep a
+    copy of the index of the agent process, which does the reloads.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._base_url = None
+        self._synced = False
+        self._loaded = 0
+        self._changes = 0
+        self._refreshing = False
+        self._clear()
+
+    def _clear(self):
+        self._by_id = {}
+        self._by_tag = {}
+        self._dirty = set()
+
+    def covers(self, client):
+        if self._base_url is None:
+            self._base_url = docker_client().base_url
+        return getattr(client, 'base_url', None) == self._base_url
+
+    @property
+    def synced(self):
+        return self._synced
+
+    def forked(self):
+        self._lock = Lock()
+
+    def reset(self):
+        with self._lock:
+            self._synced = False
+            self._clear()
+            events.publish(self, ['reset'])
+
+    def resync(self, client):
+        with self._lock:
+            changes = self._changes
+
+        images = client.images(all=True)
+
+        with self._lock:
+            self._loaded = time.time()
+            if self._synced and changes != self._changes:
+                # Events came in while listing, they are newer than the
+                # listing so keep what they did
+                return
+            self._load(images)
+            events.publish(self, ['load', images])
+
+    def _load(self, images):
+        self._clear()
+        for image in images:
+            self._put(image)
+        self._synced = True
+
+    def snapshot(self, join):
+        with self._lock:
+            join(['load', self._by_id.values()] if self._synced else None)
+
+    def apply(self, update):
+        with self._lock:
+            if update[0] == 'reset':
+                self._synced = False
+                self._clear()
+            elif update[0] == 'load':
+                self._loaded = time.time()
+                self._load(update[1])
+            elif update[0] == 'set':
+                self._set(update[1], update[2])
+
+    def tick(self, client):
+        self.resync_expired(client)
+
+    def resync_expired(self, client):
+        with self._lock:
+            if self._refreshing or time.time() - self._loaded < \
+                    DockerConfig.image_index_refresh_interval():
+                return
+            self._refreshing = True
+
+        try:
+            self.resync(client)
+        except:
+            log.exception('Failed to reload the image index')
+        finally:
+            self._refreshing = False
+
+    def on_event(self, client, event):
+        if not events.is_image_event(event):
+            return
+
+        id = event.get('id')
+        if not id:
+            return
+
+        if event.get('status') == 'delete':
+            self.discard(id)
+        else:
+            self.refresh(client, id)
+
+    def images(self):
+        with self._lock:
+            return self._by_id.values()
+
+    def invalidate(self, name_or_id):
+        """
+        Marks an image as changed by the agent itself so the next lookup
+        reads it back from Docker instead of waiting for the event.
+        """
+        with self._lock:
+            id = self._resolve(name_or_id)
+            if id is not None:
+                self._dirty.add(id)
+
+    def discard(self, name_or_id):
+        with self._lock:
+            self._set(name_or_id, None)
+            events.publish(self, ['set', name_or_id, None])
+
+    def refresh(self, client, name_or_id):
+        try:
+            image = _image(client.inspect_image(name_or_id), name_or_id)
+        except APIError as e:
+            if not _not_found(e):
+                raise
+            image = None
+
+        with self._lock:
+            self._set(name_or_id, image)
+            events.publish(self, ['set', name_or_id, image])
+
+        return image
+
+    def _set(self, name_or_id, image):
+        self._changes += 1
+        if image is None:
+            self._remove(self._resolve(name_or_id))
+        else:
+            self._remove(image['Id'])
+            self._put(image)
+
+    def get(self, client, name_or_id):
+        """
+        Looks up an image by id or tag without asking Docker about images
+        the index does not know.
+        """
+        with self._lock:
+            id = self._resolve(name_or_id)
+            if id not in self._dirty:
+                return self._by_id.get(id)
+
+        # The image may have lost the tag it was looked up by
+        self.refresh(client, id)
+        return self.get(client, name_or_id)
+
+    def by_id(self, client, id):
+        image = self._lookup(client, self._known_id, id)
+        if image is not None and image['Id'] != id:
+            image = None
+        return image
+
+    def by_name(self, client, name_or_id):
+        return self._lookup(client, self._resolve, name_or_id)
+
+    def _lookup(self, client, resolve, key):
+        with self._lock:
+            id = resolve(key)
+            if id is not None and id not in self._dirty:
+                return self._by_id[id]
+
+        if id is not None:
+            self.refresh(client, id)
+            return self._lookup(client, resolve, key)
+
+        # A miss may only mean the event for a new image has not been read
+        # yet, inspect is a direct lookup in Docker
+        return self.refresh(client, key)
+
+    def _known_id(self, id):
+        return id if id in self._by_id else None
+
+    def _resolve(self, name_or_id):
+        if name_or_id in self._by_id:
+            return name_or_id
+        return self._by_tag.get(_image_key(name_or_id))
+
+    def _put(self, image):
+        id = image['Id']
+        self._by_id[id] = image
+
+        for tag in image.get('RepoTags') or []:
+            if tag == '<none>:<none>':
+                continue
+            old = self._by_tag.get(tag)
+            if old is not None and old != id and old in self._by_id:
+                # The tag moved, the old image no longer has it
+                previous = self._by_id[old]
+                self._by_id[old] = dict(previous, RepoTags=[
+                    t for t in previous['RepoTags'] if t != tag])
+            self._by_tag[tag] = id
+
+    def _remove(self, id):
+        self._dirty.discard(id)
+        image = self._by_id.pop(id, None)
+        if image is None:
+            return
+
+        for tag in image.get('RepoTags') or []:
+            if self._by_tag.get(tag) == id:
+                del self._by_tag[tag]
+
+
+_IMAGE_INDEX = ImageIndex()
+events.add_listener(_IMAGE_INDEX)
+
+
+def get_image_index(client):
+    """
+    Returns the image index if it can answer lookups for this client, see
+    get_container_index.
+    """
+    if not DockerConfig.image_index_enabled():
+        return None
+
+    events.ensure_started()
+
+    if not _IMAGE_INDEX.synced or not _IMAGE_INDEX.covers(client):
+        return None
+
+    if not events.is_replica():
+        _IMAGE_INDEX.resync_expired(client)
+    return _IMAGE_INDEX
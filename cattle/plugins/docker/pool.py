@@ -0,0 +1,135 @@
+import logging
+import os
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+
+log = logging.getLogger('docker')
+
+
+def tls_identity(tls_config):
+    if not tls_config:
+        return None
+    return tuple(getattr(tls_config, attr, None)
+                 for attr in ['cert', 'verify', 'ssl_version',
+                              'assert_hostname', 'assert_fingerprint'])
+
+
+class ClientPool(object):
+    """
+    Docker clients shared by everything in a process, keyed by base url,
+    API version and TLS identity.  A client is a requests session, sharing
+    it keeps its connections alive between calls.  Each client lets at most
+    max_connections requests through at a time, the others wait.  The least
+    recently used client is dropped when there are more than size of them,
+    and closed once no request of another thread is using it.
+
+    Clients are never shared across processes, a forked worker starts with
+    an empty pool.
+    """
+
+    def __init__(self, size, max_connections):
+        self._size = size
+        self._max_connections = max_connections
+        self._lock = Lock()
+        self._pid = None
+        self._clients = OrderedDict()
+        self._created = 0
+        self._reused = 0
+
+    def get(self, key, factory):
+        with self._lock:
+            self._check_pid()
+            client = self._clients.pop(key, None)
+            if client is not None:
+                self._reused += 1
+                self._clients[key] = client
+                return client
+
+        client = factory()
+        self._limit(client)
+
+        with self._lock:
+            self._check_pid()
+            existing = self._clients.pop(key, None)
+            if existing is not None:
+                # Lost a race with another thread, use the first one
+                self._reused += 1
+                self._clients[key] = existing
+                client.close()
+                return existing
+
+            self._created += 1
+            self._clients[key] = client
+            evicted = []
+            while len(self._clients) > self._size:
+                evicted.append(self._clients.popitem(last=False)[1])
+
+        for old in evicted:
+            old.evict()
+
+        return client
+
+    def stats(self):
+        with self._lock:
+            self._check_pid()
+            total = self._created + self._reused
+            return {
+                'clients': len(self._clients),
+                'created': self._created,
+                'reused': self._reused,
+                'reuseRatio': float(self._reused) / total if total else 0.0,
+            }
+
+    def _check_pid(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Connections of the parent are not ours to use
+            self._clients = OrderedDict()
+            self._created = 0
+            self._reused = 0
+            self._pid = pid
+
+    def _limit(self, client):
+        _Usage(client, self._max_connections)
+
+
+class _Usage(object):
+    """
+    Counts the requests of a pooled client, waiting or sent, and limits
+    how many are sent at a time.  An evicted client is closed when the last
+    of them is done.
+    """
+
+    def __init__(self, client, max_connections):
+        self._client = client
+        self._send = client.send
+        self._slots = BoundedSemaphore(max_connections)
+        self._lock = Lock()
+        self._active = 0
+        self._evicted = False
+        client.send = self.send
+        client.evict = self.evict
+
+    def send(self, request, **kw):
+        with self._lock:
+            self._active += 1
+        try:
+            with self._slots:
+                return self._send(request, **kw)
+        finally:
+            with self._lock:
+                self._active -= 1
+                close = self._evicted and not self._active
+            if close:
+                self._close()
+
+    def evict(self):
+        with self._lock:
+            self._evicted = True
+            close = not self._active
+        if close:
+            self._close()
+
+    def _close(self):
+        log.debug('Closing docker client for %s', self._client.base_url)
+        self._client.close()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Event, Lock
+
+from cattle import Config
+from cattle.lock import lock
+from cattle.plugins.docker import DockerConfig
+
+log = logging.getLogger('docker')
+
+
+class _FanOut(object):
+    """
+    Progress of a pull passed on to everybody waiting for it.
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    def update(self, msg, progress=None, data=None):
+        for listener in list(self.listeners):
+            try:
+                listener.update(msg, progress=progress, data=data)
+            except:
+                log.exception('Failed to report pull progress')
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = Event()
+        self.progress = _FanOut()
+        self.result = None
+        self.exception = None
+
+
+class PullCoordinator(object):
+    """
+    Makes sure an image is pulled once no matter how many requests want it
+    at the same time.
+
+    Within a process later callers join the pull in progress, get its
+    progress updates and its result or exception.  Across processes the
+    pull holds a lock named after the image that the others wait on, when
+    they get it they skip the pull if it completed after they asked for it.
+    The result of the pull is kept in its marker file so they return it
+    too, or None if it can not be stored as JSON.
+
+    Pulls with different registry credentials are never shared, a caller
+    must not get an image, or a failure, through somebody else's
+    credential.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flights = {}
+
+    def pull(self, name, func, progress=None, credential=None):
+        """
+        Calls func(progress) to pull the image name unless a pull of it with
+        the same credential is already running, returns what it returned.
+        credential is anything that tells the registry credential apart,
+        None for none.
+        """
+        key = (name, credential)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            if progress is not None:
+                flight.progress.listeners.append(progress)
+
+        if not leader:
+            log.info('Waiting for the pull of [%s] in progress', name)
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result
+
+        try:
+            flight.result = self._pull(name, credential, func, flight)
+            return flight.result
+        except Exception as e:
+            flight.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _pull(self, name, credential, func, flight):
+        requested = time.time()
+        if credential is not None:
+            name_key = '{0}\0{1}'.format(name, credential)
+        else:
+            name_key = name
+        key = 'pull-' + hashlib.md5(name_key).hexdigest()
+        marker = os.path.join(Config.lock_dir(), key + '.done')
+
+        with lock(key, timeout=DockerConfig.pull_lock_timeout()):
+            try:
+                if os.path.getmtime(marker) >= requested:
+                    log.info('[%s] was pulled by another worker', name)
+                    return _read_result(marker)
+            except OSError:
+                pass
+
+            progress = flight.progress
+            if not progress.listeners:
+                progress = None
+            result = func(progress)
+
+            _write_result(marker, result)
+            return result
+
+
+def _write_result(marker, result):
+    try:
+        data = json.dumps(result)
+    except (TypeError, ValueError):
+        data = 'null'
+    with open(marker, 'w') as f:
+        f.write(data)
+
+
+def _read_result(marker):
+    try:
+        with open(marker) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+_PULLS = PullCoordinator()
+
+
+def single_flight_pull(name, func, progress=None, credential=None):
+    return _PULLS.pull(name, func, progress, credential)
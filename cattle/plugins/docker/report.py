@@ -0,0 +1,83 @@
+import hashlib
+import json
+from threading import Lock
+
+
+def _digest(instance):
+    return int(hashlib.sha1(json.dumps(instance, sort_keys=True))
+               .hexdigest(), 16)
+
+
+class InstanceReporter(object):
+    """
+    Remembers the instance set last reported on a ping so following pings
+    only have to carry what was added, changed or removed since.
+
+    Every report gets a new generation number and a checksum of the full set.
+    The checksum is the XOR of the sha1 of every instance serialized as JSON
+    with sorted keys, so it does not depend on order and is updated only for
+    the instances that changed.  The server opts into deltas by echoing the
+    generation and checksum it last applied in the ping options.  Anything
+    that does not match, or no generation at all, gets the full set back,
+    which is also how the server asks for a resync.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._generation = 0
+        self._checksum = 0
+        self._reported = {}
+
+    def report(self, instances, generation=None, checksum=None):
+        with self._lock:
+            delta = generation is not None and \
+                generation == self._generation and \
+                checksum == self._format(self._checksum)
+
+            previous = self._reported
+            current = {}
+            changed = []
+            for instance in instances:
+                key = instance['dockerId']
+                old = previous.get(key)
+                if old is not None and old[0] == instance:
+                    current[key] = old
+                else:
+                    current[key] = (instance, _digest(instance))
+                    changed.append(instance)
+
+            removed = []
+            checksum_value = self._checksum
+            for key, old in previous.iteritems():
+                new = current.get(key)
+                if new is old:
+                    continue
+                checksum_value ^= old[1]
+                if new is None:
+                    removed.append({
+                        'type': 'instance',
+                        'uuid': old[0]['uuid'],
+                        'dockerId': key,
+                    })
+            for instance in changed:
+                checksum_value ^= current[instance['dockerId']][1]
+
+            self._generation += 1
+            self._checksum = checksum_value
+            self._reported = current
+
+            options = {
+                'instancesGeneration': self._generation,
+                'instancesChecksum': self._format(checksum_value),
+                'instancesDelta': delta,
+            }
+
+            if delta:
+                options['instancesRemoved'] = removed
+                return changed, options
+
+            return list(instances), options
+
+    @staticmethod
+    def _format(checksum):
+        return '{0:040x}'.format(checksum)
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import os.path
 import shutil
@@ -7,6 +9,8 @@ from cattle.type_manager import get_type, MARSHALLER
 from cattle.storage import BaseStoragePool
 from cattle.agent.handler import KindBasedMixin
 from cattle.plugins.docker.util import is_no_op, remove_container
+from cattle.plugins.docker.pull import single_flight_pull
+from cattle.plugins.docker.index import get_image_index
 from cattle.lock import lock
 from cattle.progress import Progress
 from . import docker_client, get_compute
@@ -16,6 +20,17 @@ from cattle.utils import is_str_set
 log = logging.getLogger('docker')
 
 
+def _credential_key(image):
+    """
+    Tells the registry credential of an image apart from others without
+    keeping its secret, None if it has none.
+    """
+    credential = image.get('registryCredential')
+    if credential is None:
+        return None
+    return hashlib.sha1(json.dumps(credential, sort_keys=True)).hexdigest()
+
+
 class DockerPool(KindBasedMixin, BaseStoragePool):
     def __init__(self):
         KindBasedMixin.__init__(self, kind='docker')
@@ -23,7 +38,12 @@ class DockerPool(KindBasedMixin, BaseStoragePool):
 
     @staticmethod
     def _get_image_by_id(id):
-        templates = docker_client().images(all=True)
+        client = docker_client()
+        index = get_image_index(client)
+        if index is not None:
+            return index.by_id(client, id)
+
+        templates = client.images(all=True)
         templates = filter(lambda x: x['Id'] == id, templates)
 
         if len(templates) > 0:
@@ -38,8 +58,12 @@ class DockerPool(KindBasedMixin, BaseStoragePool):
         if is_no_op(image):
             return True
         parsed_tag = DockerPool.parse_repo_tag(image.data.dockerImage.fullName)
+        client = docker_client()
+        index = get_image_index(client)
+        if index is not None:
+            return index.by_name(client, parsed_tag['uuid']) is not None
         try:
-            if len(docker_client().inspect_image(parsed_tag['uuid'])):
+            if len(client.inspect_image(parsed_tag['uuid'])):
                 return True
         except APIError:
             pass
@@ -98,6 +122,12 @@ class DockerPool(KindBasedMixin, BaseStoragePool):
         if is_no_op(image):
             return
 
+        return single_flight_pull(
+            image.data.dockerImage.fullName,
+            lambda p: self._pull_or_build(image, p), progress,
+            _credential_key(image))
+
+    def _pull_or_build(self, image, progress):
         if self._is_build(image):
             return self._image_build(image, progress)
 
@@ -2,6 +2,7 @@ import logging
 import os
 
 from docker.errors import APIError
+from cattle.plugins.docker.index import get_container_index
 
 log = logging.getLogger('docker')
 
@@ -71,3 +72,7 @@ def remove_container(client, container):
                 raise e
         except AttributeError:
             raise e
+
+    index = get_container_index(client)
+    if index is not None:
+        index.discard(container['Id'])
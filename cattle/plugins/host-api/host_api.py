@@ -1,9 +1,12 @@
+import logging
 import os
 from cattle.plugins.docker import DockerConfig
 from cattle import Config
 
 from cattle.process_manager import background
 
+log = logging.getLogger('host-api')
+
 
 class HostApi(object):
 
@@ -12,6 +15,12 @@ class HostApi(object):
         env['HOST_API_CATTLE_ACCESS_KEY'] = Config.access_key()
         env['HOST_API_CATTLE_SECRET_KEY'] = Config.secret_key()
 
+        # The host and container stats host-api serves come from cAdvisor,
+        # logs, exec and the proxy do not need it
+        if not Config.cadvisor_enabled():
+            log.warn('cAdvisor is disabled, host-api will not serve host '
+                     'and container stats')
+
         url = 'http://{0}:{1}'.format(Config.cadvisor_ip(),
                                       Config.cadvisor_port())
 
@@ -5,12 +5,16 @@ import re
 
 from cattle.utils import CadvisorAPIClient
 from cattle import Config
+from cattle.plugins.host_info.facts import HostFacts
+from cattle.plugins.host_info.sampler import get_sampler
+from cattle.plugins.host_info.snapshot import HostSnapshot
 
 
 class CpuCollector(object):
-    def __init__(self):
+    def __init__(self, facts=None):
         self.cadvisor = CadvisorAPIClient(Config.cadvisor_ip(),
                                           Config.cadvisor_port())
+        self.facts = facts if facts is not None else HostFacts()
 
     def _get_cpuinfo_data(self):
         with open('/proc/cpuinfo') as f:
@@ -40,11 +44,17 @@ class CpuCollector(object):
 
         return data
 
-    def _get_cpu_percentages(self):
+    def _get_cpu_percentages(self, snapshot):
         data = {}
         data['cpuCoresPercentages'] = []
 
-        stats = self.cadvisor.get_stats()
+        sampler = get_sampler()
+        latest = sampler.latest() if sampler else None
+        if latest is not None:
+            data['cpuCoresPercentages'] = latest['cpuCoresPercentages']
+            return data
+
+        stats = snapshot.cadvisor_stats()
 
         if len(stats) >= 2:
             stat_latest = stats[-1]
@@ -69,17 +79,24 @@ class CpuCollector(object):
         return data
 
     def _get_load_average(self):
+        sampler = get_sampler()
+        latest = sampler.latest() if sampler else None
+        if latest is not None:
+            return {'loadAvg': latest['loadAvg']}
         return {'loadAvg': list(os.getloadavg())}
 
     def key_name(self):
         return "cpuInfo"
 
-    def get_data(self):
+    def get_data(self, snapshot=None):
+        if snapshot is None:
+            snapshot = HostSnapshot(self.cadvisor)
+
         data = {}
 
         if platform.system() == 'Linux':
-            data.update(self._get_linux_cpu_info())
+            data.update(self.facts.get('cpuInfo', self._get_linux_cpu_info))
             data.update(self._get_load_average())
-            data.update(self._get_cpu_percentages())
+            data.update(self._get_cpu_percentages(snapshot))
 
         return data
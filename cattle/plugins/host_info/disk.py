@@ -2,46 +2,51 @@ import platform
 
 from cattle.utils import CadvisorAPIClient
 from cattle import Config
+from cattle.plugins.host_info.facts import HostFacts
+from cattle.plugins.host_info.snapshot import HostSnapshot
 
 
 class DiskCollector(object):
-    def __init__(self, docker_client=None):
+    def __init__(self, docker_client=None, facts=None):
         self.unit = 1048576
         self.cadvisor = CadvisorAPIClient(Config.cadvisor_ip(),
                                           Config.cadvisor_port())
 
         self.docker_client = docker_client
-        self.docker_storage_driver = None
-
-        if self.docker_client:
-            self.docker_storage_driver = \
-                self.docker_client.info().get("Driver", None)
+        self.facts = facts if facts is not None else HostFacts()
 
     def _convert_units(self, number):
         # Return in MB
         return round(float(number)/self.unit, 3)
 
-    def _get_dockerstorage_info(self):
+    def _get_docker_storage_driver(self, snapshot):
+        if not self.docker_client:
+            return None
+        return self.facts.get('dockerInfo', snapshot.docker_info).get(
+            "Driver", None)
+
+    def _get_dockerstorage_info(self, snapshot):
         data = {}
 
         if self.docker_client:
-            for item in self.docker_client.info().get("DriverStatus"):
+            # The pool usage in here changes, it is read every time
+            for item in snapshot.docker_info().get("DriverStatus"):
                 data[item[0]] = item[1]
 
         return data
 
-    def _include_in_filesystem(self, device):
+    def _include_in_filesystem(self, device, storage_driver):
         include = True
 
-        if self.docker_storage_driver == "devicemapper":
+        if storage_driver == "devicemapper":
             if device.startswith("/dev/mapper/docker-"):
                 include = False
 
         return include
 
-    def _get_mountpoints_cadvisor(self):
+    def _get_mountpoints_cadvisor(self, snapshot):
         data = {}
-        stat = self.cadvisor.get_latest_stat()
+        stat = snapshot.cadvisor_latest_stat()
 
         if 'filesystem' in stat.keys():
             for fs in stat['filesystem']:
@@ -58,13 +63,15 @@ class DiskCollector(object):
 
         return data
 
-    def _get_machine_filesystems_cadvisor(self):
+    def _get_machine_filesystems_cadvisor(self, snapshot):
         data = {}
-        machine_info = self.cadvisor.get_machine_stats()
+        machine_info = snapshot.cadvisor_machine()
+        storage_driver = self._get_docker_storage_driver(snapshot)
 
         if 'filesystems' in machine_info.keys():
             for filesystem in machine_info['filesystems']:
-                if self._include_in_filesystem(filesystem['device']):
+                if self._include_in_filesystem(filesystem['device'],
+                                               storage_driver):
                     data[filesystem['device']] = {
                         'capacity': self._convert_units(filesystem['capacity'])
                     }
@@ -74,20 +81,24 @@ class DiskCollector(object):
     def key_name(self):
         return 'diskInfo'
 
-    def get_data(self):
+    def get_data(self, snapshot=None):
+        if snapshot is None:
+            snapshot = HostSnapshot(self.cadvisor, self.docker_client)
+
         data = {
             'fileSystems': {},
             'mountPoints': {},
             'dockerStorageDriverStatus': {},
-            'dockerStorageDriver': self.docker_storage_driver
+            'dockerStorageDriver': self._get_docker_storage_driver(snapshot)
         }
 
         if platform.system() == 'Linux':
             data['fileSystems'].update(
-                self._get_machine_filesystems_cadvisor())
-            data['mountPoints'].update(self._get_mountpoints_cadvisor())
+                self._get_machine_filesystems_cadvisor(snapshot))
+            data['mountPoints'].update(
+                self._get_mountpoints_cadvisor(snapshot))
 
         data['dockerStorageDriverStatus'].update(
-            self._get_dockerstorage_info())
+            self._get_dockerstorage_info(snapshot))
 
         return data
@@ -0,0 +1,65 @@
+import logging
+from threading import Lock
+
+log = logging.getLogger('host_info')
+
+# Facts that come from the Docker daemon and change when it restarts
+DOCKER_FACTS = frozenset(['dockerInfo', 'dockerVersion'])
+
+
+class HostFacts(object):
+    """
+    What does not change while the agent runs: the CPU model and count, the
+    kernel, the Docker version, operating system and storage driver.  Each
+    fact is read the first time it is asked for and kept until refresh().
+
+    The facts also listen to the Docker event watcher.  The Docker facts
+    are dropped whenever the event stream drops, as it does when the daemon
+    restarts, and when the daemon reports it reloaded its configuration.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+        self._generation = 0
+
+    def get(self, key, fetch):
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            generation = self._generation
+
+        value = fetch()
+
+        with self._lock:
+            # Not kept if the facts were dropped while it was fetched
+            if generation == self._generation:
+                self._values[key] = value
+        return value
+
+    def invalidate(self, keys=None):
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._values = {}
+            else:
+                for key in keys:
+                    self._values.pop(key, None)
+
+    def refresh(self):
+        self.invalidate()
+
+    def forked(self):
+        self._lock = Lock()
+
+    def reset(self):
+        self.invalidate(DOCKER_FACTS)
+
+    def resync(self, client):
+        pass
+
+    def on_event(self, client, event):
+        if event.get('Type') == 'daemon':
+            log.info('Docker daemon event %s, dropping Docker host facts',
+                     event.get('Action'))
+            self.invalidate(DOCKER_FACTS)
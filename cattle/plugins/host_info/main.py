@@ -1,30 +1,95 @@
 import logging
+import time
+from threading import Lock, Thread
 
+from cattle import Config
+from cattle.utils import CadvisorAPIClient
 from cattle.plugins.host_info.memory import MemoryCollector
 from cattle.plugins.host_info.os_c import OSCollector
 from cattle.plugins.host_info.cpu import CpuCollector
 from cattle.plugins.host_info.disk import DiskCollector
+from cattle.plugins.host_info.facts import HostFacts
+from cattle.plugins.host_info.snapshot import HostSnapshot
 
 log = logging.getLogger('host_info')
 
 
+class _Collection(Thread):
+    def __init__(self, collector, snapshot):
+        Thread.__init__(self)
+        self.daemon = True
+        self.collector = collector
+        self.snapshot = snapshot
+        self.result = {}
+        self.ok = False
+
+    def run(self):
+        try:
+            self.result = self.collector.get_data(self.snapshot)
+            self.ok = True
+        except:
+            log.exception("Error collecting {0} stats".format(
+                self.collector.key_name()))
+
+
 class HostInfo(object):
     def __init__(self, docker_client=None):
         self.docker_client = docker_client
+        self.cadvisor = CadvisorAPIClient(Config.cadvisor_ip(),
+                                          Config.cadvisor_port())
+
+        self.facts = HostFacts()
 
         self.collectors = [MemoryCollector(),
-                           OSCollector(self.docker_client),
-                           DiskCollector(self.docker_client),
-                           CpuCollector()]
+                           OSCollector(self.docker_client, self.facts),
+                           DiskCollector(self.docker_client, self.facts),
+                           CpuCollector(self.facts)]
+
+        self._lock = Lock()
+        self._running = {}
+        self._last = {}
 
     def collect_data(self):
+        """
+        Runs the collectors at the same time on one HostSnapshot.  A
+        collector that is not done within Config.host_stats_timeout()
+        reports what it last returned, it keeps running and its result is
+        used by the next collection instead of starting it again.
+        """
+        with self._lock:
+            return self._collect()
+
+    def refresh(self):
+        """
+        Drops the cached host facts, the next collection reads them again.
+        """
+        self.facts.refresh()
+
+    def _collect(self):
+        snapshot = HostSnapshot(self.cadvisor, self.docker_client)
+        deadline = time.time() + Config.host_stats_timeout()
+
+        for collector in self.collectors:
+            key = collector.key_name()
+            if key not in self._running:
+                collection = _Collection(collector, snapshot)
+                collection.start()
+                self._running[key] = collection
+
         data = {}
         for collector in self.collectors:
-            try:
-                data[collector.key_name()] = collector.get_data()
-            except:
-                log.exception(
-                    "Error collecting {0} stats".format(collector.key_name()))
-                data[collector.key_name()] = {}
+            key = collector.key_name()
+            collection = self._running[key]
+            collection.join(max(0, deadline - time.time()))
+
+            if collection.is_alive():
+                log.info('Collecting %s stats is taking longer than %s '
+                         'seconds', key, Config.host_stats_timeout())
+                data[key] = self._last.get(key, {})
+            else:
+                del self._running[key]
+                data[key] = collection.result
+                if collection.ok:
+                    self._last[key] = collection.result
 
         return data
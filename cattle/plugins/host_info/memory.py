@@ -1,5 +1,7 @@
 import platform
 
+from cattle.plugins.host_info.sampler import get_sampler
+
 
 class MemoryCollector(object):
     def __init__(self):
@@ -40,8 +42,12 @@ class MemoryCollector(object):
     def key_name(self):
         return "memoryInfo"
 
-    def get_data(self):
+    def get_data(self, snapshot=None):
         if platform.system() == 'Linux':
+            sampler = get_sampler()
+            latest = sampler.latest() if sampler else None
+            if latest is not None:
+                return latest['memory']
             return self._parse_linux_meminfo()
         else:
             return {}
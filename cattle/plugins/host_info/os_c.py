@@ -1,9 +1,13 @@
 import platform
 
+from cattle.plugins.host_info.facts import HostFacts
+from cattle.plugins.host_info.snapshot import HostSnapshot
+
 
 class OSCollector(object):
-    def __init__(self, docker_client=None):
+    def __init__(self, docker_client=None, facts=None):
         self.docker_client = docker_client
+        self.facts = facts if facts is not None else HostFacts()
 
     def key_name(self):
         return "osInfo"
@@ -18,13 +22,14 @@ class OSCollector(object):
 
         return data
 
-    def _get_docker_version(self):
+    def _get_docker_version(self, snapshot):
         data = {}
 
         if platform.system() == 'Linux':
             version = "Unknown"
             if self.docker_client:
-                ver_resp = self.docker_client.version()
+                ver_resp = self.facts.get('dockerVersion',
+                                          snapshot.docker_version)
                 version = "Docker version {0}, build {1}".format(
                     ver_resp.get("Version", "Unknown"),
                     ver_resp.get("GitCommit", "Unknown"))
@@ -33,21 +38,27 @@ class OSCollector(object):
 
         return data
 
-    def _get_os(self):
+    def _get_os(self, snapshot):
         data = {}
         if platform.system() == 'Linux':
             if self.docker_client:
-                data["operatingSystem"] = \
-                    self.docker_client.info().get("OperatingSystem",
-                                                  None)
+                data["operatingSystem"] = self.facts.get(
+                    'dockerInfo', snapshot.docker_info).get(
+                    "OperatingSystem", None)
 
-            data['kernelVersion'] = \
-                platform.release() if len(platform.release()) > 0 else None
+            data['kernelVersion'] = self.facts.get(
+                'kernelVersion', self._get_kernel_version)
 
         return data
 
-    def get_data(self):
-        data = self._get_os()
-        data.update(self._get_docker_version())
+    def _get_kernel_version(self):
+        return platform.release() if len(platform.release()) > 0 else None
+
+    def get_data(self, snapshot=None):
+        if snapshot is None:
+            snapshot = HostSnapshot(None, self.docker_client)
+
+        data = self._get_os(snapshot)
+        data.update(self._get_docker_version(snapshot))
 
         return data
@@ -0,0 +1,307 @@
+import logging
+import os
+import time
+from array import array
+from threading import Lock, Thread
+
+from cattle import Config
+
+log = logging.getLogger('host_info')
+
+# The /proc/meminfo fields MemoryCollector reports
+MEMORY_KEYS = [('MemTotal', 'memTotal'),
+               ('MemFree', 'memFree'),
+               ('MemAvailable', 'memAvailable'),
+               ('Buffers', 'buffers'),
+               ('Cached', 'cached'),
+               ('SwapCached', 'swapCached'),
+               ('Active', 'active'),
+               ('Inactive', 'inactive'),
+               ('SwapTotal', 'swapTotal'),
+               ('SwapFree', 'swapFree')]
+
+# Kept for a field the kernel does not have, reported as None
+MISSING = float('nan')
+
+SECTOR_SIZE = 512
+
+
+class RingBuffer(object):
+    """
+    The last size rows of width numbers, kept in one flat array.  Once
+    full every append overwrites the oldest row.
+    """
+
+    def __init__(self, size, width):
+        self.size = size
+        self.width = width
+        self._data = array('d', [0.0]) * (size * width)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, values):
+        offset = self._next * self.width
+        self._data[offset:offset + self.width] = array('d', values)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def latest(self):
+        if not self._count:
+            return None
+        offset = (self._next - 1) % self.size * self.width
+        return self._data[offset:offset + self.width].tolist()
+
+    def rows(self, count=None):
+        """
+        Returns the last count rows, all of them by default, oldest first.
+        """
+        if count is None or count > self._count:
+            count = self._count
+        rows = []
+        for i in xrange(self._next - count, self._next):
+            offset = i % self.size * self.width
+            rows.append(self._data[offset:offset + self.width].tolist())
+        return rows
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _cpu_times(text):
+    cores = []
+    for line in text.splitlines():
+        if line.startswith('cpu') and line[3:4].isdigit():
+            fields = [int(v) for v in line.split()[1:9]]
+            # idle and iowait
+            cores.append((sum(fields), fields[3] + fields[4]))
+    return cores
+
+
+def _memory(text):
+    values = {}
+    for line in text.splitlines():
+        parts = line.split(':', 1)
+        if len(parts) == 2:
+            values[parts[0]] = parts[1].split()[0]
+    # In MB, as MemoryCollector reports them
+    return [round(float(values[key]) / 1024, 3) if key in values else MISSING
+            for key, _ in MEMORY_KEYS]
+
+
+def _disk_bytes(text, disks):
+    read = written = 0
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 10 and fields[2] in disks:
+            read += int(fields[5])
+            written += int(fields[9])
+    return read * SECTOR_SIZE, written * SECTOR_SIZE
+
+
+def _network_bytes(text):
+    received = sent = 0
+    for line in text.splitlines()[2:]:
+        name, _, counters = line.partition(':')
+        if name.strip() == 'lo':
+            continue
+        fields = counters.split()
+        received += int(fields[0])
+        sent += int(fields[8])
+    return received, sent
+
+
+def _disks(proc):
+    """
+    Whole disks, the counters of partitions are already in those.
+    """
+    sys_block = os.path.join(os.path.dirname(proc), 'sys', 'block')
+    try:
+        return set(d for d in os.listdir(sys_block)
+                   if not d.startswith(('loop', 'ram')))
+    except OSError:
+        return set()
+
+
+class HostSampler(object):
+    """
+    Reads the host counters in /proc every Config.host_sampler_interval()
+    seconds in a background thread.  Per core CPU percentages, disk and
+    network rates are derived from two samples in a row and kept, along
+    with memory and load, in ring buffers of Config.host_sampler_size()
+    rows.  latest() and query() only read those, CpuCollector and
+    MemoryCollector report the latest CPU, load and memory sample.
+
+    The thread is started lazily and once per process.
+    """
+
+    SERIES = ['cpu', 'memory', 'load', 'disk', 'network']
+
+    def __init__(self, proc='/proc', size=None):
+        self._proc = proc
+        self._size = size
+        self._lock = Lock()
+        self._pid = None
+        self._disks = None
+        self._previous = None
+        self._buffers = None
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            self._pid = pid
+            self._previous = None
+            self._buffers = None
+
+            t = Thread(target=self._run, args=(pid,))
+            t.setDaemon(True)
+            t.start()
+
+    def _run(self, pid):
+        while self._pid == pid:
+            try:
+                self.sample()
+            except:
+                log.exception('Failed to sample host counters')
+            time.sleep(Config.host_sampler_interval())
+
+    def _file(self, name):
+        return _read(os.path.join(self._proc, name))
+
+    def sample(self, now=None):
+        if now is None:
+            now = time.time()
+        if self._disks is None:
+            self._disks = _disks(self._proc)
+
+        cpu = _cpu_times(self._file('stat'))
+        memory = _memory(self._file('meminfo'))
+        load = [float(v) for v in self._file('loadavg').split()[:3]]
+        disk = _disk_bytes(self._file('diskstats'), self._disks)
+        network = _network_bytes(self._file('net/dev'))
+
+        previous = self._previous
+        self._previous = (now, cpu, disk, network)
+        if previous is None or len(previous[1]) != len(cpu) or \
+                now <= previous[0]:
+            return
+
+        elapsed = now - previous[0]
+        percentages = []
+        for (total, idle), (prev_total, prev_idle) in zip(cpu, previous[1]):
+            busy = (total - prev_total) - (idle - prev_idle)
+            total = total - prev_total
+            percentages.append(
+                round(float(busy) / total * 100, 3) if total > 0 else 0.0)
+
+        rows = {
+            'cpu': percentages,
+            'memory': memory,
+            'load': load,
+            'disk': [max(0, c - p) / elapsed
+                     for c, p in zip(disk, previous[2])],
+            'network': [max(0, c - p) / elapsed
+                        for c, p in zip(network, previous[3])],
+        }
+
+        with self._lock:
+            buffers = self._buffers
+            if buffers is None or buffers['cpu'].width != len(cpu):
+                size = self._size or Config.host_sampler_size()
+                buffers = dict((name, RingBuffer(size, len(rows[name])))
+                               for name in self.SERIES)
+                buffers['time'] = RingBuffer(size, 1)
+                self._buffers = buffers
+
+            buffers['time'].append([now])
+            for name in self.SERIES:
+                buffers[name].append(rows[name])
+
+    def latest(self):
+        """
+        Returns the last derived sample, None until there is one.
+        """
+        with self._lock:
+            if self._buffers is None:
+                return None
+            row = dict((name, self._buffers[name].latest())
+                       for name in self.SERIES)
+            now = self._buffers['time'].latest()[0]
+
+        return {
+            'time': now,
+            'cpuCoresPercentages': row['cpu'],
+            'memory': dict((k, None if v != v else v)
+                           for (_, k), v in zip(MEMORY_KEYS, row['memory'])),
+            'loadAvg': row['load'],
+            'diskBytesPerSecond': dict(zip(['read', 'write'], row['disk'])),
+            'networkBytesPerSecond': dict(zip(['rx', 'tx'], row['network'])),
+        }
+
+    def query(self, series, seconds=None, points=None):
+        """
+        Returns [time, values] pairs of series for the last seconds, all
+        that is kept by default.  With points the window is split in that
+        many equal steps and the samples in each are averaged.
+        """
+        with self._lock:
+            if self._buffers is None:
+                return []
+            times = [t for t, in self._buffers['time'].rows()]
+            rows = self._buffers[series].rows()
+
+        if seconds is not None:
+            start = times[-1] - seconds
+            first = next((i for i, t in enumerate(times) if t > start),
+                         len(times))
+            times = times[first:]
+            rows = rows[first:]
+
+        if points is None or len(times) <= points:
+            return [[t, row] for t, row in zip(times, rows)]
+
+        step = (times[-1] - times[0]) / points
+        buckets = []
+        for t, row in zip(times, rows):
+            index = min(int((t - times[0]) / step), points - 1) \
+                if step > 0 else 0
+            if not buckets or buckets[-1][0] != index:
+                buckets.append([index, t, [0.0] * len(row), 0])
+            bucket = buckets[-1]
+            bucket[1] = t
+            bucket[2] = [a + b for a, b in zip(bucket[2], row)]
+            bucket[3] += 1
+
+        return [[t, [round(v / n, 3) for v in total]]
+                for _, t, total, n in buckets]
+
+    def history(self, points):
+        """
+        Returns the query() of every series for all that is kept, in at
+        most points steps.
+        """
+        return dict((series, self.query(series, points=points))
+                    for series in self.SERIES)
+
+
+_SAMPLER = HostSampler()
+
+
+def get_sampler():
+    """
+    Returns the started host sampler, None if it is turned off.
+    """
+    if not Config.host_sampler_enabled():
+        return None
+    _SAMPLER.ensure_started()
+    return _SAMPLER
@@ -0,0 +1,68 @@
+from threading import Lock
+
+from cattle import Config
+
+
+class HostSnapshot(object):
+    """
+    The cAdvisor and Docker documents of one stats collection.  Each is
+    fetched the first time a collector asks for it, collectors asking at
+    the same time wait for that one fetch, and all of them share the
+    result.  When cAdvisor is turned off its documents are empty.
+    """
+
+    def __init__(self, cadvisor, docker_client=None):
+        self.cadvisor = cadvisor
+        self.docker_client = docker_client
+        self._lock = Lock()
+        self._values = {}
+        self._fetch_locks = {}
+
+    def _get(self, key, fetch):
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            fetch_lock = self._fetch_locks.setdefault(key, Lock())
+
+        with fetch_lock:
+            with self._lock:
+                if key in self._values:
+                    return self._values[key]
+
+            value = fetch()
+
+            with self._lock:
+                self._values[key] = value
+            return value
+
+    def cadvisor_stats(self):
+        if not Config.cadvisor_enabled():
+            return []
+
+        def fetch():
+            containers = self.cadvisor.get_containers()
+            if containers:
+                return containers['stats']
+            return []
+        return self._get('stats', fetch)
+
+    def cadvisor_latest_stat(self):
+        stats = self.cadvisor_stats()
+        if len(stats) > 1:
+            return stats[-1]
+        return {}
+
+    def cadvisor_machine(self):
+        if not Config.cadvisor_enabled():
+            return {}
+        return self._get('machine', self.cadvisor.get_machine_stats)
+
+    def docker_info(self):
+        if self.docker_client is None:
+            return {}
+        return self._get('info', self.docker_client.info)
+
+    def docker_version(self):
+        if self.docker_client is None:
+            return {}
+        return self._get('version', self.docker_client.version)
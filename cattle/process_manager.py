@@ -1,7 +1,14 @@
+import ctypes
+import ctypes.util
+import errno
+import json
 import time
 import os
 import logging
-from threading import Thread
+import signal
+import sys
+from threading import Event, Lock, Thread
+from cattle import Config
 try:
     from subprocess32 import Popen
 except:
@@ -9,78 +16,299 @@ except:
 
 log = logging.getLogger('process-manager')
 
+PR_SET_CHILD_SUBREAPER = 36
 
-# There's nothing about this solution that I particularly like.  The basic
-# problem is the agent will spawn many subprocesses that need to be alive as
-# long as the agent is alive.  If the subprocess dies, it should be restarted.
-# If the agent dies, the subprocess should die too.  A better solution could
-# be to make the agent process be PID 1 in a new PID namespace.
+# How long the rest of the process group of a dead child gets to exit after
+# SIGTERM before it is killed
+GROUP_KILL_TIMEOUT = 5
+
+# Name of the wrapper that guards the process group of the agent
+GROUP_GUARD = 'process-group-guard'
+
+WRAPPER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'process_wrapper.py')
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _prctl = _libc.prctl
+except (OSError, AttributeError):
+    # Not Linux
+    _prctl = None
+
+
+def prctl(option, arg):
+    if _prctl is None:
+        return False
+    if _prctl(option, arg, 0, 0, 0) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return True
+
+
+def _wrap(parent, command):
+    """
+    Returns command run by process_wrapper.py, which sets up the process
+    group and death signal of the child after it execs.  Python code
+    between fork and exec is not safe in the threaded agent.  With no
+    command the wrapper guards the process group of parent.
+    """
+    if isinstance(command, basestring):
+        command = [command]
+    return [sys.executable, WRAPPER, str(parent),
+            str(GROUP_KILL_TIMEOUT)] + list(command)
+
+
+def _orphans(parent, exclude):
+    """
+    Returns the exited processes parent adopted as their subreaper.  Those
+    are in another process group than parent, children parent started
+    itself are in its own group or in exclude.
+    """
+    pgrp = os.getpgrp()
+    orphans = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) in exclude:
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(name)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except IOError:
+            continue
+        if fields[0] == 'Z' and int(fields[1]) == parent and \
+                int(fields[2]) != pgrp:
+            orphans.append(int(name))
+    return orphans
+
+
+def _kill_group(pgid):
+    """
+    Kills what is left of the process group of a child that exited and
+    reaps the members the agent adopted as their subreaper.
+    """
+    deadline = time.time() + GROUP_KILL_TIMEOUT
+    sig = signal.SIGTERM
+    while True:
+        try:
+            os.killpg(pgid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            return
+
+        try:
+            while os.waitpid(-pgid, os.WNOHANG)[0]:
+                pass
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+
+        if time.time() >= deadline:
+            sig = signal.SIGKILL
+        time.sleep(0.01)
+
+
+class _Child(object):
+    def __init__(self, name, spawn):
+        self.name = name
+        self.spawn = spawn
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.failures = 0
+        self.last_exit = None
+
+    def restart_delay(self, uptime):
+        """
+        Returns how long to wait before restarting after the child ran for
+        uptime seconds.  A child that ran longer than the longest backoff
+        is restarted right away, one that keeps dying waits twice as long
+        every time.
+        """
+        max_backoff = Config.process_max_restart_backoff()
+        if uptime >= max_backoff:
+            self.failures = 0
+            return 0
+
+        delay = min(Config.process_restart_backoff() * 2 ** self.failures,
+                    max_backoff)
+        self.failures += 1
+        return delay
+
+
+# The agent spawns subprocesses that need to be alive as long as the agent
+# is alive.  If a subprocess dies it is restarted, along with it the rest of
+# its process group is killed.  If the agent dies the kernel sends every
+# subprocess SIGTERM, and SIGKILL follows when it does not exit, see
+# process_wrapper.py.  The agent is also the subreaper of their children,
+# whatever they leave behind when they exit is reaped every
+# Config.process_reap_interval() seconds.
+#
+# The agent puts itself in a new process group.  Its workers and what it
+# starts with popen stay in that group, a wrapper with no command guards it
+# and kills the group when the agent dies.
+#
+# Only the process that started the subprocesses knows how they are doing,
+# the agent workers are forked from it.  It writes the state of its
+# subprocesses to Config.process_stats_file() whenever one starts or exits
+# and stats() reads that file in every other process.
 class ProcessManager(object):
     def __init__(self):
-        self.pids = {}
-        self.processes = []
+        self.children = []
+        self._pid = None
+        self._write_lock = Lock()
 
     def init(self):
-        script = os.path.join(os.path.dirname(__file__), 'process_watcher.sh')
+        self._pid = os.getpid()
+        # Drops what the last run of the agent left
+        self._write_stats()
 
-        launch_script = False
         try:
             # If this isn't UNIX, this will fail, so just ignore it
             os.setpgid(0, 0)
-            launch_script = True
-        except:
-            pass
+            self._background(GROUP_GUARD, [])
+        except OSError:
+            log.info('Not guarding the process group of the agent')
 
-        if launch_script:
-            self.background([script])
+        try:
+            if not prctl(PR_SET_CHILD_SUBREAPER, 1):
+                return
+        except OSError:
+            log.exception('Failed to become a subreaper')
+            return
 
-        t = Thread(target=self.watch)
+        log.info('Reaping orphaned descendants of the agent')
+        t = Thread(target=self._reap, args=(os.getpid(),))
         t.setDaemon(True)
         t.start()
 
-    def watch(self):
+    def _reap(self, pid):
         while True:
-            time.sleep(2)
+            time.sleep(Config.process_reap_interval())
+            exclude = set(child.process.pid for child in self.children
+                          if child.process is not None)
             try:
-                self.processes = filter(_wait_process, self.processes)
-
-                for pid, spawn in self.pids.items():
-                    if not os.path.exists('/proc/{0}'.format(pid)):
-                        self._exec(spawn, pid)
+                for orphan in _orphans(pid, exclude):
+                    try:
+                        os.waitpid(orphan, os.WNOHANG)
+                    except OSError as e:
+                        if e.errno != errno.ECHILD:
+                            raise
             except:
-                log.exception('Error in process watcher')
+                log.exception('Failed to reap orphaned processes')
 
-    def _exec(self, spawn, old_pid=None):
+    def _start(self, child):
+        log.info('Launching %s', child.name)
         try:
-            new_pid = spawn()
-            self.pids[new_pid] = spawn
-            try:
-                del self.pids[old_pid]
-            except KeyError:
-                pass
+            child.process = child.spawn()
         except:
+            child.process = None
             log.exception('Failed to spawn process')
+            return False
+
+        child.started = time.time()
+        log.info('Launched %s as pid %d', child.name, child.process.pid)
+        self._write_stats()
+        return True
+
+    def supervise(self, child, started):
+        """
+        Starts the child and waits for it to exit, which wakes this thread
+        as soon as it does, then starts it again after the restart backoff.
+        The death signal of a child is sent when the thread that started it
+        exits, so it is always started from here.
+        """
+        self._start(child)
+        started.set()
+
+        while True:
+            uptime = 0
+            if child.process is not None:
+                child.last_exit = child.process.wait()
+                uptime = time.time() - child.started
+                log.info('Process %d is dead, return code %d',
+                         child.process.pid, child.last_exit)
+                _kill_group(child.process.pid)
+                self._write_stats()
+
+            delay = child.restart_delay(uptime)
+            if delay > 0:
+                log.info('Restarting %s in %s seconds', child.name, delay)
+                time.sleep(delay)
 
-    def _exec_background(self, *args, **kw):
-        log.info('Launching %s', args[0])
-        p = Popen(*args, **kw)
-        self.processes.append(p)
-        log.info('Launched %s as pid %d', args[0], p.pid)
-        return p.pid
+            child.restarts += 1
+            self._start(child)
 
     def background(self, *args, **kw):
-        self._exec(lambda: self._exec_background(*args, **kw))
+        self._background(args[0][0] if isinstance(args[0], list) else args[0],
+                         *args, **kw)
 
+    def _background(self, name, *args, **kw):
+        command = _wrap(os.getpid(), args[0])
+        child = _Child(name, lambda: Popen(command, *args[1:], **kw))
+        self._pid = os.getpid()
+        self.children.append(child)
+
+        started = Event()
+        t = Thread(target=self.supervise, args=(child, started))
+        t.setDaemon(True)
+        t.start()
+        started.wait()
+
+    def _states(self):
+        states = []
+        for child in self.children:
+            process = child.process
+            running = process is not None and process.returncode is None
+            states.append({
+                'name': child.name,
+                'pid': process.pid if running else None,
+                'running': running,
+                'restarts': child.restarts,
+                'started': child.started if running else None,
+                'lastExitCode': child.last_exit,
+            })
+        return states
+
+    def _write_stats(self):
+        stats_file = Config.process_stats_file()
+        temp_name = '{0}.{1}'.format(stats_file, os.getpid())
+        try:
+            with self._write_lock:
+                with open(temp_name, 'w') as f:
+                    json.dump(self._states(), f)
+                os.rename(temp_name, stats_file)
+        except (IOError, OSError):
+            log.exception('Failed to write process stats to %s', stats_file)
+
+    def _read_stats(self):
+        try:
+            with open(Config.process_stats_file()) as f:
+                return json.load(f)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                log.exception('Failed to read process stats')
+        except ValueError:
+            log.exception('Failed to read process stats')
+        return []
+
+    def stats(self):
+        if self._pid == os.getpid():
+            states = self._states()
+        else:
+            # A forked worker, its copy of the children does not change
+            states = self._read_stats()
+
+        now = time.time()
+        stats = []
+        for state in states:
+            started = state.pop('started')
+            state['uptime'] = now - started if state['running'] else 0
+            stats.append(state)
+        return stats
 
-def _wait_process(process):
-    process.poll()
-    if process.returncode is not None:
-        log.info('Process %d is dead, return code %d', process.pid,
-                 process.returncode)
-        return False
-    return True
 
 _PROCESS_MANAGER = ProcessManager()
 
 background = _PROCESS_MANAGER.background
 init = _PROCESS_MANAGER.init
+stats = _PROCESS_MANAGER.stats
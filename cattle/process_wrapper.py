@@ -0,0 +1,141 @@
+"""
+Runs a subprocess of the agent:
+
+    process_wrapper.py AGENT_PID KILL_TIMEOUT [COMMAND [ARGS...]]
+
+It puts itself in a new process group and asks for SIGTERM when the agent
+dies, all in a fresh single threaded process instead of between fork and
+exec in the agent.  It then runs COMMAND as its child in the same group and
+waits for it, exiting the way COMMAND did.  When the agent dies the wrapper
+sends SIGTERM to the group and, if COMMAND is still running after
+KILL_TIMEOUT seconds, SIGKILL.
+
+Without COMMAND it guards the process group of the agent instead, which
+holds the agent, its workers and whatever they started with popen.  When
+the agent dies the group gets SIGTERM and SIGKILL after KILL_TIMEOUT
+seconds.
+
+Nothing polls, the wrapper sleeps in wait() or pause() until a signal or
+the exit of COMMAND wakes it.
+
+It only uses the standard library, the agent runs it as a script.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import signal
+import sys
+
+PR_SET_PDEATHSIG = 1
+
+
+def _set_death_signal(sig):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        prctl = libc.prctl
+    except (OSError, AttributeError):
+        # Not Linux
+        return
+    if prctl(PR_SET_PDEATHSIG, sig, 0, 0, 0) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+
+def _killpg(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _on_agent_death(agent, pgid, kill_timeout, on_kill):
+    """
+    Makes SIGTERM from the kernel, sent when the agent dies, terminate
+    process group pgid and kill it after kill_timeout seconds.
+    """
+    terminating = []
+
+    def on_term(signum, frame):
+        # The group is signalled below, the wrapper is in it too
+        if terminating or os.getppid() == agent:
+            return
+        terminating.append(True)
+        signal.setitimer(signal.ITIMER_REAL, kill_timeout)
+        _killpg(pgid, signal.SIGTERM)
+
+    def on_alarm(signum, frame):
+        _killpg(pgid, signal.SIGKILL)
+        on_kill()
+
+    signal.signal(signal.SIGALRM, on_alarm)
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def _guard(agent, pgid, kill_timeout):
+    _on_agent_death(agent, pgid, kill_timeout, lambda: os._exit(0))
+    if os.getppid() != agent:
+        # The agent died before the handler was set up
+        os.kill(os.getpid(), signal.SIGTERM)
+    while True:
+        signal.pause()
+
+
+def _run(agent, kill_timeout, command):
+    wrapper = os.getpid()
+    child = os.fork()
+    if child == 0:
+        try:
+            _set_death_signal(signal.SIGTERM)
+            if os.getppid() != wrapper:
+                os._exit(1)
+            os.execvp(command[0], command)
+        except OSError as e:
+            sys.stderr.write('Failed to run {0}: {1}\n'.format(command[0], e))
+        os._exit(127)
+
+    # The group is killed with the wrapper in it, nothing to do then
+    _on_agent_death(agent, os.getpgid(0), kill_timeout, lambda: None)
+    if os.getppid() != agent:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    while True:
+        try:
+            _, status = os.waitpid(child, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig != signal.SIGKILL:
+            signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+        os._exit(128 + sig)
+    os._exit(os.WEXITSTATUS(status))
+
+
+def main(args):
+    agent = int(args[0])
+    kill_timeout = float(args[1])
+    command = args[2:]
+
+    # Started by the agent, so in its group
+    agent_pgid = os.getpgrp()
+    os.setpgid(0, 0)
+    _set_death_signal(signal.SIGTERM)
+
+    if not command:
+        _guard(agent, agent_pgid, kill_timeout)
+    elif os.getppid() != agent:
+        # The agent died before the death signal was set up
+        os._exit(1)
+    else:
+        _run(agent, kill_timeout, command)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
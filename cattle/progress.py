@@ -1,5 +1,10 @@
+import heapq
 import logging
+import os
+import time
+from threading import Condition, Lock, Thread
 
+from cattle import Config
 from cattle import utils
 from cattle.type_manager import get_type, PUBLISHER
 
@@ -7,9 +12,31 @@ log = logging.getLogger('progress')
 
 
 class EventProgress(object):
-    def __init__(self, req, parent=None):
+    """
+    Progress updates are coalesced per request.  update() only remembers
+    the latest message, it is published from a background thread at most
+    once every CATTLE_PROGRESS_INTERVAL seconds.  flush() publishes what is
+    still pending right away, the worker does that for every request before
+    it publishes the reply so the last update always gets out and never
+    arrives after the reply.
+    """
+
+    def __init__(self, req, parent=None, interval=None):
         self._req = req
         self._parent = parent
+        self._interval = Config.progress_interval() if interval is None \
+            else interval
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._pending = None
+        self._last = 0
+
+        _track(self)
+
+    @property
+    def key(self):
+        return _request_key(self._req if self._parent is None
+                            else self._parent)
 
     def update(self, msg, progress=None, data=None):
         resp = utils.reply(self._req, data)
@@ -23,11 +50,28 @@ class EventProgress(object):
             resp['transitioningMessage'] = msg
             resp['transitioningProgress'] = progress
 
-        publisher = get_type(PUBLISHER)
-        try:
-            publisher.publish(resp)
-        except:
-            pass
+        with self._lock:
+            scheduled = self._pending is not None
+            self._pending = resp
+            due = self._last + self._interval
+
+        if not scheduled:
+            _SCHEDULER.schedule(due, self)
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock:
+                resp = self._pending
+                self._pending = None
+                if resp is None:
+                    return
+                self._last = time.time()
+
+            publisher = get_type(PUBLISHER)
+            try:
+                publisher.publish(resp)
+            except:
+                pass
 
 
 Progress = EventProgress
@@ -39,3 +83,86 @@ class LogProgress(object):
 
     def update(self, msg, progress=None, data=None):
         log.info('Progress %s %s', msg, progress)
+
+
+def _request_key(req):
+    try:
+        return req.id
+    except AttributeError:
+        return None
+
+
+_TRACKED = {}
+_TRACKED_LOCK = Lock()
+
+
+def _track(progress):
+    key = progress.key
+    if key is None:
+        return
+    with _TRACKED_LOCK:
+        _TRACKED.setdefault(key, []).append(progress)
+
+
+def flush(req):
+    """
+    Publishes the pending updates of every EventProgress made while
+    handling req and forgets them.
+    """
+    with _TRACKED_LOCK:
+        tracked = _TRACKED.pop(_request_key(req), [])
+
+    for progress in tracked:
+        progress.flush()
+
+
+class _Scheduler(object):
+    """
+    Flushes EventProgress objects when their update is due.  The thread is
+    started on first use in every process.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._cond = Condition(Lock())
+        self._heap = []
+        self._seq = 0
+
+    def schedule(self, due, progress):
+        self._ensure_started()
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, progress))
+            self._cond.notify()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._cond:
+            if self._pid == pid:
+                return
+            self._heap = []
+            t = Thread(target=self._run, name='progress')
+            t.daemon = True
+            t.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    if self._heap:
+                        self._cond.wait(self._heap[0][0] - time.time())
+                    else:
+                        self._cond.wait()
+                progress = heapq.heappop(self._heap)[2]
+
+            try:
+                progress.flush()
+            except:
+                log.exception('Failed to publish progress')
+
+
+_SCHEDULER = _Scheduler()
@@ -1,4 +1,5 @@
 TYPES = {}
+_GENERATION = 0
 
 PRIORITY_PRE = 500
 PRIORITY_SPECIFIC = 1000
@@ -26,12 +27,15 @@ def types():
 
 
 def register_type(type_name, impl):
+    global _GENERATION
+    _GENERATION += 1
+
     priority = _get_priority(impl)
     try:
         types = TYPES[type_name]
         for i in range(len(types)):
             if priority < _get_priority(types[i]):
-                types.insert(i, types)
+                types.insert(i, impl)
                 break
         else:
             types.append(impl)
@@ -39,6 +43,14 @@ def register_type(type_name, impl):
         TYPES[type_name] = [impl]
 
 
+def generation():
+    """
+    Changes every time a type is registered, lets callers cache what they
+    derive from the registry.
+    """
+    return _GENERATION
+
+
 def _get_priority(impl):
     try:
         return impl.priority
@@ -30,55 +30,105 @@ _TEMP_NAME = 'work'
 _TEMP_PREFIX = 'cattle-temp-'
 
 
-def _to_json_object(v):
-    if isinstance(v, dict):
-        return JsonObject(v)
-    elif isinstance(v, list):
-        ret = []
-        for i in v:
-            ret.append(_to_json_object(i))
-        return ret
+def _wrap(container, key, value):
+    if type(value) is dict:
+        value = JsonObject(value)
+    elif type(value) is list:
+        value = JsonList(value)
     else:
-        return v
+        return value
+
+    container[key] = value
+    return value
 
 
-class JsonObject:
-    def __init__(self, data):
-        for k, v in data.items():
-            self.__dict__[k] = _to_json_object(v)
+class JsonObject(dict):
+    """
+    A dict whose keys can also be read and written as attributes.
 
-    def __getitem__(self, item):
-        value = self.__dict__[item]
-        if isinstance(value, JsonObject):
-            return value.__dict__
-        return value
+    Nested dicts and lists are left as they were parsed and only wrapped
+    when they are first read, as an item, as an attribute or through get()
+    and items(), the wrapper then replaces the child so it is built once.
+    Since every wrapper is a real dict or list the structure can be handed
+    to json as it is and unwrap() does not need to copy anything.
+
+    A key named like a dict method, such as items or keys, has to be read
+    with get() or as an item, as an attribute it is the method.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, data=None):
+        if data is not None:
+            dict.__init__(self, data)
+
+    def __getitem__(self, key):
+        return _wrap(self, key, dict.__getitem__(self, key))
 
     def __getattr__(self, name):
-        return getattr(self.__dict__, name)
+        try:
+            value = dict.__getitem__(self, name)
+        except KeyError:
+            raise AttributeError(name)
+        return _wrap(self, name, value)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, key, default=None):
+        try:
+            value = dict.__getitem__(self, key)
+        except KeyError:
+            return default
+        return _wrap(self, key, value)
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self.get(key)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self.get(key)
+
+    def values(self):
+        return list(self.itervalues())
 
     @staticmethod
     def unwrap(json_object):
-        if isinstance(json_object, list):
-            ret = []
-            for i in json_object:
-                ret.append(JsonObject.unwrap(i))
-            return ret
-
-        if isinstance(json_object, dict):
-            ret = {}
-            for k, v in json_object.items():
-                ret[k] = JsonObject.unwrap(v)
-            return ret
-
-        if isinstance(json_object, JsonObject):
-            ret = {}
-            for k, v in json_object.__dict__.items():
-                ret[k] = JsonObject.unwrap(v)
-            return ret
-
         return json_object
 
 
+class JsonList(list):
+    """
+    The list counterpart of JsonObject, dicts in it are wrapped as they are
+    indexed or iterated over.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return JsonList(value)
+        return _wrap(self, index, value)
+
+    def __getslice__(self, i, j):
+        return JsonList(list.__getslice__(self, i, j))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
 class CadvisorAPIClient(object):
     def __init__(self, host, port, version='v1.2', proto='http://'):
         self.url = '{0}{1}:{2}/api/{3}'.format(proto, host, str(port), version)
@@ -155,6 +205,13 @@ def ping_include_instances(ping):
         return False
 
 
+def ping_get_option(ping, key, default=None):
+    try:
+        return ping.data.options[key]
+    except (KeyError, AttributeError):
+        return default
+
+
 def ping_add_resources(pong, *args):
     if 'resources' not in pong.data:
         pong.data.resources = []
@@ -1078,6 +1078,14 @@ def test_instance_deactivate(agent, responses):
     assert end - start > 1
 
 
+def assert_ping_instance_options(resp):
+    options = resp['data']['options']
+    assert options['instancesGeneration'] > 0
+    assert len(options['instancesChecksum']) == 40
+    del options['instancesGeneration']
+    del options['instancesChecksum']
+
+
 def assert_ping_stat_resources(resp):
     hostname = Config.hostname()
     pool_name = hostname + ' Storage Pool'
@@ -1127,8 +1135,30 @@ def ping_post_process(req, resp):
 
     resources = filter(lambda x: x.get('kind') == 'docker', resources)
     resources += instances
+
+    # What the agent supervises depends on where the tests run
+    info = resources[0]['info']
+    for process in info['processInfo']:
+        assert set(process.keys()) == set(['name', 'pid', 'running',
+                                           'restarts', 'uptime',
+                                           'lastExitCode'])
+    info['processInfo'] = []
+
+    # Whatever the host did while the tests ran, as [time, values] pairs
+    for samples in info['hostHistory'].values():
+        for sample in samples:
+            assert len(sample) == 2
+    info['hostHistory'] = {}
+
+    # Every running container on the host is there, with its cgroup
+    container_stats = info['containerStats']
+    for values in container_stats.values():
+        assert len(values) == len(container_stats['ids'])
+    for key in container_stats:
+        container_stats[key] = []
     resp['data']['resources'] = resources
     assert_ping_stat_resources(resp)
+    assert_ping_instance_options(resp)
 
 
 def ping_post_process_state_exception(req, resp):
@@ -1137,6 +1167,7 @@ def ping_post_process_state_exception(req, resp):
     resp['data']['resources'] = filter(lambda x: x.get('kind') == 'docker',
                                        resp['data']['resources'])
     assert_ping_stat_resources(resp)
+    assert_ping_instance_options(resp)
 
 
 @if_docker
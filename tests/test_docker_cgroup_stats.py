@@ -0,0 +1,115 @@
+from .common_fixtures import *  # NOQA
+import os
+import pytest
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.docker.cgroup_stats import ContainerStats
+from cattle.utils import JsonObject
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture()
+def cgroups(tmpdir):
+    root = str(tmpdir)
+
+    def container(path, cpu, read, written, usage=1024, limit=4096):
+        _write(os.path.join(root, 'cpuacct', path, 'cpuacct.usage'),
+               '{0}\n'.format(cpu))
+        memory = os.path.join(root, 'memory', path)
+        _write(os.path.join(memory, 'memory.usage_in_bytes'),
+               '{0}\n'.format(usage))
+        _write(os.path.join(memory, 'memory.limit_in_bytes'),
+               '{0}\n'.format(limit))
+        _write(os.path.join(root, 'blkio', path,
+                            'blkio.throttle.io_service_bytes'),
+               '8:0 Read {0}\n8:0 Write {1}\n8:0 Sync 7\n'
+               '8:16 Read {0}\nTotal {2}\n'.format(read, written,
+                                                   2 * read + written))
+
+    return root, container
+
+
+def test_rates_from_consecutive_collections(cgroups):
+    root, container = cgroups
+    stats = ContainerStats(root)
+
+    container('docker/a', 0, 0, 0)
+    container('system.slice/docker-b.scope', 0, 0, 0)
+
+    data = stats.collect(['a', 'b', 'gone'], now=10)
+    assert data['ids'] == ['a', 'b']
+    assert data['cpuPercentages'] == [None, None]
+    assert data['memoryUsage'] == [1024, 1024]
+    assert data['memoryLimit'] == [4096, 4096]
+
+    # Half a core for two seconds
+    container('docker/a', 10**9, 1000, 200, usage=2048)
+    container('system.slice/docker-b.scope', 4 * 10**9, 0, 0)
+
+    data = stats.collect(['b', 'a'], now=12)
+    assert data['ids'] == ['b', 'a']
+    assert data['cpuPercentages'] == [200.0, 50.0]
+    assert data['memoryUsage'] == [1024, 2048]
+    # Reads on both disks count, the totals do not
+    assert data['diskReadBytesPerSecond'] == [0.0, 1000.0]
+    assert data['diskWriteBytesPerSecond'] == [0.0, 100.0]
+
+
+def test_new_and_removed_containers(cgroups):
+    root, container = cgroups
+    stats = ContainerStats(root)
+
+    container('docker/a', 0, 0, 0)
+    stats.collect(['a'], now=1)
+
+    container('docker/b', 10**9, 0, 0)
+    data = stats.collect(['b'], now=2)
+    assert data['ids'] == ['b']
+    assert data['cpuPercentages'] == [None]
+
+    # a is no longer remembered
+    container('docker/a', 10**9, 0, 0)
+    data = stats.collect(['a', 'b'], now=3)
+    assert data['cpuPercentages'] == [None, 0.0]
+
+
+def test_ping_reports_container_stats(cgroups, monkeypatch):
+    from cattle.plugins.docker import compute
+    root, container = cgroups
+    container('docker/a', 0, 0, 0)
+
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOCKER_UUID', 'testuuid')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PHYSICAL_HOST_UUID', 'hostuuid')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOCKER_HOST_IP', '127.0.0.1')
+    monkeypatch.setattr(compute.events, 'ensure_started', lambda: None)
+    monkeypatch.setattr(compute.process_manager, 'stats', lambda: [])
+    monkeypatch.setattr(compute, 'get_sampler', lambda: None)
+
+    class FakeHostInfo(object):
+        def collect_data(self):
+            return {}
+
+    docker = compute.DockerCompute.__new__(compute.DockerCompute)
+    docker.host_info = FakeHostInfo()
+    docker.container_stats = ContainerStats(root)
+
+    ping = JsonObject({'data': {'options': {'resources': True,
+                                            'stats': True}}})
+    pong = JsonObject({'data': {}})
+    # Listed once for the ping, a stopped container has no stats
+    listing = [({'a': {}}, {'b': {}})]
+    docker._add_resources(ping, pong, listing)
+
+    host = [r for r in pong.data.resources if r['type'] == 'host'][0]
+    stats = host['info']['containerStats']
+    assert stats['ids'] == ['a']
+    assert stats['memoryUsage'] == [1024]
+    assert stats['memoryLimit'] == [4096]
+    assert host['info']['processInfo'] == []
+    assert host['info']['hostHistory'] == {}
@@ -0,0 +1,72 @@
+from .common_fixtures import *  # NOQA
+import os
+import pytest
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.docker import cluster
+from cattle.plugins.docker.cluster import ClusterClients
+
+
+class FakeClient(object):
+    def __init__(self, base_url_override=None, tls_config=None,
+                 pooled=True):
+        self.base_url = base_url_override
+        self.tls_config = tls_config
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def certs_dir(monkeypatch):
+    certs_dir = os.path.join(SCRATCH_DIR, 'client_certs')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'CLIENT_CERTS_DIR', certs_dir)
+    monkeypatch.setattr(cluster, 'docker_client', FakeClient)
+    return certs_dir
+
+
+def _host(account_id=1, key='key'):
+    return {
+        'accountId': account_id,
+        'caCrt': 'ca',
+        'clientCrt': 'crt',
+        'clientKey': key,
+    }
+
+
+def test_client_cached_until_certs_change(certs_dir):
+    clients = ClusterClients(4)
+    url = 'https://cluster:2376'
+    client = clients.get(_host(), url)
+    assert client.tls_config is not None
+
+    key_file = os.path.join(certs_dir, '1', 'client.key')
+    with open(key_file) as f:
+        assert f.read() == 'key'
+    mtime = os.path.getmtime(key_file)
+
+    assert clients.get(_host(), url) is client
+
+    other = clients.get(_host(key='new'), url)
+    assert other is not client
+    assert client.closed
+    with open(key_file) as f:
+        assert f.read() == 'new'
+
+    os.utime(key_file, (mtime - 100, mtime - 100))
+    mtime = os.path.getmtime(key_file)
+    assert ClusterClients(4).get(_host(key='new'), url) is not other
+    assert os.path.getmtime(key_file) == mtime
+
+
+def test_least_recently_used_evicted(certs_dir):
+    clients = ClusterClients(1)
+    first = clients.get(_host(1), 'https://a')
+    clients.get(_host(2), 'https://a')
+    assert first.closed
+
+
+def test_missing_certs_raise(certs_dir):
+    with pytest.raises(Exception):
+        ClusterClients(1).get({'accountId': 1}, 'https://a')
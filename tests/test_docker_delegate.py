@@ -0,0 +1,141 @@
+from .common_fixtures import *  # NOQA
+import os
+import pytest
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.docker import delegate
+from cattle.plugins.docker.delegate import ns_exec, ExecHelpers
+from cattle.utils import JsonObject
+
+SCRIPT = '''#!/bin/sh
+read event
+echo "$CATTLE_TEST_VALUE"
+echo "$event" | grep -q config.update || exit 3
+echo '{"ok": true}'
+'''
+
+
+@pytest.fixture
+def environ_reads(monkeypatch):
+    reads = []
+    real_environ = delegate._environ
+
+    def environ(pid):
+        reads.append(pid)
+        env = real_environ(pid)
+        env['CATTLE_TEST_VALUE'] = 'from-environ'
+        return env
+
+    monkeypatch.setattr(delegate, '_environ', environ)
+    return reads
+
+
+@pytest.fixture
+def home(monkeypatch, environ_reads):
+    home = os.path.join(SCRATCH_DIR, 'delegate-home')
+    events = os.path.join(home, 'events')
+    if not os.path.exists(events):
+        os.makedirs(events)
+    script = os.path.join(events, 'config.update')
+    with open(script, 'w') as f:
+        f.write(SCRIPT)
+    os.chmod(script, 0755)
+
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'HOME', home)
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'CONFIG_URL', 'http://config')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOCKER_DELEGATE_RETRY_TIMEOUT',
+                        '0.3')
+    # Run the scripts here instead of in the namespaces of a container
+    monkeypatch.setattr(delegate, '_nsenter', lambda pid: [])
+    monkeypatch.setattr(delegate, '_HELPERS', ExecHelpers(2))
+    return home
+
+
+def _event(name='config.update'):
+    return JsonObject({'name': name, 'data': {'x': 1}})
+
+
+def test_helper_is_reused(home, environ_reads, monkeypatch):
+    started = []
+    real = delegate._ExecHelper
+    monkeypatch.setattr(delegate, '_ExecHelper',
+                        lambda *a: started.append(a) or real(*a))
+
+    for i in range(3):
+        exit_code, output, data = ns_exec(os.getpid(), _event())
+        assert exit_code == 0
+        assert output == 'from-environ'
+        assert data == {'ok': True}
+
+    assert len(started) == 1
+    assert environ_reads == [os.getpid()]
+
+
+def test_failure_and_missing_script(home):
+    with open(os.path.join(home, 'events', 'other'), 'w') as f:
+        f.write(SCRIPT)
+    os.chmod(os.path.join(home, 'events', 'other'), 0755)
+
+    exit_code, output, data = ns_exec(os.getpid(), _event('other'))
+    assert exit_code == 3
+    assert data is None
+
+    exit_code, output, data = ns_exec(os.getpid(), _event('missing'))
+    assert exit_code == 127
+
+
+def test_falls_back_to_nsenter(home, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOCKER_DELEGATE_EXEC_HELPER',
+                        'false')
+    exit_code, output, data = ns_exec(os.getpid(), _event())
+    assert exit_code == 0
+    assert output == 'from-environ'
+    assert data == {'ok': True}
+
+
+def test_dead_helper_falls_back(home):
+    env, helper = delegate._HELPERS.get(os.getpid())
+    helper._process.kill()
+    helper._process.wait()
+
+    exit_code, output, data = ns_exec(os.getpid(), _event())
+    assert exit_code == 0
+    assert delegate._HELPERS.get(os.getpid())[1] is None
+
+
+def test_helper_closed_when_container_dies(home):
+    env, helper = delegate._HELPERS.get(os.getpid(), 'c1')
+
+    delegate._HELPERS.on_event(None, {'id': 'c2', 'status': 'die'})
+    assert helper._process.poll() is None
+
+    delegate._HELPERS.on_event(None, {'id': 'c1', 'status': 'die'})
+    assert helper._process.poll() is not None
+    assert delegate._HELPERS.get(os.getpid())[1] is not helper
+
+
+def test_idle_helper_closed(home, monkeypatch):
+    env, helper = delegate._HELPERS.get(os.getpid())
+
+    delegate._HELPERS.expire()
+    assert helper._process.poll() is None
+
+    monkeypatch.setitem(CONFIG_OVERRIDE,
+                        'DOCKER_DELEGATE_EXEC_HELPER_IDLE_TIMEOUT', '-1')
+    delegate._HELPERS.expire()
+    assert helper._process.poll() is not None
+
+
+def test_helper_call_times_out(home, monkeypatch):
+    script = os.path.join(home, 'events', 'slow')
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\nsleep 30\n')
+    os.chmod(script, 0755)
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOCKER_DELEGATE_TIMEOUT', '1')
+
+    env, helper = delegate._HELPERS.get(os.getpid())
+    with pytest.raises(delegate.HelperTimeout):
+        ns_exec(os.getpid(), _event('slow'))
+
+    assert helper._process.poll() is not None
+    assert delegate._HELPERS.get(os.getpid())[1] is None
@@ -0,0 +1,157 @@
+from .common_fixtures import *  # NOQA
+import pytest
+import time
+from docker.errors import APIError
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.docker.index import ImageIndex
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = ''
+
+
+class FakeClient(object):
+    base_url = 'http+docker://localunixsocket'
+
+    def __init__(self, images):
+        self.data = images
+        self.list_calls = 0
+        self.inspect_calls = 0
+
+    def images(self, all=False):
+        self.list_calls += 1
+        return [dict(i) for i in self.data]
+
+    def inspect_image(self, name_or_id):
+        self.inspect_calls += 1
+        if ':' not in name_or_id and not name_or_id.startswith('id'):
+            name_or_id += ':latest'
+        for i in self.data:
+            if i['Id'] == name_or_id or name_or_id in i['RepoTags']:
+                return {
+                    'Id': i['Id'],
+                    'RepoTags': list(i['RepoTags']),
+                    'Config': {'Labels': i['Labels']},
+                }
+        raise APIError('Not found', FakeResponse(404))
+
+
+def _image(id, tags, labels=None):
+    return {
+        'Id': id,
+        'RepoTags': tags,
+        'Labels': labels or {},
+    }
+
+
+@pytest.fixture
+def client():
+    return FakeClient([
+        _image('id1', ['busybox:latest', 'busybox:1']),
+        _image('id2', ['rancher/agent:v1'],
+               labels={'io.rancher.container.system': 'rancher-agent'}),
+        _image('id3', ['<none>:<none>']),
+    ])
+
+
+@pytest.fixture
+def index(client):
+    index = ImageIndex()
+    index.resync(client)
+    client.list_calls = 0
+    return index
+
+
+def test_lookups_do_not_call_docker(index, client):
+    assert index.synced
+    assert index.by_name(client, 'busybox')['Id'] == 'id1'
+    assert index.by_name(client, 'busybox:1')['Id'] == 'id1'
+    assert index.by_name(client, 'id2')['Id'] == 'id2'
+    assert index.by_id(client, 'id3')['Id'] == 'id3'
+    assert index.get(client, 'rancher/agent:v1')['Labels'] == \
+        {'io.rancher.container.system': 'rancher-agent'}
+    assert client.list_calls == 0
+    assert client.inspect_calls == 0
+
+
+def test_miss_probes_docker(index, client):
+    assert index.by_name(client, 'missing') is None
+    assert client.inspect_calls == 1
+
+    assert index.get(client, 'ubuntu') is None
+    assert client.inspect_calls == 1
+
+    client.data.append(_image('id4', ['ubuntu:latest']))
+    assert index.by_name(client, 'ubuntu')['Id'] == 'id4'
+    assert index.get(client, 'ubuntu:latest')['Id'] == 'id4'
+    assert client.inspect_calls == 2
+    assert client.list_calls == 0
+
+
+def test_events_update_index(index, client):
+    client.data.append(_image('id4', ['busybox:latest']))
+    client.data[0]['RepoTags'] = ['busybox:1']
+    index.on_event(client, {'status': 'pull', 'id': 'busybox:latest'})
+    assert index.get(client, 'busybox')['Id'] == 'id4'
+    assert index.get(client, 'id1')['RepoTags'] == ['busybox:1']
+
+    client.data.pop()
+    index.on_event(client, {'status': 'delete', 'id': 'id4'})
+    assert index.get(client, 'busybox') is None
+    assert index.get(client, 'busybox:1')['Id'] == 'id1'
+
+    index.on_event(client, {'status': 'create', 'id': 'id1'})
+    assert len(index.images()) == 3
+
+
+def test_invalidate_rereads_image(index, client):
+    client.data[0]['RepoTags'] = ['busybox:1']
+    assert index.by_name(client, 'busybox')['Id'] == 'id1'
+
+    index.invalidate('busybox')
+    assert index.by_name(client, 'busybox') is None
+    assert index.by_name(client, 'busybox:1')['RepoTags'] == ['busybox:1']
+
+
+def test_expired_index_is_reloaded(index, client, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE,
+                        'DOCKER_IMAGE_INDEX_REFRESH_INTERVAL', '300')
+    index.resync_expired(client)
+    assert client.list_calls == 0
+
+    client.data.append(_image('id4', ['ubuntu:latest']))
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 301)
+    index.resync_expired(client)
+    assert client.list_calls == 1
+    assert index.get(client, 'ubuntu')['Id'] == 'id4'
+
+
+def test_reset_unsyncs(index, client):
+    index.reset()
+    assert not index.synced
+    assert index.images() == []
+
+
+def test_sys_container_falls_back_on_docker_error(monkeypatch):
+    from cattle.plugins.docker import compute
+
+    class FailingIndex(object):
+        def get(self, client, name):
+            raise APIError('server error', FakeResponse(500))
+
+    monkeypatch.setattr(compute, 'docker_client', lambda: None)
+    monkeypatch.setattr(compute, 'get_image_index',
+                        lambda client: FailingIndex())
+
+    docker = compute.DockerCompute.__new__(compute.DockerCompute)
+    docker.system_images = {'rancher/agent:v1': 'agent'}
+    assert docker._get_sys_container({'Image': 'rancher/agent:v1'}) == \
+        'agent'
+    assert docker._get_sys_container({
+        'Image': 'other',
+        'Labels': {'io.rancher.container.system': 'network'},
+    }) == 'network'
@@ -0,0 +1,171 @@
+from .common_fixtures import *  # NOQA
+import json
+import os
+import pytest
+import socket
+from docker.errors import APIError
+
+from cattle.plugins.docker import events
+from cattle.plugins.docker.index import ContainerIndex
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = ''
+
+
+class FakeClient(object):
+    base_url = 'http+docker://localunixsocket'
+
+    def __init__(self, containers, id_filter=True):
+        self.data = containers
+        self.id_filter = id_filter
+        self.list_calls = 0
+        self.inspect_calls = 0
+
+    def containers(self, all=False, trunc=False, filters=None):
+        self.list_calls += 1
+        if filters and self.id_filter:
+            return [dict(c) for c in self.data if c['Id'] == filters['id']]
+        return [dict(c) for c in self.data]
+
+    def inspect_container(self, name_or_id):
+        self.inspect_calls += 1
+        for c in self.data:
+            if c['Id'] == name_or_id or '/' + name_or_id in c['Names']:
+                return {'Id': c['Id']}
+        raise APIError('Not found', FakeResponse(404))
+
+
+def _container(id, name, uuid=None, agent_id=None, aliases=[]):
+    labels = {}
+    if uuid:
+        labels['io.rancher.container.uuid'] = uuid
+    if agent_id:
+        labels['io.rancher.container.agent_id'] = agent_id
+    return {
+        'Id': id,
+        'Names': ['/' + name] + aliases,
+        'Labels': labels,
+    }
+
+
+@pytest.fixture
+def client():
+    return FakeClient([
+        _container('id1', 'name1', uuid='uuid1'),
+        _container('id2', 'name2', agent_id='42',
+                   aliases=['/name1/alias2']),
+        _container('id3', 'alias2'),
+    ])
+
+
+@pytest.fixture
+def index(client):
+    index = ContainerIndex()
+    index.resync(client)
+    client.list_calls = 0
+    return index
+
+
+def test_lookups_do_not_call_docker(index, client):
+    assert index.synced
+    assert index.by_name(client, 'name1')['Id'] == 'id1'
+    assert index.by_uuid(client, 'uuid1')['Id'] == 'id1'
+    assert index.by_agent_id(client, '42')['Id'] == 'id2'
+    assert index.by_id(client, 'id2')['Id'] == 'id2'
+    assert client.list_calls == 0
+    assert client.inspect_calls == 0
+
+
+def test_primary_name_wins_over_alias(index, client):
+    assert index.by_name(client, 'alias2')['Id'] == 'id3'
+
+    index.discard('id3')
+    client.data.pop()
+    assert index.by_name(client, 'alias2') is None
+    assert index.by_name(client, 'name2')['Id'] == 'id2'
+
+
+def test_miss_probes_docker(index, client):
+    assert index.by_name(client, 'missing') is None
+    assert client.inspect_calls == 1
+    assert client.list_calls == 0
+
+    client.data.append(_container('id4', 'name4'))
+    assert index.by_name(client, 'name4')['Id'] == 'id4'
+    assert client.list_calls == 1
+
+    assert index.by_name(client, 'name4')['Id'] == 'id4'
+    assert client.list_calls == 1
+
+
+def test_events_update_index(index, client):
+    client.data.append(_container('id4', 'name4', uuid='uuid4'))
+    index.on_event(client, {'status': 'create', 'id': 'id4'})
+    assert index.by_uuid(client, 'uuid4')['Id'] == 'id4'
+
+    client.data.pop()
+    index.on_event(client, {'status': 'destroy', 'id': 'id4'})
+    assert index.by_uuid(client, 'uuid4') is None
+
+    index.on_event(client, {'status': 'untag', 'id': 'busybox:latest'})
+    assert len(index.containers()) == 3
+
+
+def test_invalidate_rereads_container(index, client):
+    client.data[0]['Status'] = 'Up 1 second'
+    assert 'Status' not in index.by_id(client, 'id1')
+
+    index.invalidate('id1')
+    assert index.by_id(client, 'id1')['Status'] == 'Up 1 second'
+    assert client.list_calls == 1
+
+
+def test_refresh_without_id_filter(index, client):
+    client.id_filter = False
+    client.data.append(_container('id4', 'name4'))
+    index.refresh(client, 'id1')
+    assert index.by_name(client, 'name4')['Id'] == 'id4'
+    assert client.inspect_calls == 0
+
+
+def test_reset_unsyncs(index, client):
+    index.reset()
+    assert not index.synced
+    assert index.containers() == []
+
+
+def test_worker_copy_follows_agent_index(client, monkeypatch):
+    watcher = events.DockerEventWatcher()
+    monkeypatch.setattr(events, '_WATCHER', watcher)
+    agent = ContainerIndex()
+    watcher.add_listener(agent)
+    # This process serves the workers
+    watcher._feed_pid = os.getpid()
+
+    agent.resync(client)
+    feed, worker_end = socket.socketpair()
+    agent.snapshot(lambda update: watcher._join(0, feed, update))
+
+    client.data.append(_container('id4', 'name4', uuid='uuid4'))
+    agent.on_event(client, {'status': 'create', 'id': 'id4'})
+    agent.on_event(client, {'status': 'destroy', 'id': 'id1'})
+    feed.close()
+
+    worker = ContainerIndex()
+    worker_client = FakeClient([])
+    for line in worker_end.makefile('rb'):
+        watcher._apply(worker, json.loads(line)[1])
+
+    assert worker.synced
+    assert worker.by_uuid(worker_client, 'uuid4')['Id'] == 'id4'
+    assert worker.by_uuid(worker_client, 'uuid1') is None
+    assert worker.by_name(worker_client, 'alias2')['Id'] == 'id3'
+    assert worker_client.list_calls == 0
+    assert worker_client.inspect_calls == 0
+
+    agent.reset()
+    watcher._apply(worker, ['reset'])
+    assert not worker.synced
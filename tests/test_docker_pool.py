@@ -0,0 +1,110 @@
+from .common_fixtures import *  # NOQA
+import time
+from threading import Event, Thread
+
+from cattle.plugins.docker import pool
+from cattle.plugins.docker.pool import ClientPool
+
+
+class FakeClient(object):
+    def __init__(self, base_url, gate=None):
+        self.base_url = base_url
+        self.closed = False
+        self.gate = gate
+        self.active = 0
+        self.max_active = 0
+
+    def send(self, request, **kw):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        if self.gate is not None:
+            self.gate.wait()
+        self.active -= 1
+        return request
+
+    def close(self):
+        self.closed = True
+
+
+def test_clients_are_reused():
+    clients = ClientPool(2, 10)
+    a = clients.get(('unix://a', '1.18', None), lambda: FakeClient('a'))
+    assert clients.get(('unix://a', '1.18', None),
+                       lambda: FakeClient('a')) is a
+    b = clients.get(('unix://a', '1.20', None), lambda: FakeClient('a'))
+    assert b is not a
+
+    stats = clients.stats()
+    assert stats['created'] == 2
+    assert stats['reused'] == 1
+    assert stats['clients'] == 2
+
+
+def test_least_recently_used_client_is_closed():
+    clients = ClientPool(2, 10)
+    a = clients.get('a', lambda: FakeClient('a'))
+    b = clients.get('b', lambda: FakeClient('b'))
+    clients.get('a', lambda: FakeClient('a'))
+    clients.get('c', lambda: FakeClient('c'))
+
+    assert b.closed
+    assert not a.closed
+    assert clients.get('a', lambda: FakeClient('a')) is a
+
+
+def test_client_in_use_is_closed_when_done():
+    gate = Event()
+    clients = ClientPool(1, 10)
+    a = clients.get('a', lambda: FakeClient('a', gate))
+    t = Thread(target=a.send, args=(1,))
+    t.start()
+    assert _wait_for(lambda: a.active == 1)
+
+    clients.get('b', lambda: FakeClient('b'))
+    assert not a.closed
+
+    gate.set()
+    t.join(5)
+    assert a.closed
+
+
+def _wait_for(func, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if func():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_pool_is_per_process(monkeypatch):
+    clients = ClientPool(2, 10)
+    a = clients.get('a', lambda: FakeClient('a'))
+
+    monkeypatch.setattr(pool.os, 'getpid', lambda: -1)
+    assert clients.get('a', lambda: FakeClient('a')) is not a
+    assert clients.stats()['created'] == 1
+
+
+def test_connections_are_limited():
+    gate = Event()
+    clients = ClientPool(2, 2)
+    client = clients.get('a', lambda: FakeClient('a', gate))
+
+    threads = [Thread(target=client.send, args=(i,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert client.max_active <= 2
+
+
+def test_tls_identity():
+    class TLS(object):
+        cert = ('client.crt', 'client.key')
+        verify = 'ca.crt'
+
+    assert pool.tls_identity(None) is None
+    assert pool.tls_identity(TLS()) == pool.tls_identity(TLS())
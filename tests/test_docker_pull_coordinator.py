@@ -0,0 +1,113 @@
+from .common_fixtures import *  # NOQA
+import os
+import pytest
+import time
+from threading import Event, Thread
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.docker.pull import PullCoordinator
+
+
+class Recorder(object):
+    def __init__(self):
+        self.messages = []
+
+    def update(self, msg, progress=None, data=None):
+        self.messages.append(msg)
+
+
+@pytest.fixture(autouse=True)
+def lock_dir(monkeypatch):
+    lock_dir = os.path.join(SCRATCH_DIR, 'locks')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_DIR', lock_dir)
+    return lock_dir
+
+
+def test_concurrent_pulls_share_one():
+    pulls = PullCoordinator()
+    started = Event()
+    release = Event()
+    calls = []
+
+    def pull(progress):
+        calls.append(progress)
+        started.set()
+        release.wait(5)
+        progress.update('Downloading')
+        return 'image'
+
+    leader = Recorder()
+    results = []
+    t = Thread(target=lambda: results.append(
+        pulls.pull('busybox:latest', pull, leader)))
+    t.start()
+    assert started.wait(5)
+
+    joiners = [Recorder() for i in range(5)]
+    threads = [Thread(target=lambda r=r: results.append(
+        pulls.pull('busybox:latest', pull, r))) for r in joiners]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [t] + threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ['image'] * 6
+    for r in [leader] + joiners:
+        assert r.messages == ['Downloading']
+
+
+def test_failure_is_shared():
+    pulls = PullCoordinator()
+
+    def pull(progress):
+        raise ValueError('pull failed')
+
+    with pytest.raises(ValueError):
+        pulls.pull('busybox:latest', pull)
+
+    # The next caller pulls again
+    assert pulls.pull('busybox:latest', lambda p: 'ok') == 'ok'
+
+
+def test_skips_pull_finished_elsewhere(monkeypatch):
+    pulls = PullCoordinator()
+    assert pulls.pull('busybox:latest', lambda p: 'ok') == 'ok'
+
+    # Another process finished a pull after this one was asked for, its
+    # result is returned
+    monkeypatch.setattr(time, 'time', lambda: 0)
+    assert pulls.pull('busybox:latest', lambda p: 'pulled') == 'ok'
+
+
+def test_other_credential_does_not_join():
+    pulls = PullCoordinator()
+    started = Event()
+    release = Event()
+
+    def leader_pull(progress):
+        started.set()
+        release.wait(5)
+        raise ValueError('unauthorized')
+
+    errors = []
+
+    def lead():
+        try:
+            pulls.pull('private/app:1', leader_pull, credential='bad')
+        except ValueError as e:
+            errors.append(e)
+
+    t = Thread(target=lead)
+    t.start()
+    assert started.wait(5)
+
+    # Runs its own pull instead of waiting for the one with the bad
+    # credential and sharing its failure
+    assert pulls.pull('private/app:1', lambda p: 'image',
+                      credential='good') == 'image'
+    release.set()
+    t.join(5)
+    assert len(errors) == 1
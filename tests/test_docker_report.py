@@ -0,0 +1,83 @@
+from .common_fixtures import *  # NOQA
+
+from cattle.plugins.docker.report import InstanceReporter
+
+
+def _instance(id, state='running'):
+    return {
+        'type': 'instance',
+        'uuid': 'uuid-' + id,
+        'dockerId': id,
+        'state': state,
+    }
+
+
+def test_full_report_without_generation():
+    reporter = InstanceReporter()
+    instances = [_instance('a'), _instance('b')]
+
+    resources, options = reporter.report(instances)
+    assert resources == instances
+    assert options['instancesGeneration'] == 1
+    assert not options['instancesDelta']
+
+    resources, options = reporter.report(instances)
+    assert resources == instances
+    assert options['instancesGeneration'] == 2
+
+
+def test_delta_report():
+    reporter = InstanceReporter()
+    _, options = reporter.report([_instance('a'), _instance('b'),
+                                  _instance('c')])
+
+    resources, options = reporter.report(
+        [_instance('a'), _instance('b', state='stopped'), _instance('d')],
+        generation=options['instancesGeneration'],
+        checksum=options['instancesChecksum'])
+
+    assert options['instancesDelta']
+    assert sorted(r['dockerId'] for r in resources) == ['b', 'd']
+    assert options['instancesRemoved'] == [
+        {'type': 'instance', 'uuid': 'uuid-c', 'dockerId': 'c'}]
+
+    resources, options = reporter.report(
+        [_instance('a'), _instance('b', state='stopped'), _instance('d')],
+        generation=options['instancesGeneration'],
+        checksum=options['instancesChecksum'])
+
+    assert options['instancesDelta']
+    assert resources == []
+    assert options['instancesRemoved'] == []
+
+
+def test_checksum_matches_full_set():
+    instances = [_instance('a'), _instance('b', state='stopped')]
+
+    reporter = InstanceReporter()
+    _, options = reporter.report([_instance('b'), _instance('c')])
+    _, options = reporter.report(
+        instances,
+        generation=options['instancesGeneration'],
+        checksum=options['instancesChecksum'])
+
+    _, fresh = InstanceReporter().report(list(reversed(instances)))
+    assert options['instancesChecksum'] == fresh['instancesChecksum']
+
+
+def test_mismatch_sends_full_set():
+    reporter = InstanceReporter()
+    instances = [_instance('a')]
+    _, options = reporter.report(instances)
+
+    resources, stale = reporter.report(
+        instances, generation=options['instancesGeneration'] - 1,
+        checksum=options['instancesChecksum'])
+    assert not stale['instancesDelta']
+    assert resources == instances
+
+    resources, bad = reporter.report(
+        instances, generation=stale['instancesGeneration'],
+        checksum='0' * 40)
+    assert not bad['instancesDelta']
+    assert resources == instances
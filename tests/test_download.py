@@ -0,0 +1,281 @@
+from .common_fixtures import *  # NOQA
+import bz2
+import gzip
+import hashlib
+import os
+import pytest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock, Thread
+
+from cattle import CONFIG_OVERRIDE, download
+from cattle.download import _download_file, _SegmentProgress
+from cattle.download_cache import DownloadCache
+
+DATA = ''.join(str(i) for i in range(20000))
+
+
+@pytest.fixture(autouse=True)
+def cache(request, monkeypatch):
+    path = os.path.join(SCRATCH_DIR, 'download-cache', request.node.name)
+    cache = DownloadCache(path, 10 * len(DATA))
+    monkeypatch.setattr(download, '_CACHE', cache)
+    return cache
+
+
+def _file_url(name, data):
+    dir = os.path.join(SCRATCH_DIR, 'download-src')
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    file_name = os.path.join(dir, name)
+    with open(file_name, 'wb') as f:
+        f.write(data)
+    return 'file://' + file_name
+
+
+def _dest(name='download-dst'):
+    return os.path.join(SCRATCH_DIR, name)
+
+
+def _read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def _gzip(data):
+    file_name = os.path.join(SCRATCH_DIR, 'data.gz')
+    f = gzip.open(file_name, 'wb')
+    f.write(data)
+    f.close()
+    return _read(file_name)
+
+
+def test_plain_download_with_checksum():
+    url = _file_url('plain', DATA)
+    checksum = hashlib.sha256(DATA).hexdigest()
+    assert _read(_download_file(url, _dest(), checksum=checksum)) == DATA
+
+
+def test_decompressed_while_downloading():
+    hooks = []
+    gz = _gzip(DATA) + _gzip('more')
+    url = _file_url('data.gz', gz)
+    result = _download_file(url, _dest(),
+                            reporthook=lambda *x: hooks.append(x),
+                            checksum=hashlib.md5(gz).hexdigest())
+    assert _read(result) == DATA + 'more'
+    assert hooks[-1][2] == len(gz)
+
+    url = _file_url('data.bz2', bz2.compress(DATA))
+    assert _read(_download_file(url, _dest())) == DATA
+
+    result = _download_file(url, _dest(), decompression=False)
+    assert _read(result) == bz2.compress(DATA)
+
+
+def test_truncated_compressed_download_fails():
+    url = _file_url('cut.gz', _gzip(DATA)[:-8])
+    with pytest.raises(Exception) as e:
+        _download_file(url, _dest('cut'))
+    assert 'Compressed data ended' in str(e.value)
+
+    url = _file_url('cut.bz2', bz2.compress(DATA)[:-8])
+    with pytest.raises(Exception) as e:
+        _download_file(url, _dest('cut'))
+    assert 'Compressed data ended' in str(e.value)
+
+
+def test_bad_checksum_removes_file():
+    url = _file_url('plain', DATA)
+    with pytest.raises(Exception) as e:
+        _download_file(url, _dest('bad-checksum'), checksum='0' * 40)
+    assert 'Invalid checksum' in str(e.value)
+    assert os.listdir(os.path.join(_dest('bad-checksum'), 'work')) == []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    data = DATA
+    ranges = True
+    drop_first = True
+    requests = []
+    lock = Lock()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+
+    def do_GET(self):
+        start = 0
+        end = len(self.data) - 1
+        range = self.headers.get('Range')
+        with _Handler.lock:
+            _Handler.requests.append(range)
+            first = len(_Handler.requests) == 1
+        if range and self.ranges:
+            start, end = range.split('=')[1].split('-')
+            start = int(start)
+            end = int(end) if end else len(self.data) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, len(self.data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.end_headers()
+
+        if self.drop_first and first:
+            # Drop the first transfer half way
+            self.wfile.write(self.data[start:len(self.data) / 2])
+        else:
+            self.wfile.write(self.data[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server(request):
+    _Handler.requests = []
+    server = _Server(('127.0.0.1', 0), _Handler)
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    request.addfinalizer(server.shutdown)
+    return 'http://127.0.0.1:{0}/data'.format(server.server_port)
+
+
+def test_interrupted_download_resumes(server):
+    checksum = hashlib.sha1(DATA).hexdigest()
+    assert _read(_download_file(server, _dest(), checksum=checksum)) == DATA
+    assert _Handler.requests == [None, 'bytes={0}-'.format(len(DATA) / 2)]
+
+
+def test_restarts_without_range_support(server, monkeypatch):
+    monkeypatch.setattr(_Handler, 'ranges', False)
+    checksum = hashlib.sha1(DATA).hexdigest()
+    assert _read(_download_file(server, _dest(), checksum=checksum)) == DATA
+    assert len(_Handler.requests) == 2
+
+
+def test_cache_hit_by_checksum(server, cache):
+    checksum = hashlib.sha1(DATA).hexdigest()
+    first = _download_file(server, _dest(), checksum=checksum)
+    second = _download_file(server, _dest(), checksum=checksum)
+    assert _read(second) == DATA
+    assert len(_Handler.requests) == 2
+
+    # Changing what was handed out does not change the cache
+    with open(first, 'wb') as f:
+        f.write('changed')
+    assert _read(_download_file(server, _dest(), checksum=checksum)) == DATA
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+
+def test_cache_hit_by_url_and_version(cache):
+    url = _file_url('versioned', DATA)
+    _download_file(url, _dest())
+    assert _read(_download_file(url, _dest())) == DATA
+    assert cache.stats()['hits'] == 1
+
+    # A new version of the file is downloaded again
+    os.utime(url[7:], (0, 0))
+    _download_file(url, _dest())
+    assert cache.stats()['hits'] == 1
+
+
+def test_cache_evicts_least_recently_used(cache):
+    cache.max_size = 2 * len(DATA)
+    checksums = []
+    for i in range(3):
+        data = DATA[:-i] if i else DATA
+        url = _file_url('data-{0}'.format(i), data)
+        checksum = hashlib.md5(data).hexdigest()
+        checksums.append((url, checksum))
+        _download_file(url, _dest(), checksum=checksum)
+        os.utime(os.path.join(cache.path, cache.checksum_key(checksum, False)),
+                 (i, i))
+        cache.evict()
+
+    assert cache.stats()['evictions'] == 1
+    assert sorted(os.listdir(cache.path)) == sorted(
+        cache.checksum_key(c, False) for _, c in checksums[1:])
+
+
+def test_segmented_download(server, monkeypatch):
+    monkeypatch.setattr(_Handler, 'drop_first', False)
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_PARALLELISM', '4')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_SEGMENT_SIZE', '10000')
+    checksum = hashlib.sha1(DATA).hexdigest()
+    hooks = []
+    result = _download_file(server, _dest(), checksum=checksum,
+                            reporthook=lambda *x: hooks.append(x))
+    assert _read(result) == DATA
+    assert sorted(_Handler.requests) == sorted(
+        'bytes={0}-{1}'.format(i, min(i + 10000, len(DATA)) - 1)
+        for i in range(0, len(DATA), 10000))
+    assert hooks[-1][2] == len(DATA)
+
+
+def test_segmented_download_retries_segment(server, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_PARALLELISM', '2')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_SEGMENT_SIZE', '50000')
+    checksum = hashlib.sha1(DATA).hexdigest()
+    assert _read(_download_file(server, _dest(), checksum=checksum)) == DATA
+    assert len(_Handler.requests) == 3
+
+
+def test_segmented_falls_back_to_stream(server, monkeypatch):
+    monkeypatch.setattr(_Handler, 'drop_first', False)
+    monkeypatch.setattr(_Handler, 'do_HEAD', lambda self: (
+        self.send_response(200),
+        self.send_header('Accept-Ranges', 'bytes'),
+        self.send_header('Content-Length', str(len(DATA))),
+        self.end_headers()))
+    monkeypatch.setattr(_Handler, 'ranges', False)
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_PARALLELISM', '4')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'DOWNLOAD_SEGMENT_SIZE', '10000')
+    checksum = hashlib.sha1(DATA).hexdigest()
+    assert _read(_download_file(server, _dest(), checksum=checksum)) == DATA
+    assert _Handler.requests[-1] is None
+
+
+def test_segments_are_hashed_in_order_as_written(monkeypatch):
+    file_name = os.path.join(SCRATCH_DIR, 'segments')
+    data = DATA[:30000]
+    with open(file_name, 'wb') as f:
+        f.truncate(len(data))
+    progress = _SegmentProgress(None, file_name, len(data), 10000,
+                                hashlib.sha1)
+
+    reads = []
+    real_open = open
+
+    def recording_open(name, mode='r', *args):
+        if mode == 'rb':
+            reads.append(name)
+        return real_open(name, mode, *args)
+
+    monkeypatch.setattr(download, 'open', recording_open, raising=False)
+
+    # The second segment is done before the first
+    with real_open(file_name, 'r+b') as f:
+        for offset, end in [(10000, 20000), (20000, 25000), (0, 5000),
+                            (5000, 10000), (25000, 30000)]:
+            f.seek(offset)
+            f.write(data[offset:end])
+            f.flush()
+            progress.add(offset, data[offset:end])
+
+    assert progress.hexdigest() == hashlib.sha1(data).hexdigest()
+    # Only what the two segments wrote ahead was read back, once each
+    assert len(reads) == 2
@@ -0,0 +1,106 @@
+from .common_fixtures import *  # NOQA
+import pytest
+
+from cattle import type_manager
+from cattle.agent.handler import BaseHandler, KindBasedMixin
+from cattle.plugins.core.event_router import Router
+from cattle.utils import JsonObject
+
+
+class FakeDriver(KindBasedMixin, BaseHandler):
+    def __init__(self, kind):
+        KindBasedMixin.__init__(self, kind=kind)
+        BaseHandler.__init__(self)
+        self.calls = 0
+
+    def _get_handler_category(self, req):
+        return 'compute'
+
+    def instance_activate(self, req=None, instanceHostMap=None, **kw):
+        self.calls += 1
+        return self.kind
+
+    def _do_instance_activate(self):
+        pass
+
+
+class FakeHook(object):
+    def __init__(self, name, result=None):
+        self.name = name
+        self.result = result
+        self.calls = 0
+
+    def events(self):
+        return [self.name]
+
+    def execute(self, req):
+        self.calls += 1
+        return self.result
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(type_manager, 'TYPES', {})
+
+
+def _activate(kind, suffix=''):
+    return JsonObject({
+        'name': 'compute.instance.activate' + suffix,
+        'data': {
+            'instanceHostMap': {
+                'host': {'kind': kind},
+            },
+        },
+    })
+
+
+def test_route_by_kind(registry):
+    docker = FakeDriver('docker')
+    sim = FakeDriver('sim')
+    type_manager.register_type(type_manager.COMPUTE_DRIVER, docker)
+    type_manager.register_type(type_manager.COMPUTE_DRIVER, sim)
+
+    router = Router()
+    assert router.route(_activate('sim')) == 'sim'
+    assert router.route(_activate('docker', ';agent=3')) == 'docker'
+    assert router.route(_activate('other')) is None
+    assert docker.calls == 1
+    assert sim.calls == 1
+
+
+def test_route_does_not_grow_registry(registry):
+    type_manager.register_type(type_manager.COMPUTE_DRIVER,
+                               FakeDriver('docker'))
+    router = Router()
+    for i in range(3):
+        router.route(_activate('docker'))
+
+    assert len(type_manager.get_type_list(type_manager.COMPUTE_DRIVER)) == 1
+    assert type_manager.get_type_list(type_manager.REQUEST_HANDLER) == []
+
+
+def test_pre_and_post_handlers(registry):
+    pre = FakeHook('compute.instance.activate')
+    post = FakeHook('ping', result='pong')
+    type_manager.register_type(type_manager.PRE_REQUEST_HANDLER, pre)
+    type_manager.register_type(type_manager.POST_REQUEST_HANDLER, post)
+    type_manager.register_type(type_manager.COMPUTE_DRIVER,
+                               FakeDriver('docker'))
+
+    router = Router()
+    assert router.route(_activate('docker')) == 'docker'
+    assert pre.calls == 1
+    assert post.calls == 0
+
+    assert router.route(JsonObject({'name': 'ping', 'data': {}})) == 'pong'
+    assert pre.calls == 1
+    assert post.calls == 1
+
+
+def test_table_rebuilt_on_register(registry):
+    router = Router()
+    assert router.route(_activate('docker')) is None
+
+    type_manager.register_type(type_manager.COMPUTE_DRIVER,
+                               FakeDriver('docker'))
+    assert router.route(_activate('docker')) == 'docker'
@@ -0,0 +1,105 @@
+from .common_fixtures import *  # NOQA
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.host_info.cpu import CpuCollector
+from cattle.plugins.host_info.disk import DiskCollector
+from cattle.plugins.host_info.facts import HostFacts
+from cattle.plugins.host_info.os_c import OSCollector
+from cattle.plugins.host_info.snapshot import HostSnapshot
+
+
+class FakeDocker(object):
+    def __init__(self):
+        self.calls = {'info': 0, 'version': 0}
+        self.driver_status = [['Data Space Used', '1 GB']]
+
+    def info(self):
+        self.calls['info'] += 1
+        return {'Driver': 'overlay', 'OperatingSystem': 'Boot2Docker',
+                'DriverStatus': self.driver_status}
+
+    def version(self):
+        self.calls['version'] += 1
+        return {'Version': '1.9.1', 'GitCommit': 'a34a1d5'}
+
+
+class FakeCadvisor(object):
+    def get_containers(self):
+        return None
+
+    def get_machine_stats(self):
+        return {}
+
+
+def _collect(collectors, client):
+    snapshot = HostSnapshot(FakeCadvisor(), client)
+    return dict((c.key_name(), c.get_data(snapshot)) for c in collectors)
+
+
+def test_docker_facts_read_once(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'HOST_SAMPLER', 'false')
+    client = FakeDocker()
+    facts = HostFacts()
+    collectors = [OSCollector(client, facts), DiskCollector(client, facts)]
+
+    data = _collect(collectors, client)
+    assert data['osInfo']['operatingSystem'] == 'Boot2Docker'
+    assert data['osInfo']['dockerVersion'] == \
+        'Docker version 1.9.1, build a34a1d5'
+    assert data['diskInfo']['dockerStorageDriver'] == 'overlay'
+    assert client.calls == {'info': 1, 'version': 1}
+
+    # Only the driver status, which changes, is read again
+    client.driver_status = [['Data Space Used', '2 GB']]
+    data = _collect(collectors, client)
+    assert data['diskInfo']['dockerStorageDriverStatus'] == \
+        {'Data Space Used': '2 GB'}
+    assert client.calls == {'info': 2, 'version': 1}
+
+
+def test_cpu_info_read_once(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'HOST_SAMPLER', 'false')
+    reads = []
+
+    def cpuinfo(self):
+        reads.append(1)
+        return ['model name\t: Intel(R) Core(TM) i7 CPU @ 1.70GHz\n']
+
+    monkeypatch.setattr(CpuCollector, '_get_cpuinfo_data', cpuinfo)
+    collector = CpuCollector(HostFacts())
+
+    for i in range(3):
+        data = _collect([collector], None)['cpuInfo']
+        assert data['modelName'] == 'Intel(R) Core(TM) i7 CPU @ 1.70GHz'
+        assert data['count'] == 1
+    assert len(reads) == 1
+
+
+def test_daemon_restart_drops_docker_facts():
+    facts = HostFacts()
+    facts.get('cpuInfo', lambda: 'cpu')
+    facts.get('dockerVersion', lambda: 'old')
+
+    # The event stream drops when the daemon goes away
+    facts.reset()
+    assert facts.get('dockerVersion', lambda: 'new') == 'new'
+    assert facts.get('cpuInfo', lambda: 'other') == 'cpu'
+
+    facts.on_event(None, {'Type': 'daemon', 'Action': 'reload'})
+    assert facts.get('dockerVersion', lambda: 'newer') == 'newer'
+
+    facts.on_event(None, {'Type': 'container', 'Action': 'start'})
+    assert facts.get('dockerVersion', lambda: 'other') == 'newer'
+
+    facts.refresh()
+    assert facts.get('cpuInfo', lambda: 'other') == 'other'
+
+
+def test_fact_dropped_while_fetched_is_not_kept():
+    facts = HostFacts()
+
+    def fetch():
+        facts.reset()
+        return 'stale'
+
+    assert facts.get('dockerVersion', fetch) == 'stale'
+    assert facts.get('dockerVersion', lambda: 'fresh') == 'fresh'
@@ -0,0 +1,94 @@
+from .common_fixtures import *  # NOQA
+import time
+from threading import Event
+
+from cattle import CONFIG_OVERRIDE
+from cattle.plugins.host_info.main import HostInfo
+from cattle.plugins.host_info.snapshot import HostSnapshot
+
+
+class FakeCadvisor(object):
+    def __init__(self):
+        self.calls = 0
+
+    def get_containers(self):
+        self.calls += 1
+        time.sleep(0.05)
+        return {'stats': [{'n': 1}, {'n': 2}]}
+
+
+class StatsCollector(object):
+    def __init__(self, name):
+        self.name = name
+
+    def key_name(self):
+        return self.name
+
+    def get_data(self, snapshot=None):
+        return {'latest': snapshot.cadvisor_latest_stat()}
+
+
+class SlowCollector(object):
+    def __init__(self):
+        self.release = Event()
+        self.value = 0
+
+    def key_name(self):
+        return 'slow'
+
+    def get_data(self, snapshot=None):
+        self.release.wait(5)
+        self.release.clear()
+        self.value += 1
+        return {'value': self.value}
+
+
+class FailingCollector(object):
+    def key_name(self):
+        return 'failing'
+
+    def get_data(self, snapshot=None):
+        raise ValueError()
+
+
+def _host_info(*collectors):
+    host_info = HostInfo()
+    host_info.cadvisor = FakeCadvisor()
+    host_info.collectors = list(collectors)
+    return host_info
+
+
+def test_collectors_share_snapshot():
+    host_info = _host_info(StatsCollector('a'), StatsCollector('b'),
+                           StatsCollector('c'))
+    data = host_info.collect_data()
+    assert data == dict((k, {'latest': {'n': 2}}) for k in 'abc')
+    assert host_info.cadvisor.calls == 1
+
+
+def test_slow_collector_reports_last_value(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'HOST_STATS_TIMEOUT', '0.2')
+    slow = SlowCollector()
+    host_info = _host_info(slow, StatsCollector('fast'), FailingCollector())
+
+    slow.release.set()
+    data = host_info.collect_data()
+    assert data['slow'] == {'value': 1}
+    assert data['failing'] == {}
+
+    start = time.time()
+    data = host_info.collect_data()
+    assert time.time() - start < 1
+    assert data['slow'] == {'value': 1}
+    assert data['fast'] == {'latest': {'n': 2}}
+
+    # The late result is picked up without starting another collection
+    slow.release.set()
+    time.sleep(0.05)
+    assert host_info.collect_data()['slow'] == {'value': 2}
+
+
+def test_snapshot_without_docker():
+    snapshot = HostSnapshot(FakeCadvisor())
+    assert snapshot.docker_info() == {}
+    assert snapshot.cadvisor_stats() is snapshot.cadvisor_stats()
@@ -4,6 +4,7 @@ import tests
 import platform
 import json
 
+from cattle import CONFIG_OVERRIDE
 from cattle.plugins.host_info.main import HostInfo
 from cattle.plugins.host_info.cpu import CpuCollector
 from cattle.plugins.host_info.memory import MemoryCollector
@@ -17,6 +18,12 @@ from .docker_common import *  # NOQA
 TEST_DIR = os.path.join(os.path.dirname(tests.__file__))
 
 
+@pytest.fixture(autouse=True)
+def no_sampler(monkeypatch):
+    # CPU percentages come from the mocked cAdvisor stats
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'HOST_SAMPLER', 'false')
+
+
 def cpuinfo_data():
     with open(os.path.join(TEST_DIR, 'host_info/cpuinfo')) as mf:
         return mf.readlines()
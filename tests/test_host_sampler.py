@@ -0,0 +1,144 @@
+from .common_fixtures import *  # NOQA
+import os
+import pytest
+
+from cattle.plugins.host_info import cpu, memory
+from cattle.plugins.host_info.sampler import HostSampler, RingBuffer
+
+STAT = '''cpu  {0} 0 {1} {2} {3} 0 0 0 0 0
+cpu0 {0} 0 0 {2} {3} 0 0 0 0 0
+cpu1 0 0 {1} {2} 0 0 0 0 0 0
+intr 1 2 3
+'''
+
+MEMINFO = '''MemTotal:        2048000 kB
+MemFree:         1024000 kB
+MemAvailable:    1536000 kB
+Buffers:           10240 kB
+Cached:           102400 kB
+SwapTotal:             0 kB
+SwapFree:              0 kB
+'''
+
+DISKSTATS = '''   8       0 sda 1 0 {0} 0 1 0 {1} 0 0 0 0
+   8       1 sda1 1 0 {0} 0 1 0 {1} 0 0 0 0
+   7       0 loop0 1 0 {0} 0 1 0 {1} 0 0 0 0
+'''
+
+NET_DEV = '''Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes
+    lo: {0} 1 0 0 0 0 0 0 {0} 1 0 0 0 0 0 0
+  eth0: {0} 1 0 0 0 0 0 0 {1} 1 0 0 0 0 0 0
+'''
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture()
+def host(tmpdir):
+    root = str(tmpdir)
+    proc = os.path.join(root, 'proc')
+    os.makedirs(os.path.join(proc, 'net'))
+    for disk in ['sda', 'loop0']:
+        os.makedirs(os.path.join(root, 'sys', 'block', disk))
+    _write(os.path.join(proc, 'meminfo'), MEMINFO)
+    _write(os.path.join(proc, 'loadavg'), '0.50 0.25 0.10 1/100 42\n')
+
+    def counters(user, system, idle, iowait, sectors, net):
+        _write(os.path.join(proc, 'stat'),
+               STAT.format(user, system, idle, iowait))
+        _write(os.path.join(proc, 'diskstats'),
+               DISKSTATS.format(sectors, sectors * 2))
+        _write(os.path.join(proc, 'net', 'dev'),
+               NET_DEV.format(net, net * 3))
+
+    return proc, counters
+
+
+def test_ring_buffer_overwrites_oldest():
+    buf = RingBuffer(3, 2)
+    assert buf.latest() is None
+    assert buf.rows() == []
+
+    for i in range(5):
+        buf.append([i, i * 10])
+
+    assert len(buf) == 3
+    assert buf.latest() == [4.0, 40.0]
+    assert buf.rows() == [[2.0, 20.0], [3.0, 30.0], [4.0, 40.0]]
+    assert buf.rows(2) == [[3.0, 30.0], [4.0, 40.0]]
+
+
+def test_rates_from_consecutive_samples(host):
+    proc, counters = host
+    sampler = HostSampler(proc=proc, size=10)
+
+    counters(0, 0, 0, 0, 0, 0)
+    sampler.sample(now=100)
+    assert sampler.latest() is None
+
+    # Idle and iowait time is not busy
+    counters(100, 50, 100, 50, 10, 1000)
+    sampler.sample(now=102)
+
+    latest = sampler.latest()
+    assert latest['time'] == 102
+    assert latest['cpuCoresPercentages'] == [40.0, 33.333]
+    assert latest['memory']['memTotal'] == 2000
+    assert latest['memory']['memAvailable'] == 1500
+    # Not in this meminfo
+    assert latest['memory']['swapCached'] is None
+    assert latest['loadAvg'] == [0.5, 0.25, 0.1]
+    # Only whole disks count, partitions and loop devices do not
+    assert latest['diskBytesPerSecond'] == {'read': 10 * 512 / 2,
+                                            'write': 20 * 512 / 2}
+    # Loopback traffic is left out
+    assert latest['networkBytesPerSecond'] == {'rx': 500, 'tx': 1500}
+
+
+def test_collectors_read_latest_sample(host, monkeypatch):
+    proc, counters = host
+    sampler = HostSampler(proc=proc, size=10)
+    monkeypatch.setattr(memory, 'get_sampler', lambda: sampler)
+    monkeypatch.setattr(cpu, 'get_sampler', lambda: sampler)
+    collector = memory.MemoryCollector()
+    monkeypatch.setattr(collector, '_get_meminfo_data', lambda: [])
+
+    counters(0, 0, 0, 0, 0, 0)
+    sampler.sample(now=100)
+    counters(100, 50, 100, 50, 10, 1000)
+    sampler.sample(now=102)
+
+    data = collector.get_data()
+    assert sorted(data.keys()) == sorted(collector.key_map.values())
+    assert data['memTotal'] == 2000
+    assert data['cached'] == 100
+
+    load = cpu.CpuCollector()._get_load_average()
+    assert load == {'loadAvg': [0.5, 0.25, 0.1]}
+
+
+def test_query_downsamples(host):
+    proc, counters = host
+    sampler = HostSampler(proc=proc, size=4)
+
+    for i in range(7):
+        counters(i * i * 10, 0, i * 100, 0, 0, 0)
+        sampler.sample(now=i)
+
+    # The first sample only has no rates, the buffer keeps the last four
+    assert [t for t, _ in sampler.query('cpu')] == [3, 4, 5, 6]
+    assert [t for t, _ in sampler.query('cpu', seconds=2)] == [5, 6]
+
+    points = sampler.query('disk', points=2)
+    assert [t for t, _ in points] == [4, 6]
+    assert points[0][1] == [0.0, 0.0]
+
+    assert HostSampler(proc=proc).query('cpu') == []
+
+    history = sampler.history(2)
+    assert sorted(history.keys()) == sorted(HostSampler.SERIES)
+    assert history['disk'] == points
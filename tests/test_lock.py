@@ -0,0 +1,149 @@
+from .common_fixtures import *  # NOQA
+import os
+import portalocker
+import pytest
+import time
+from threading import Event, Thread
+
+from cattle import CONFIG_OVERRIDE
+from cattle import lock as lock_module
+from cattle.lock import lock, LockManager, FailedToLock, lock_summary
+
+
+@pytest.fixture
+def lock_dir(monkeypatch):
+    lock_dir = os.path.join(SCRATCH_DIR, 'locks-test')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_DIR', lock_dir)
+    return lock_dir
+
+
+def test_thread_mode_uses_no_files(lock_dir, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'AGENT_MULTI', 'thread')
+    with lock('thread-only'):
+        with pytest.raises(FailedToLock):
+            with lock('thread-only'):
+                pass
+    assert not os.path.exists(os.path.join(lock_dir, 'thread-only'))
+
+
+def test_proc_mode_removes_lock_file(lock_dir, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'AGENT_MULTI', 'proc')
+    with lock({'type': 'instance', 'id': 1}):
+        assert os.path.exists(os.path.join(lock_dir, 'instance-1'))
+    assert not os.path.exists(os.path.join(lock_dir, 'instance-1'))
+    with lock({'type': 'instance', 'id': 1}, timeout=1):
+        pass
+
+
+def test_waiter_on_removed_lock_file_starts_over(lock_dir, monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'AGENT_MULTI', 'proc')
+    path = os.path.join(lock_dir, 'instance-2')
+    locked = []
+    real_lock = portalocker.Lock
+
+    def recording_lock(file_name, *args, **kw):
+        file_lock = real_lock(file_name, *args, **kw)
+        acquire = file_lock.acquire
+
+        def acquire_after_removal(*args, **kw):
+            fh = acquire(*args, **kw)
+            locked.append(os.fstat(fh.fileno()).st_ino)
+            if len(locked) == 1:
+                # Another process held this file and removed it meanwhile
+                os.remove(path)
+                open(path, 'a').close()
+            return fh
+
+        file_lock.acquire = acquire_after_removal
+        return file_lock
+
+    monkeypatch.setattr(portalocker, 'Lock', recording_lock)
+    with lock({'type': 'instance', 'id': 2}, timeout=1) as fh:
+        assert len(locked) == 2
+        assert locked[0] != locked[1]
+        assert os.fstat(fh.fileno()).st_ino == os.stat(path).st_ino
+
+
+def test_waiters_get_lock_in_order():
+    locks = LockManager()
+    locks.acquire('key')
+    order = []
+    waiting = []
+
+    def wait(i):
+        waiting.append(i)
+        locks.acquire('key', timeout=5)
+        order.append(i)
+        locks.release('key')
+
+    threads = []
+    for i in range(5):
+        t = Thread(target=wait, args=(i,))
+        t.start()
+        threads.append(t)
+        while len(waiting) <= i:
+            time.sleep(0.001)
+        time.sleep(0.01)
+
+    locks.release('key')
+    for t in threads:
+        t.join(5)
+
+    assert order == range(5)
+    assert not locks.held('key')
+
+    stats = locks.stats()['key']
+    assert stats['acquired'] == 6
+    assert stats['contended'] == 5
+    assert stats['maxWaitTime'] > 0
+
+
+def test_wait_times_out():
+    locks = LockManager()
+    locks.acquire('key')
+    start = time.time()
+    with pytest.raises(FailedToLock):
+        locks.acquire('key', timeout=0.1)
+    assert time.time() - start >= 0.1
+
+    released = Event()
+
+    def release():
+        time.sleep(0.05)
+        locks.release('key')
+        released.set()
+
+    Thread(target=release).start()
+    locks.acquire('key', timeout=5)
+    assert released.wait(5)
+    locks.release('key')
+
+    stats = locks.stats()['key']
+    assert stats['failed'] == 1
+    assert stats['acquired'] == 2
+    assert stats['holdTime'] >= 0.05
+
+
+def test_table_is_per_process(monkeypatch):
+    locks = LockManager()
+    locks.acquire('key')
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    locks.acquire('key')
+    assert locks.held('key')
+
+
+def test_lock_summary(monkeypatch):
+    locks = LockManager()
+    monkeypatch.setattr(lock_module, '_MANAGER', locks)
+    locks.acquire('a')
+    with pytest.raises(FailedToLock):
+        locks.acquire('a')
+    locks.release('a')
+    locks.acquire('b')
+    locks.release('b')
+
+    summary = lock_summary()
+    assert summary['names'] == 2
+    assert summary['acquired'] == 2
+    assert summary['failed'] == 1
+    assert summary['maxWaitName'] is None
@@ -0,0 +1,65 @@
+from .common_fixtures import *  # NOQA
+import json
+import os
+import pytest
+
+from cattle.plugins.core import marshaller
+from cattle.plugins.core.marshaller import Marshaller
+from cattle.utils import JsonObject
+
+
+def _fixture(name):
+    with open(os.path.join(TEST_DIR, 'docker', name)) as f:
+        return f.read()
+
+
+def test_stdlib_backend():
+    m = Marshaller('json')
+    assert m.decoder == 'json'
+    assert m.encoder == 'json'
+
+    obj = m.from_string('{"data": {"items": [1, 2.5, "x"]}}')
+    assert isinstance(obj, JsonObject)
+    assert obj.data['items'] == [1, 2.5, 'x']
+
+
+def test_unknown_backend_uses_json():
+    m = Marshaller('fastest')
+    assert m.decoder == 'json'
+    assert m.encoder == 'json'
+
+
+def test_decode_only_backend(monkeypatch):
+    def fake():
+        return lambda s: {'fake': True}, None
+
+    def missing():
+        raise ImportError()
+
+    monkeypatch.setattr(marshaller, 'BACKENDS', [
+        ('missing', missing),
+        ('fake', fake),
+        ('json', marshaller._json),
+    ])
+
+    m = Marshaller('auto')
+    assert m.decoder == 'fake'
+    assert m.encoder == 'json'
+    assert m.from_string('{}') == {'fake': True}
+
+    m = Marshaller('missing')
+    assert m.decoder == 'json'
+
+
+@pytest.mark.parametrize('backend', ['ujson', 'simplejson'])
+def test_output_matches_json(backend):
+    pytest.importorskip(backend)
+    m = Marshaller(backend)
+    assert m.decoder == backend
+
+    for name in ['ping_resp', 'instance_activate_links_resp',
+                 'instance_inspect_resp']:
+        string = _fixture(name)
+        obj = m.from_string(string)
+        assert obj == json.loads(string)
+        assert m.to_string(obj) == json.dumps(obj)
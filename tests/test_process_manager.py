@@ -0,0 +1,218 @@
+from .common_fixtures import *  # NOQA
+import errno
+import json
+import os
+import pytest
+import time
+
+from cattle import CONFIG_OVERRIDE
+from subprocess import Popen
+from cattle.process_manager import ProcessManager, _Child, _orphans, _wrap
+from cattle.process_manager import prctl, PR_SET_CHILD_SUBREAPER
+
+
+@pytest.fixture(scope='module', autouse=True)
+def subreaper(request):
+    # Like the agent, so what dead children leave is reaped with their group
+    prctl(PR_SET_CHILD_SUBREAPER, 1)
+    request.addfinalizer(lambda: prctl(PR_SET_CHILD_SUBREAPER, 0))
+
+
+def _wait_for(func, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if func():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_exit_is_noticed_right_away(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_RESTART_BACKOFF', '0')
+    manager = ProcessManager()
+    manager.background(['sleep', '0.2'])
+    child = manager.children[0]
+    first = child.process
+
+    assert _wait_for(lambda: first.returncode is not None)
+    exited = time.time()
+    assert _wait_for(lambda: child.process is not first)
+    assert time.time() - exited < 0.1
+
+    stats = manager.stats()[0]
+    assert stats['name'] == 'sleep'
+    assert stats['restarts'] >= 1
+    assert stats['lastExitCode'] == 0
+
+
+def test_crash_loop_backs_off(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_RESTART_BACKOFF', '1')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_MAX_RESTART_BACKOFF', '8')
+    child = _Child('crash', None)
+    assert [child.restart_delay(0) for i in range(5)] == [1, 2, 4, 8, 8]
+
+    # A child that stayed up long enough is restarted right away
+    assert child.restart_delay(10) == 0
+    assert child.restart_delay(0) == 1
+
+
+def test_running_child_uptime(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_RESTART_BACKOFF', '3600')
+    manager = ProcessManager()
+    manager.background(['sleep', '10'])
+    child = manager.children[0]
+    try:
+        stats = manager.stats()[0]
+        assert stats['running']
+        assert stats['pid'] == child.process.pid
+        assert stats['restarts'] == 0
+        assert stats['uptime'] >= 0
+    finally:
+        child.process.kill()
+        # Not restarted before the test run is over
+        assert _wait_for(lambda: child.failures == 1)
+
+
+def _gone(pid):
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            return f.read().split(') ')[1][0] == 'Z'
+    except IOError:
+        return True
+
+
+def test_group_of_dead_child_is_killed(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_RESTART_BACKOFF', '3600')
+    pid_file = os.path.join(SCRATCH_DIR, 'orphan.pid')
+    if os.path.exists(pid_file):
+        os.remove(pid_file)
+
+    manager = ProcessManager()
+    manager.background(['sh', '-c',
+                        'sleep 30 & echo $! > {0}; sleep 0.2'.format(
+                            pid_file)])
+    child = manager.children[0]
+    assert _wait_for(
+        lambda: os.getpgid(child.process.pid) == child.process.pid)
+
+    assert _wait_for(lambda: os.path.exists(pid_file) and
+                     os.path.getsize(pid_file) > 0)
+    with open(pid_file) as f:
+        orphan = int(f.read())
+    assert not _gone(orphan)
+
+    assert _wait_for(lambda: child.failures == 1)
+    assert _wait_for(lambda: _gone(orphan))
+
+
+def _stats_in_fork(manager):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, json.dumps(manager.stats()))
+        os._exit(0)
+
+    os.close(write)
+    data = ''
+    while True:
+        chunk = os.read(read, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read)
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def test_forked_worker_sees_supervisor_stats(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_RESTART_BACKOFF', '3600')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'PROCESS_STATS_FILE',
+                        os.path.join(SCRATCH_DIR, 'process-stats'))
+
+    def setpgid(pid, pgrp):
+        # Leave the group of the test run alone, no group guard
+        raise OSError(errno.EPERM, 'Not the agent')
+
+    monkeypatch.setattr(os, 'setpgid', setpgid)
+    manager = ProcessManager()
+    manager.init()
+    assert _stats_in_fork(manager) == []
+
+    manager.background(['sleep', '10'])
+    child = manager.children[0]
+    stats = _stats_in_fork(manager)[0]
+    assert stats['running']
+    assert stats['pid'] == child.process.pid
+
+    # Exits after the worker was forked are seen too
+    child.process.kill()
+    assert _wait_for(lambda: child.last_exit is not None)
+    stats = _stats_in_fork(manager)[0]
+    assert not stats['running']
+    assert stats['pid'] is None
+    assert stats['lastExitCode'] == -9
+
+
+def test_exited_orphans_are_found():
+    pid = os.fork()
+    if pid == 0:
+        # Like a process left by a child in its own group
+        os.setpgid(0, 0)
+        os._exit(0)
+
+    assert _wait_for(lambda: pid in _orphans(os.getpid(), set()))
+    assert pid not in _orphans(os.getpid(), set([pid]))
+    os.waitpid(pid, 0)
+    assert pid not in _orphans(os.getpid(), set())
+
+
+def test_child_is_killed_when_agent_dies():
+    pid_file = os.path.join(SCRATCH_DIR, 'stubborn.pid')
+    if os.path.exists(pid_file):
+        os.remove(pid_file)
+
+    command = _wrap(0, ['sh', '-c', 'trap "" TERM; echo $$ > {0}; '
+                                    'exec sleep 30'.format(pid_file)])
+    agent = os.fork()
+    if agent == 0:
+        command[2] = str(os.getpid())
+        Popen(command)
+        _wait_for(lambda: os.path.exists(pid_file) and
+                  os.path.getsize(pid_file) > 0)
+        os._exit(0)
+
+    os.waitpid(agent, 0)
+    with open(pid_file) as f:
+        stubborn = int(f.read())
+
+    # SIGTERM is ignored, SIGKILL follows after GROUP_KILL_TIMEOUT
+    assert not _gone(stubborn)
+    assert _wait_for(lambda: _gone(stubborn), timeout=10)
+
+
+def test_wrapper_exits_like_command():
+    assert Popen(_wrap(os.getpid(), ['sh', '-c', 'exit 3'])).wait() == 3
+    assert Popen(_wrap(os.getpid(), ['sh', '-c', 'kill $$'])).wait() == -15
+
+
+def test_agent_group_is_killed_when_agent_dies():
+    pid_file = os.path.join(SCRATCH_DIR, 'grouped.pid')
+    if os.path.exists(pid_file):
+        os.remove(pid_file)
+
+    agent = os.fork()
+    if agent == 0:
+        os.setpgid(0, 0)
+        Popen(_wrap(os.getpid(), []))
+        # Like a helper the agent started with popen
+        Popen(['sh', '-c', 'echo $$ > {0}; exec sleep 30'.format(pid_file)])
+        _wait_for(lambda: os.path.exists(pid_file) and
+                  os.path.getsize(pid_file) > 0)
+        os._exit(0)
+
+    os.waitpid(agent, 0)
+    with open(pid_file) as f:
+        grouped = int(f.read())
+
+    assert _wait_for(lambda: _gone(grouped))
@@ -0,0 +1,77 @@
+from .common_fixtures import *  # NOQA
+import pytest
+import time
+
+from cattle import progress
+from cattle.progress import EventProgress
+from cattle.utils import JsonObject
+
+
+class FakePublisher(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, resp):
+        self.published.append(resp['transitioningMessage'])
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    publisher = FakePublisher()
+    monkeypatch.setattr(progress, 'get_type', lambda name: publisher)
+    return publisher
+
+
+def _req(id='req1'):
+    return JsonObject({
+        'id': id,
+        'name': 'storage.image.activate',
+        'replyTo': 'reply.1',
+        'resourceType': 'image',
+        'resourceId': '1',
+    })
+
+
+def _wait_for(func, timeout=5):
+    deadline = time.time() + timeout
+    while not func() and time.time() < deadline:
+        time.sleep(0.01)
+    return func()
+
+
+def test_updates_are_coalesced(publisher):
+    req = _req()
+    p = EventProgress(req, interval=60)
+    p.update('first')
+    assert _wait_for(lambda: publisher.published == ['first'])
+
+    for i in range(100):
+        p.update('status %d' % i)
+    time.sleep(0.05)
+    assert publisher.published == ['first']
+
+    progress.flush(req)
+    assert publisher.published == ['first', 'status 99']
+
+    progress.flush(req)
+    assert publisher.published == ['first', 'status 99']
+
+
+def test_latest_update_sent_after_interval(publisher):
+    p = EventProgress(_req(), interval=0.05)
+    p.update('first')
+    assert _wait_for(lambda: publisher.published == ['first'])
+
+    p.update('second')
+    p.update('third')
+    assert _wait_for(lambda: publisher.published == ['first', 'third'])
+
+
+def test_flush_by_parent_request(publisher):
+    parent = _req('parent')
+    p = EventProgress(_req('child'), parent=parent, interval=60)
+    p.update('first')
+    p.update('failed')
+
+    progress.flush(parent)
+    assert publisher.published[-1] == 'failed'
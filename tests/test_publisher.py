@@ -0,0 +1,125 @@
+from .common_fixtures import *  # NOQA
+import json
+import pytest
+import requests
+from threading import Event
+
+from cattle.plugins.core import publisher
+from cattle.plugins.core.publisher import Publisher, PublishError
+from cattle.utils import JsonObject
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+class FakeSession(object):
+    posted = []
+    failures = []
+    gate = None
+
+    def post(self, url, data=None, auth=None, timeout=None):
+        if FakeSession.gate is not None:
+            FakeSession.gate.wait()
+        if FakeSession.failures:
+            failure = FakeSession.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return FakeResponse(failure)
+        FakeSession.posted.append(data)
+        return FakeResponse(201)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(publisher.requests, 'Session', FakeSession)
+    FakeSession.posted = []
+    FakeSession.failures = []
+    FakeSession.gate = None
+    return FakeSession
+
+
+def _async(senders=2, retries=2):
+    p = Publisher('http://localhost/publish', None, mode='sync')
+    p._outbox = publisher.Outbox(p.url, None, depth=10, senders=senders,
+                                 retries=retries, backoff=0.001,
+                                 max_backoff=0.001)
+    return p
+
+
+def _reply(event_id, msg):
+    return JsonObject({
+        'id': msg,
+        'name': 'reply',
+        'previousIds': [event_id],
+    })
+
+
+def test_sync_publish(session):
+    p = Publisher('http://localhost/publish', None, mode='sync')
+    future = p.publish(_reply('1', 'a'))
+    assert future.done()
+    assert len(session.posted) == 1
+    assert p.flush(0)
+
+    session.failures = [500]
+    future = p.publish(_reply('2', 'b'))
+    assert future.done()
+    with pytest.raises(PublishError):
+        future.result()
+
+
+def test_async_publish(session):
+    p = _async()
+    futures = [p.publish(_reply(str(i), 'm%d' % i)) for i in range(5)]
+    for future in futures:
+        assert future.result(5) >= 0
+
+    assert len(session.posted) == 5
+    stats = p.stats()
+    assert stats['sent'] == 5
+    assert stats['depth'] == 0
+
+
+def test_replies_to_one_event_stay_ordered(session):
+    p = _async(senders=4)
+    for i in range(20):
+        p.publish(_reply('event', 'm%d' % i))
+
+    assert p.flush(5)
+    assert [JsonObject(json.loads(line)).id for line in session.posted] == \
+        ['m%d' % i for i in range(20)]
+
+
+def test_retry_with_backoff(session):
+    session.failures = [503, requests.ConnectionError()]
+    p = _async()
+    assert p.publish(_reply('1', 'a')).result(5) >= 0
+    assert p.stats()['retries'] == 2
+
+    session.failures = [503, 503, 503]
+    with pytest.raises(PublishError):
+        p.publish(_reply('1', 'b')).result(5)
+    assert p.stats()['failed'] == 1
+
+
+def test_client_error_is_not_retried(session):
+    session.failures = [400]
+    p = _async()
+    with pytest.raises(PublishError):
+        p.publish(_reply('1', 'a')).result(5)
+    assert p.stats()['retries'] == 0
+
+
+def test_flush_times_out(session):
+    session.gate = Event()
+    p = _async()
+    future = p.publish(_reply('1', 'a'))
+    assert not p.flush(0.01)
+    assert not future.done()
+
+    session.gate.set()
+    assert p.flush(5)
+    assert future.done()
@@ -0,0 +1,103 @@
+from .common_fixtures import *  # NOQA
+import json
+
+from cattle import CONFIG_OVERRIDE
+from cattle.agent.event import _Deferred, _deferral_key, _give_up
+from cattle.agent.shard import ShardedQueue, shard_key
+from cattle.utils import JsonObject
+
+
+def _event(id, resource_id, instance_uuid=None):
+    event = {
+        'id': id,
+        'name': 'compute.instance.activate',
+        'resourceType': 'instanceHostMap',
+        'resourceId': resource_id,
+        'data': {},
+    }
+    if instance_uuid is not None:
+        event['data']['instanceHostMap'] = {
+            'instance': {'uuid': instance_uuid},
+        }
+    return event
+
+
+def test_shard_key():
+    assert shard_key(_event('1', '5', 'uuid1')) == 'instance:uuid1'
+    assert shard_key(_event('1', '5')) == 'instanceHostMap:5'
+    assert shard_key({
+        'data': {'volumeStoragePoolMap': {'volume': {'uuid': 'vol1'}}},
+    }) == 'volume:vol1'
+    assert shard_key({'name': 'ping', 'data': {}}) is None
+
+
+def test_same_resource_same_shard():
+    queue = ShardedQueue(8, 10)
+    lines = [json.dumps(_event(str(i), str(i), 'uuid1')) for i in range(5)]
+    shards = set(queue.shard(line) for line in lines)
+    assert len(shards) == 1
+
+    for line in lines:
+        queue.put(line)
+    shard = queue.queues[shards.pop()]
+    assert [shard.get(True, 5) for line in lines] == lines
+
+
+def test_events_without_resource_spread():
+    queue = ShardedQueue(4, 10)
+    line = json.dumps({'id': '1', 'name': 'ping', 'data': {}})
+    assert sorted(queue.shard(line) for i in range(4)) == [0, 1, 2, 3]
+
+
+def test_locked_events_wait_by_resource(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_RETRY_INTERVAL', '0')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_RETRY_TIMEOUT', '60')
+    held = set(['uuid1'])
+    ran = []
+
+    def run(req):
+        key = req['data']['instanceHostMap']['instance']['uuid']
+        if key in held:
+            return False
+        ran.append(req['id'])
+        return True
+
+    deferred = _Deferred()
+    for id, uuid in [('1', 'uuid1'), ('2', 'uuid2'), ('3', 'uuid1')]:
+        req = JsonObject(_event(id, id, uuid))
+        key = _deferral_key(req)
+        if key in deferred or not run(req):
+            deferred.add(key, req)
+
+    # The other resource ran, the later event of the locked one waits
+    assert ran == ['2']
+    assert deferred.timeout(5) == 0
+
+    deferred.retry(run, None)
+    assert ran == ['2']
+
+    held.clear()
+    deferred.retry(run, None)
+    assert ran == ['2', '1', '3']
+    assert deferred.timeout(5) == 5
+
+
+def test_locked_event_is_given_up(monkeypatch):
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_RETRY_INTERVAL', '0')
+    monkeypatch.setitem(CONFIG_OVERRIDE, 'LOCK_RETRY_TIMEOUT', '0')
+
+    published = []
+    publisher = JsonObject({'publish': published.append})
+
+    deferred = _Deferred()
+    req = JsonObject(_event('1', '1', 'uuid1'))
+    req.replyTo = 'reply.1'
+    deferred.add(_deferral_key(req), req)
+    deferred.retry(lambda req: False, lambda req: _give_up(publisher, req))
+    assert _deferral_key(req) not in deferred
+
+    assert len(published) == 1
+    assert published[0]['name'] == 'reply.1'
+    assert published[0]['previousIds'] == ['1']
+    assert published[0]['transitioning'] == 'error'
+    assert 'Lock still held' in published[0]['transitioningInternalMessage']
@@ -0,0 +1,117 @@
+from .common_fixtures import *  # NOQA
+import json
+import os
+import pytest
+import time
+
+from cattle.agent.shard import ShardedQueue
+from cattle.agent.spill import SpillJournal
+
+
+@pytest.fixture()
+def path(tmpdir):
+    return os.path.join(str(tmpdir), 'spill')
+
+
+def _journal(queue, path, max_size=1024):
+    return SpillJournal(queue, path=path, max_size=max_size)
+
+
+def _event(resource_id):
+    return json.dumps({'name': 'compute.instance.activate',
+                       'resourceType': 'instanceHostMap',
+                       'resourceId': resource_id, 'data': {}})
+
+
+def _wait(predicate):
+    deadline = time.time() + 5
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_spill_keeps_order(path):
+    queue = ShardedQueue(1, 2)
+    journal = _journal(queue, path)
+    lines = ['event%d' % i for i in range(10)]
+    for line in lines:
+        assert journal.offer(line)
+
+    _wait(lambda: journal.stats()['spilled'] == 8)
+    stats = journal.stats()
+    assert stats['queueDepth'] == 2
+    assert stats['spilledTotal'] == 8
+
+    received = [queue.queues[0].get(True, 5) for i in range(10)]
+    assert received == lines
+
+    _wait(lambda: journal.stats()['spilled'] == 0)
+    stats = journal.stats()
+    assert stats['spillBytes'] == 0
+    assert stats['drainedTotal'] == stats['spilledTotal']
+    assert os.path.getsize(path) == 0
+
+
+def test_full_shard_does_not_hold_up_others(path):
+    queue = ShardedQueue(2, 1)
+    busy = _event('1')
+    other = _event('2')
+    busy_shard = queue.shard(busy)
+    assert queue.shard(other) != busy_shard
+
+    journal = _journal(queue, path)
+    for line in [busy, busy, busy, other]:
+        assert journal.offer(line)
+
+    free = queue.queues[1 - busy_shard]
+    assert free.get(True, 5) == other
+    assert journal.stats()['spilled'] == 2
+
+    full = queue.queues[busy_shard]
+    assert [full.get(True, 5) for i in range(3)] == [busy] * 3
+
+
+def test_spill_is_bounded(path):
+    queue = ShardedQueue(1, 1)
+    journal = _journal(queue, path, max_size=20)
+    assert journal.offer('a' * 10)
+    # Room comes back once the first one is in the queue
+    deadline = time.time() + 5
+    while not journal.offer('b' * 10):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert not journal.offer('c' * 10)
+    _wait(lambda: journal.stats()['spilled'] == 1)
+
+    assert queue.queues[0].get(True, 5) == 'a' * 10
+    assert queue.queues[0].get(True, 5) == 'b' * 10
+
+
+def _timed(name, age):
+    return json.dumps({'name': name, 'time': (time.time() - age) * 1000,
+                       'timeoutMillis': 15000})
+
+
+def test_replays_events_left_by_last_run(path):
+    # The agent stopped with event1 handed over and the rest spilled
+    fresh = _timed('fresh', 1)
+    with open(path, 'wb') as f:
+        for record in ['-event1', '+event2', '+' + _timed('stale', 60),
+                       '+' + fresh, '+event4']:
+            f.write(record + '\n')
+        f.write('+cut short')
+
+    restarted = ShardedQueue(1, 1)
+    journal = _journal(restarted, path)
+    assert journal.stats()['spilled'] == 3
+
+    # Nothing is handed over yet, a crash now would not lose them
+    with open(path, 'rb') as f:
+        assert '+event4\n' in f.read()
+
+    journal.start()
+    received = [restarted.queues[0].get(True, 5) for i in range(3)]
+    assert received == ['event2', fresh, 'event4']
+
+    _wait(lambda: journal.stats()['spilled'] == 0)
+    assert os.path.getsize(path) == 0
@@ -1,5 +1,7 @@
+import copy
+import json
 import pytest
-from cattle.utils import CadvisorAPIClient
+from cattle.utils import CadvisorAPIClient, JsonObject
 
 
 @pytest.fixture
@@ -18,3 +20,71 @@ def test_cadvisor_time(cadvisor_client):
         val = cadvisor_client.timestamp_diff(time_val_key,
                                              time_vals[time_val_key])
         assert type(val) == float
+
+
+def _event():
+    return {
+        'name': 'compute.instance.activate',
+        'data': {
+            'items': [{'name': 'pyagent'}],
+            'instanceHostMap': {
+                'instance': {
+                    'nics': [{'network': {'kind': 'network'}}],
+                },
+            },
+        },
+    }
+
+
+def test_json_object_access():
+    raw = _event()
+    obj = JsonObject(raw)
+
+    assert obj.name == obj['name'] == 'compute.instance.activate'
+    nic = obj.data.instanceHostMap.instance.nics[0]
+    assert nic.network.kind == 'network'
+    assert [i.name for i in obj.data.get('items')] == ['pyagent']
+    assert obj.get('missing') is None
+    assert not hasattr(obj, 'missing')
+
+    obj.data.instanceHostMap.instance.nics.append({'network': None})
+    obj.replyTo = 'reply'
+    assert obj['replyTo'] == 'reply'
+    assert len(obj['data']['instanceHostMap']['instance']['nics']) == 2
+
+
+def test_json_object_wraps_lazily():
+    raw = _event()
+    obj = JsonObject(raw)
+
+    assert type(dict.__getitem__(obj, 'data')) is dict
+    assert obj.data is obj.data
+    assert obj['data'] is obj.data
+    assert raw['data'] is not obj.data
+
+    instance = obj['data']['instanceHostMap']['instance']
+    assert isinstance(instance, JsonObject)
+    assert instance is obj.data.instanceHostMap.instance
+    assert instance.nics[0]['network'].kind == 'network'
+
+
+def test_json_object_item_then_attribute():
+    obj = JsonObject(_event())
+
+    # Item access wraps too, whatever was read before
+    assert obj['data']['instanceHostMap'].instance.nics[0].network.kind == \
+        'network'
+    assert [i['name'] for i in obj['data']['items']] == ['pyagent']
+    assert obj.data.get('items')[0].name == 'pyagent'
+
+
+def test_json_object_unwrap_does_not_copy():
+    obj = JsonObject(_event())
+    obj.data.instanceHostMap.instance.nics[0].network
+
+    assert JsonObject.unwrap(obj) is obj
+    assert json.loads(json.dumps(JsonObject.unwrap(obj))) == _event()
+
+    clone = copy.deepcopy(obj)
+    clone.data.instanceHostMap.instance.nics[0].network.kind = 'other'
+    assert obj.data.instanceHostMap.instance.nics[0].network.kind == 'network'